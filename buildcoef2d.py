@@ -6,8 +6,27 @@
 
 import numpy as np
 import random
+import copy
+import hashlib
+import os
+import json
+import shutil
+import tempfile
+import warnings
+from scipy import ndimage
+from scipy import sparse
+from scipy.sparse import csgraph
 
 class Coefficient2d:
+    #what the coefficient is built from (the key of the cache), those changed by the build and what it builds
+    CacheParameters = ['NWorldFine', 'bg', 'val', 'length', 'thick', 'space', 'probfactor', 'right', 'down', 
+                        'diagr1', 'diagr2', 'diagl1', 'diagl2', 'LenSwitch', 'thickSwitch', 'equidistant', 
+                        'ChannelHorizontal', 'ChannelVertical', 'BoundarySpace', 'Boxes2n', 'Channels2n', 
+                        'NewShapes', 'TestExample', 'Periodic', 'Seed']
+    CacheBuildParameters = ['right', 'down', 'length', 'thick', 'space']
+    CacheArrays = ['Matrix', 'ShapeRemember', 'ShapeAnchors', 'ValueCells', 'ShapeTable', 'ShapeLabels', 'Period']
+    CacheVersion = 1
+    
     def __init__(self,NWorldFine, 
                     bg=0.01, 
                     val=1, 
@@ -31,7 +50,9 @@ class Coefficient2d:
                     Channels2n=None,
                     NewShapes=None,
                     RandomInverse=None,
-                    TestExample=None):
+                    TestExample=None,
+                    Periodic=None,
+                    Seed=None):
         
         '''
         2dCoefficient   
@@ -87,12 +108,48 @@ class Coefficient2d:
         self.ShapeIndex = [0]
         self.ShapeCoords = []
         self.CoordsIndex = [0]
+        #per shape one row [shape, length, thick, inverser, px, py] for each part
+        self.CompiledShapes = []
         
-        #valuecount
+        #valuecount and the flat indices of the inclusion cells (cell k+1 <-> ValueCells[k])
         self.valuecounter = None
+        self.ValueCells = None
+        
+        #rasterized shapes for the stamping engine
+        self.Templates = {}
+        self.Footprints = {}
+        self.ChangeCells = {}
         
         self.TestExample = TestExample
         
+        #periodic unit cell (True: detect it, [p0,p1]: declared)
+        self.Periodic = Periodic
+        self.Period = None
+        self.ShapeAnchors = None
+        
+        #instance table and label map of the shapes
+        self.ShapeTable = None
+        self.ShapeLabels = None
+        #label map of RandomMatrix (None if unknown)
+        self.RandomLabels = None
+        self.MoveFailures = None
+        #flat indices of the cells the last kernel may have changed (see Perturbed)
+        self.ChangedCells = None
+        
+        #coarse statistics of RandomMatrix (see CoarseStatistics)
+        self.Statistics = None
+        
+        #random streams of the instance (None: the global ones of random and np.random)
+        self.Seed = Seed
+        self.Random = None
+        self.Generator = None
+        self.SampleSeeds = None
+        
+        #if true the kernels return the scatters [Indices, Values] of the samples (see PerturbationStream)
+        self.SparseSamples = None
+        if Seed is not None:
+            self.SeedStreams()
+        
     def NewShape(self, ShapeBuildMatrix):
         '''
         you need to enumerate the new shapes by yourself
@@ -139,6 +196,19 @@ class Coefficient2d:
         summand = self.CoordsIndex[self.Shapes-1]
         self.CoordsIndex.append(summand + 2*NumberOfShapes)
         
+        #compile it once, the loops only look it up
+        Parts = []
+        for shape in range(0,NumberOfShapes):
+            Parts.append([int(ShapeBuildMatrix[shape][0]), int(ShapeBuildMatrix[shape][1]), int(ShapeBuildMatrix[shape][2]), 
+                            int(ShapeBuildMatrix[shape][3]), int(ShapeCoords[shape*2]), int(ShapeCoords[shape*2+1])])
+        self.CompiledShapes.append(Parts)
+        
+        #template raster and the footprints of the parts
+        self.ShapeTemplate(6+self.Shapes, 0, 0, self.space)
+        for ShapeIndex, ShapeLength, ShapeThick, ShapeInverser, px, py in Parts:
+            self.ShapeFootprint(ShapeIndex, ShapeLength, ShapeThick, ShapeInverser)
+        self.ShapeCells(self.Shapes-1)
+        
         return 0
         
         ########################### IndexSearch ###################################
@@ -171,10 +241,257 @@ class Coefficient2d:
         return px, py            
     
         
+        ########################### Streams ###################################
+    
+    def SeedStreams(self):
+        '''
+        generators of the instance for Seed, which is an integer or a path 
+        [root, child, grandchild, ...] of spawned streams. 
+        The state comes from np.random.SeedSequence, or from sha256 for old numpy versions.
+        '''
+        State = Coefficient2d.SeedState(self.Seed)
+        self.Generator = np.random.RandomState(State)
+        self.Random = random.Random(sum(int(State[k]) << 32*k for k in range(0,4)))
+    
+    @staticmethod
+    def SeedState(Seed):
+        '''
+        the 128 bit state of the stream Seed = integer or path [root, child, grandchild, ...]
+        '''
+        Path = [int(x) for x in np.atleast_1d(Seed)]
+        if hasattr(np.random, 'SeedSequence'):
+            return np.random.SeedSequence(Path[0], spawn_key=tuple(Path[1:])).generate_state(4)
+        Digest = hashlib.sha256(repr(Path).encode('ascii')).hexdigest()
+        return np.array([int(Digest[8*k:8*k+8],16) for k in range(0,4)], dtype=np.uint32)
+    
+    def Spawn(self, Sample):
+        '''
+        the coefficient with an independent child stream for sample number Sample. 
+        The arrays are shared and the stream only depends on Seed and Sample, 
+        such that samples can be drawn in any order and in any process.
+        '''
+        assert(self.Seed is not None)
+        Child = copy.copy(self)
+        Child.Seed = [int(x) for x in np.atleast_1d(self.Seed)] + [int(Sample)]
+        Child.SampleSeeds = None
+        Child.SparseSamples = None
+        Child.SeedStreams()
+        return Child
+    
+    def Stream(self):
+        '''
+        python stream for random.sample
+        '''
+        if self.Random is None:
+            return random
+        return self.Random
+    
+    def Uniform(self, Shape):
+        '''
+        uniform numbers for the kernels with one row per sample. 
+        With SampleSeeds every row comes from the child stream of its sample.
+        '''
+        if self.SampleSeeds is not None:
+            return np.array([self.Spawn(Sample).Generator.random_sample(Shape[1:]) for Sample in self.SampleSeeds])
+        if self.Generator is None:
+            return np.random.random_sample(Shape)
+        return self.Generator.random_sample(Shape)
+    
+        ########################### Templates ###################################
+
+    def ShapeTemplate(self, Shape, Len, thick, space, inv = 1):
+        '''
+        rasterizes a shape together with its space halo once and remembers it.
+        The shape is built by the pixel builders on a blank canvas, so the template 
+        behaves exactly like BuildRight, ..., BuildNewShapes. 
+        
+        returns [r0, c0, ShapeMask, HaloMask, ResetMask] where (r0, c0) is the offset 
+        of the masks with respect to the anchor (i,j) 
+        '''
+        if Shape >= 7:
+            #new shapes do not depend on Len and thick
+            Len, thick, inv = 0, 0, 1
+            
+        key = (Shape, Len, thick, space, inv)
+        if key in self.Templates:
+            return self.Templates[key]
+        
+        if Shape >= 7:
+            s = Shape - 7
+            Parts = self.CompiledShapes[s]
+            extent = 0
+            for ShapeIndex, ShapeLength, ShapeThick, ShapeInverser, px, py in Parts:
+                extent = max(extent, abs(px) + abs(py) + ShapeLength + ShapeThick)
+        else:
+            extent = Len + thick
+        extent = int(extent + 2*space + 4)
+        
+        #blank canvas with the anchor in the middle
+        Canvas = Coefficient2d(np.array([2*extent+1, 2*extent+1]))
+        c = extent
+        
+        #sentinels: 1 shape, marker halo
+        marker = 0.5
+        Masks = []
+        for start in [0, marker]:
+            A = np.zeros([2*extent+1, 2*extent+1]) + start
+            B = np.zeros([2*extent+1, 2*extent+1])
+            if Shape == 1:
+                A, B = Canvas.BuildRight(A, B, c, c, 1, marker, Len, thick, space, inv)
+            elif Shape == 2:
+                A, B = Canvas.BuildDiagr1(A, B, c, c, 1, marker, Len, thick, space, inv)
+            elif Shape == 3:
+                A, B = Canvas.BuildDiagr2(A, B, c, c, 1, marker, Len, thick, space, inv)
+            elif Shape == 4:
+                A, B = Canvas.BuildDown(A, B, c, c, 1, marker, Len, thick, space, inv)
+            elif Shape == 5:
+                A, B = Canvas.BuildDiagl1(A, B, c, c, 1, marker, Len, thick, space, inv)
+            elif Shape == 6:
+                A, B = Canvas.BuildDiagl2(A, B, c, c, 1, marker, Len, thick, space, inv)
+            else:
+                A, B = Canvas.BuildNewShapes(Parts, A, B, c, c, 1, marker, space)
+            Masks.append(A)
+        
+        ShapeMask = Masks[0] == 1
+        HaloMask = Masks[0] == marker
+        #the diagonal shapes give back one corner of the halo, 
+        #but only if it carries a halo value at that time
+        ResetMask = Masks[1] == 0
+        
+        #crop to the bounding box
+        rows, cols = np.nonzero(ShapeMask | HaloMask | ResetMask)
+        if np.size(rows) == 0:
+            rows, cols = np.array([c]), np.array([c])
+        a0, a1 = rows.min(), rows.max()+1
+        b0, b1 = cols.min(), cols.max()+1
+        Template = [a0-c, b0-c, ShapeMask[a0:a1,b0:b1].copy(), HaloMask[a0:a1,b0:b1].copy(), ResetMask[a0:a1,b0:b1].copy()]
+        
+        self.Templates[key] = Template
+        return Template
+    
+    def StampShape(self, A, B, i, j, Template, val, bg, Index=None):
+        '''
+        places a template at (i,j) with slice assignment. 
+        Same result as the corresponding Build function.
+        Index = OccupancyIndex of A that is kept up to date
+        '''
+        NWorldFine = self.NWorldFine
+        r0, c0, ShapeMask, HaloMask, ResetMask = Template
+        
+        #window of the template in the grid (halo is cut at the boundary)
+        a0 = i + r0
+        b0 = j + c0
+        a1 = a0 + np.shape(ShapeMask)[0]
+        b1 = b0 + np.shape(ShapeMask)[1]
+        ca0, cb0 = max(a0,0), max(b0,0)
+        ca1, cb1 = min(a1,NWorldFine[0]), min(b1,NWorldFine[1])
+        
+        window = (slice(ca0-a0,ca1-a0), slice(cb0-b0,cb1-b0))
+        AT = A[ca0:ca1,cb0:cb1]
+        BT = B[ca0:ca1,cb0:cb1]
+        
+        Shape = ShapeMask[window]
+        AT[Shape] = 1
+        BT[Shape] = val-bg
+        AT[HaloMask[window] & (AT != 1)] = bg
+        AT[ResetMask[window] & (AT == bg)] = 0
+        
+        if Index is not None:
+            Index.Update(ca0, ca1, cb0, cb1)
+        
+        return A, B
+    
+    def ShapeFootprint(self, Shape, Len, thick, inv = 1):
+        '''
+        the cells an Investigate function looks at, as a rectangle in the frame 
+        of the OccupancyIndex where it is one (diagonal shapes are rectangles in the 
+        sheared frames). 
+        
+        returns [frame, U0, U1, V0, V1, r0, r1, c0, c1] relative to the anchor 
+        '''
+        key = (Shape, Len, thick, inv)
+        if key in self.Footprints:
+            return self.Footprints[key]
+        
+        #the footprint is the shape itself
+        r0, c0, ShapeMask = self.ShapeTemplate(Shape, Len, thick, 0, inv)[0:3]
+        rows, cols = np.nonzero(ShapeMask)
+        rows = rows + r0
+        cols = cols + c0
+        
+        #small footprints are faster scanned cell by cell than indexed
+        Footprint = None
+        for frame in range(0,5*(np.size(rows) >= OccupancyIndex.MinArea)):
+            U, V = OccupancyIndex.Transform(frame, rows, cols, 1)
+            width = V.max()-V.min()+1
+            area = (U.max()-U.min()+1)*width
+            if area == np.size(U) and np.size(np.unique((U-U.min())*width+V-V.min())) == area:
+                Footprint = [frame, U.min(), U.max()+1, V.min(), V.max()+1, rows.min(), rows.max()+1, cols.min(), cols.max()+1]
+                break
+        
+        self.Footprints[key] = Footprint
+        return Footprint
+    
+    def ShapeCells(self, s):
+        '''
+        the cells the ValueChange and Vanish functions of the parts visit for the new shape s, as 
+        offsets to the anchor. Like ShapeTemplate they are found once by running the part functions 
+        on a blank canvas, then the randomizers change a new shape in one scatter. 
+        
+        returns [Rows, Cols, AddRows, AddCols, Died]: the visited cells, the same repeated as often 
+        as ValueChange adds to them (overlapping parts) and whether Vanish reports the shape as died
+        '''
+        if s in self.ChangeCells:
+            return self.ChangeCells[s]
+        
+        Parts = self.CompiledShapes[s]
+        extent = 0
+        for ShapeIndex, ShapeLength, ShapeThick, ShapeInverser, px, py in Parts:
+            extent = max(extent, abs(px) + abs(py) + ShapeLength + ShapeThick)
+        extent = int(extent + 4)
+        Canvas = Coefficient2d(np.array([2*extent+1, 2*extent+1]))
+        c = extent
+        
+        #every visit adds 1
+        A = np.ones([2*extent+1, 2*extent+1])
+        C = np.zeros([2*extent+1, 2*extent+1])
+        A, C = Canvas.ValueChangeNewShapes(Parts, A, C, c, c, 1, 1, None, None, None, 1, 1)
+        Rows, Cols = np.nonzero(A == 0)
+        Count = C[Rows, Cols].astype(int)
+        A, C, died = Canvas.VanishNewShapes(Parts, np.ones_like(A), np.zeros_like(C), c, c, 1, None, None, 1)
+        
+        Cells = [Rows - c, Cols - c, np.repeat(Rows, Count) - c, np.repeat(Cols, Count) - c, died == 1]
+        self.ChangeCells[s] = Cells
+        return Cells
+    
         ############### BUILD FUNCTION #################    
-    def BuildCoefficient(self):
+    def BuildCoefficient(self, Stamping=True, Indexing=True, DirectSampling=None, Cache=None):
+        '''
+        Stamping = if true the shapes are placed as precomputed templates 
+                   instead of pixel by pixel. The result is the same.
+        Indexing = if true the fit checks are rectangle sums of an OccupancyIndex 
+                   instead of cell by cell scans (needs Stamping). The result is the same.
+        DirectSampling = if true the shape is drawn from the shapes that fit at (i,j) 
+                   instead of retrying random shapes. This changes the random stream, 
+                   hence the coefficient.
+        Cache = folder of built coefficients. If the coefficient was built there before, it is 
+                   loaded (memory mapped) instead of built, see LoadCoefficient.
+        '''
+        if Cache is not None:
+            Key = self.CacheKey(DirectSampling)
+            if self.LoadCoefficient(Cache, Key):
+                return self.Matrix
+            Before = np.random.get_state()
+            B = self.BuildCoefficient(Stamping, Indexing, DirectSampling)
+            self.StoreCoefficient(Cache, Key, Before)
+            return B
+        
         #random seed
-        random.seed(20)
+        if self.Seed is None:
+            random.seed(20)
+        else:
+            self.SeedStreams()
+        Stream = self.Stream()
         
         #regain properties
         NWorldFine = self.NWorldFine 
@@ -227,6 +544,7 @@ class Coefficient2d:
             self.ShapeRememberOriginal = S
             self.Matrix = A
             self.RandomMatrix = A
+            self.RandomLabels = None
             return A
             
         if self.Boxes2n:
@@ -256,11 +574,17 @@ class Coefficient2d:
             self.ShapeRemember = S
             self.ShapeRememberOriginal = S
             self.RandomMatrix = A
+            self.RandomLabels = None
             return A
         
         
         
-        np.random.seed(0)
+        if self.Seed is None:
+            np.random.seed(0)
+        #shape remember as list, turned into an array at the end
+        S = []
+        Anchors = []
+        
         if self.probfactor > 0:
             valorbg = np.ones(self.probfactor)*bg                         #percentage
             valorbg[0] = val
@@ -325,6 +649,17 @@ class Coefficient2d:
         
         if self.TestExample:
             startj=22
+        
+        #periodic unit cell
+        if self.Periodic and equidistant and not self.TestExample:
+            Tiled = self.TileCoefficient(starti, startj)
+            if Tiled is not None:
+                return Tiled
+        
+        #occupancy index for the fit checks
+        Index = None
+        if Stamping and Indexing:
+            Index = OccupancyIndex(A)
             
         for i in range(starti,endi):
             #special for channel
@@ -334,14 +669,17 @@ class Coefficient2d:
                 #can we do something here?
                 if A[i][j] == 0:
                     #will we do something here?
-                    A[i][j] = random.sample(valorbg,1)[0]
+                    A[i][j] = Stream.sample(valorbg,1)[0]
                     if equidistant:
                         A[i][j] = 1 #yes sure
+                    if Index is not None and A[i][j] != 1 and A[i][j] != 0:
+                        #this cell is taken from now on
+                        Index.Update(i, i+1, j, j+1)
                     #if yes then
                     if A[i][j] == 1:
                         #len randomizing
-                        Len = random.sample(LenList,1)[0]
-                        thick = random.sample(thickList,1)[0]
+                        Len = Stream.sample(LenList,1)[0]
+                        thick = Stream.sample(thickList,1)[0]
                         #yes but first go back to zero
                         A[i][j] = 0
                         stop = 0 #initial for loop change
@@ -359,7 +697,8 @@ class Coefficient2d:
                                 zuf.append(s+7)
                             zuf = list(filter(lambda x: x!=0 ,zuf))
                     
-                        zuf1 = random.sample(zuf,1)[0] #chooses shape
+                        if not DirectSampling:
+                            zuf1 = Stream.sample(zuf,1)[0] #chooses shape
                         '''
                         1 : right
                         2 : right diag1 
@@ -372,26 +711,38 @@ class Coefficient2d:
                         
                         ########### investigate ##########
                         #does it fit into the grid
-                        ShapeResults = []
+                        #only shapes in zuf can be chosen
+                        ShapeResults = [0]*(6+self.Shapes)
                         
-                        ShapeResults.append(self.InvestigateRight(A, i, j, Len, thick, b, c, Channel=ChannelHorizontal))
-                        ShapeResults.append(self.InvestigateDiagr1(A, i, j, Len, thick, b, c))
-                        ShapeResults.append(self.InvestigateDiagr2(A, i, j, Len, thick, b, c))
-                        ShapeResults.append(self.InvestigateDown(A, i, j, Len, thick, b, c, Channel=ChannelVertical))
-                        ShapeResults.append(self.InvestigateDiagl1(A, i, j, Len, thick, b, c))
-                        ShapeResults.append(self.InvestigateDiagl2(A, i, j, Len, thick, b, c))
+                        if 1 in zuf:
+                            ShapeResults[0] = self.InvestigateRight(A, i, j, Len, thick, b, c, Channel=ChannelHorizontal, Index=Index)
+                        if 2 in zuf:
+                            ShapeResults[1] = self.InvestigateDiagr1(A, i, j, Len, thick, b, c, Index=Index)
+                        if 3 in zuf:
+                            ShapeResults[2] = self.InvestigateDiagr2(A, i, j, Len, thick, b, c, Index=Index)
+                        if 4 in zuf:
+                            ShapeResults[3] = self.InvestigateDown(A, i, j, Len, thick, b, c, Channel=ChannelVertical, Index=Index)
+                        if 5 in zuf:
+                            ShapeResults[4] = self.InvestigateDiagl1(A, i, j, Len, thick, b, c, Index=Index)
+                        if 6 in zuf:
+                            ShapeResults[5] = self.InvestigateDiagl2(A, i, j, Len, thick, b, c, Index=Index)
                         
                         for s in range(0,self.Shapes):
-                            #rebuildMatrix
-                            NewShapeMatrix = self.ShapeMatrixes[self.ShapeIndex[s]:self.ShapeIndex[s+1]]
-                            NewShapeMatrix = np.reshape(NewShapeMatrix,(int(self.ShapeSizes[s][0]),int(self.ShapeSizes[s][1])))
-                            ShapeCoords = self.ShapeCoords[self.CoordsIndex[s]:self.CoordsIndex[s+1]]
-                            ShapeResults.append(self.InvestigateNewShapes(NewShapeMatrix, ShapeCoords, A, i, j, b, c))
+                            #compiled shape
+                            Parts = self.CompiledShapes[s]
+                            ShapeResults[6+s] = self.InvestigateNewShapes(Parts, A, i, j, b, c, Index=Index)
                         
                     
+                        if DirectSampling:
+                            #only shapes that fit
+                            zuf = list(filter(lambda x: ShapeResults[x-1] == 1 ,zuf))
+                            if len(zuf) == 0:
+                                continue
+                            zuf1 = Stream.sample(zuf,1)[0]
+                        
                         for z in range(0,100):    #arbitrary
                             if ShapeResults[zuf1-1] == 0:
-                                zuf1 = random.sample(zuf,1)[0]
+                                zuf1 = Stream.sample(zuf,1)[0]
                                 stop = 1
                             else:
                                 stop = 0
@@ -402,9 +753,14 @@ class Coefficient2d:
                         
                         #shape remember
                         shapecounter += 1
-                        S = np.append(S,[zuf1,Len,thick])
+                        S.append([zuf1,Len,thick])
+                        Anchors.append([i,j])
                         ############################### keine if-abfragen zum crash mehr notwendig ###############
                         
+                        if Stamping:
+                            A, B = self.StampShape(A, B, i, j, self.ShapeTemplate(zuf1, Len, thick, space), val, bg, Index)
+                            continue
+                        
                         if zuf1 == 1:
                             A, B = self.BuildRight(A, B, i, j, val, bg, Len, thick, space)
                         elif zuf1 == 2:
@@ -419,35 +775,330 @@ class Coefficient2d:
                             A, B = self.BuildDiagl2(A, B, i, j, val, bg, Len, thick, space)
                         
                         for s in range(0,self.Shapes):
-                            #rebuildMatrix
+                            #compiled shape
                             if zuf1 == 7+s:
-                                NewShapeMatrix = self.ShapeMatrixes[self.ShapeIndex[s]:self.ShapeIndex[s+1]]
-                                NewShapeMatrix = np.reshape(NewShapeMatrix,(int(self.ShapeSizes[s][0]),int(self.ShapeSizes[s][1])))
-                                ShapeCoords = self.ShapeCoords[self.CoordsIndex[s]:self.CoordsIndex[s+1]]
-                                A, B = self.BuildNewShapes(NewShapeMatrix, ShapeCoords, A, B, i, j, val, bg, space)
+                                Parts = self.CompiledShapes[s]
+                                A, B = self.BuildNewShapes(Parts, A, B, i, j, val, bg, space)
                         
-        #search for all values
-        valuecounter = 0
-        for i in range(0,NWorldFine[0]):
-            for j in range(0,NWorldFine[1]):
-                if A[i][j] == 1:
-                    valuecounter += 1
-        
-        self.valuecounter = valuecounter
+        #search for all values, numbered row by row
+        self.ValueCells = np.flatnonzero(A == 1)
+        self.valuecounter = np.size(self.ValueCells)
                 
-        S = np.reshape(S,(shapecounter,3))
+        S = np.reshape(np.array(S,dtype=float),(shapecounter,3))
+        self.ShapeAnchors = np.reshape(np.array(Anchors,dtype=int),(shapecounter,2))
         #print S
         B += bg
         self.Matrix = B
         self.ShapeRemember = S
         self.ShapeRememberOriginal = S
         self.RandomMatrix = B
+        self.ShapeInstances()
         return B
         
         
+        ############### INSTANCES ################
+    def ShapeInstances(self):
+        '''
+        instance table and label map of the built shapes, in the order of ShapeRemember.
+        ShapeTable has one row [type, i, j, Len, thick, r0, r1, c0, c1] per shape, 
+        that is the anchor and the bounding box of its pixels. 
+        ShapeLabels (int32) gives the row of the shape for every fine cell and -1 for the background.
+        '''
+        NWorldFine = self.NWorldFine
+        S = self.ShapeRememberOriginal
+        Anchors = self.ShapeAnchors
+        n = np.shape(S)[0]
+        
+        Labels = -np.ones(NWorldFine, dtype=np.int32)
+        Table = np.zeros([n,9], dtype=int)
+        Table[:,0] = S[:,0]
+        Table[:,1:3] = Anchors
+        Table[:,3:5] = S[:,1:3]
+        
+        #all shapes of one kind share the template
+        Kinds = {}
+        for k, key in enumerate(map(tuple, Table[:,[0,3,4]].tolist())):
+            Kinds.setdefault(key, []).append(k)
+        
+        for key in Kinds:
+            Shape, Len, thick = key
+            Instances = np.array(Kinds[key])
+            r0, c0, ShapeMask = self.ShapeTemplate(Shape, Len, thick, self.space)[0:3]
+            rows, cols = np.nonzero(ShapeMask)
+            R = Anchors[Instances,0][:,np.newaxis] + (rows + r0)[np.newaxis,:]
+            C = Anchors[Instances,1][:,np.newaxis] + (cols + c0)[np.newaxis,:]
+            inside = (R > -1) & (R < NWorldFine[0]) & (C > -1) & (C < NWorldFine[1])
+            Labels[R[inside], C[inside]] = np.repeat(Instances, np.size(rows))[inside.flatten()]
+            
+            #bounding box of the pixels in the grid
+            found = np.any(inside, axis=1)
+            Box = Table[Instances]
+            Box[:,5] = np.where(inside, R, NWorldFine[0]).min(axis=1)
+            Box[:,6] = np.where(inside, R, -1).max(axis=1) + 1
+            Box[:,7] = np.where(inside, C, NWorldFine[1]).min(axis=1)
+            Box[:,8] = np.where(inside, C, -1).max(axis=1) + 1
+            Box[~found,5:9] = 0
+            Table[Instances] = Box
+        
+        self.ShapeTable = Table
+        self.ShapeLabels = Labels
+        self.RandomLabels = Labels
+        return Table, Labels
+    
+    def ShapePixels(self, k):
+        '''
+        rows and columns of the pixels of shape k, looked up in its bounding box 
+        '''
+        r0, r1, c0, c1 = self.ShapeTable[k][5:9]
+        rows, cols = np.nonzero(self.ShapeLabels[r0:r1,c0:c1] == k)
+        return rows + r0, cols + c0
+    
+        ############### PERIODIC TILING ################
+    def TileCoefficient(self, starti, startj):
+        '''
+        periodic mode for equidistant coefficients with one kind of shape. 
+        Small probes are built with the loop above, the periodic part is repeated 
+        with np.tile and the boundary strips are taken from a probe that has the 
+        size of the grid modulo the period. Hence the result is the same as from the loop.
+        
+        returns None if the coefficient is not periodic (or too small) or its shape reaches 
+        left of the anchor (diagl1, diagl2 and such new shapes), then the loop is used.
+        Note: the random stream after the build is not the same as after the loop.
+        '''
+        NWorldFine = self.NWorldFine
+        
+        if self.ChannelVertical:
+            Shape = 4
+            Len = NWorldFine[0]
+        elif self.ChannelHorizontal:
+            Shape = 1
+            Len = NWorldFine[1]
+        else:
+            zuf = [self.right*1,self.down*4,self.diagr1*2,self.diagr2*3,self.diagl1*5,self.diagl2*6]
+            zuf.extend(range(7,7+self.Shapes))
+            zuf = list(filter(lambda x: x!=0 ,zuf))
+            if len(zuf) != 1:
+                return None
+            Shape = zuf[0]
+            Len = self.length
+        
+        #a shape that reaches left of its anchor fits or not depending on the shapes anchored 
+        #to its right in the rows above. So the right boundary changes the shapes further left 
+        #in every row and no strip of fixed width covers it, such shapes are not tiled
+        if self.ShapeTemplate(Shape, Len, self.thick, 0)[1] < 0:
+            return None
+        
+        #channels are not repeated in their direction
+        Channel = [self.ChannelVertical, self.ChannelHorizontal]
+        start = [starti, startj]
+        
+        #extent of one shape with its space, the strips are this far from the boundary 
+        Extent = np.shape(self.ShapeTemplate(Shape, Len, self.thick, self.space)[2])
+        head = [start[a] + Extent[a] + 1 for a in range(0,2)]
+        tail = [2*(Extent[a] + 1) for a in range(0,2)]
+        
+        if self.Periodic is True:
+            #detect: the smallest shift that leaves the probe unchanged
+            Size = [NWorldFine[a] if Channel[a] else head[a] + tail[a] + 4*(Extent[a]+1) for a in range(0,2)]
+            if Size[0]*Size[1] >= NWorldFine[0]*NWorldFine[1]:
+                return None
+            Probe = self.PeriodicProbe(Size)
+            Period = []
+            for a in range(0,2):
+                p = NWorldFine[a]
+                if not Channel[a]:
+                    for p in range(1,2*(Extent[a]+1)+1):
+                        if self.IsPeriodic(Probe, a, p, head, tail):
+                            break
+                    else:
+                        return None
+                Period.append(p)
+        else:
+            #declared
+            Period = [NWorldFine[a] if Channel[a] else int(self.Periodic[a]) for a in range(0,2)]
+        
+        #probe of the same size modulo the period, with two periods in between the strips
+        Size = []
+        for a in range(0,2):
+            if Channel[a]:
+                Size.append(NWorldFine[a])
+            else:
+                q = head[a] + tail[a] + 2*Period[a]
+                Size.append(q + (NWorldFine[a]-q) % Period[a])
+        if Size[0]*Size[1] >= NWorldFine[0]*NWorldFine[1] or Size[0] > NWorldFine[0] or Size[1] > NWorldFine[1]:
+            return None
+        Probe = self.PeriodicProbe(Size)
+        for a in range(0,2):
+            if not Channel[a] and not self.IsPeriodic(Probe, a, Period[a], head, tail):
+                return None
+        if np.shape(Probe.ShapeRemember)[0] == 0:
+            return None
+        
+        #grid index -> probe index
+        Map = []
+        for a in range(0,2):
+            if Channel[a]:
+                Map.append(np.arange(NWorldFine[a]))
+                continue
+            middle = NWorldFine[a] - head[a] - tail[a]
+            repeat = np.tile(np.arange(Period[a]), middle//Period[a] + 1)[0:middle]
+            Map.append(np.concatenate((np.arange(head[a]), head[a] + repeat, Size[a] - tail[a] + np.arange(tail[a]))))
+        
+        Grid = np.ix_(Map[0], Map[1])
+        B = Probe.Matrix[Grid]
+        Anchors = np.zeros(Size, dtype=bool)
+        Anchors[Probe.ShapeAnchors[:,0], Probe.ShapeAnchors[:,1]] = True
+        Anchors = np.transpose(np.nonzero(Anchors[Grid]))
+        S = np.tile(Probe.ShapeRemember[0], (np.shape(Anchors)[0],1))
+        
+        self.ValueCells = np.flatnonzero(B != self.bg)
+        self.valuecounter = np.size(self.ValueCells)
+        self.Period = np.array(Period)
+        self.ShapeAnchors = Anchors
+        self.Matrix = B
+        self.ShapeRemember = S
+        self.ShapeRememberOriginal = S
+        self.RandomMatrix = B
+        self.ShapeInstances()
+        return B
+    
+    def PeriodicProbe(self, Size):
+        '''
+        the same coefficient on a smaller grid, built with the loop
+        '''
+        Probe = copy.copy(self)
+        Probe.NWorldFine = np.array(Size)
+        Probe.Periodic = None
+        Probe.BuildCoefficient()
+        return Probe
+    
+    def IsPeriodic(self, Probe, axis, p, head, tail):
+        '''
+        does a shift by p along the axis leave the shapes in between the strips of the probe unchanged
+        '''
+        Size = np.shape(Probe.Matrix)
+        Anchors = np.zeros(Size)
+        Anchors[Probe.ShapeAnchors[:,0], Probe.ShapeAnchors[:,1]] = 1
+        
+        Window = []
+        for a in range(0,2):
+            if Size[a] == self.NWorldFine[a] and (self.ChannelVertical, self.ChannelHorizontal)[a]:
+                Window.append(np.arange(Size[a]))
+            else:
+                Window.append(np.arange(head[a], Size[a]-tail[a]))
+        if np.size(Window[axis]) < 2*p:
+            return False
+        
+        Shifted = list(Window)
+        Shifted[axis] = Window[axis][p:]
+        Window[axis] = Window[axis][:-p]
+        for X in [Probe.Matrix, Anchors]:
+            if not np.array_equal(X[np.ix_(Window[0], Window[1])], X[np.ix_(Shifted[0], Shifted[1])]):
+                return False
+        return True
+    
+        ############### CACHE ################
+    def CacheKey(self, DirectSampling=None):
+        '''
+        sha256 of what the coefficient is built from: the parameters, the registered NewShapes, 
+        the seed and DirectSampling (Stamping and Indexing do not change the coefficient)
+        '''
+        Parameters = dict((Name, getattr(self, Name)) for Name in self.CacheParameters)
+        Parameters['ShapeMatrixes'] = self.ShapeMatrixes
+        Parameters['ShapeSizes'] = self.ShapeSizes
+        Parameters['DirectSampling'] = DirectSampling
+        Parameters['Version'] = self.CacheVersion
+        Text = json.dumps(Parameters, sort_keys=True, default=lambda x: np.asarray(x).tolist())
+        return hashlib.sha256(Text.encode('utf-8')).hexdigest()
+    
+    def StoreCoefficient(self, Cache, Key, Before):
+        '''
+        writes the built coefficient to the folder Cache/Key: one .npy file per array and Meta.json. 
+        The states of the random streams after the build are stored as well, such that a loaded 
+        coefficient continues with the same random numbers. Before = state of np.random before the 
+        build, it is only stored if the build changed it.
+        '''
+        Folder = os.path.join(Cache, Key)
+        if os.path.exists(Folder):
+            return Folder
+        if not os.path.isdir(Cache):
+            try:
+                os.makedirs(Cache)
+            except OSError:
+                pass
+        
+        if self.Seed is None:
+            Python = random.getstate()
+            Numpy = np.random.get_state()
+            if all(np.array_equal(a, b) for a, b in zip(Numpy, Before)):
+                Numpy = None
+        else:
+            Python = self.Random.getstate()
+            Numpy = self.Generator.get_state()
+        
+        Meta = {'Parameters': dict((Name, getattr(self, Name)) for Name in self.CacheBuildParameters),
+                'valuecounter': self.valuecounter,
+                'Arrays': [Name for Name in self.CacheArrays if getattr(self, Name) is not None],
+                'Python': [Python[0], Python[2]],
+                'Numpy': None if Numpy is None else [Numpy[0], int(Numpy[2]), int(Numpy[3]), float(Numpy[4])]}
+        
+        #written to a new folder that is renamed in the end, other processes see all or nothing
+        Temporary = tempfile.mkdtemp(dir=Cache)
+        for Name in Meta['Arrays']:
+            np.save(os.path.join(Temporary, Name + '.npy'), np.asarray(getattr(self, Name)))
+        np.save(os.path.join(Temporary, 'Python.npy'), np.array(Python[1], dtype=np.uint32))
+        if Numpy is not None:
+            np.save(os.path.join(Temporary, 'Numpy.npy'), Numpy[1])
+        with open(os.path.join(Temporary, 'Meta.json'), 'w') as File:
+            json.dump(Meta, File, default=lambda x: np.asarray(x).tolist())
+        try:
+            os.rename(Temporary, Folder)
+        except OSError:
+            #stored by someone else in the meantime
+            shutil.rmtree(Temporary, ignore_errors=True)
+        return Folder
+    
+    def LoadCoefficient(self, Cache, Key):
+        '''
+        takes over the coefficient stored in Cache/Key, returns False if there is none. 
+        The arrays are memory mapped copy-on-write: changing them does not change the files.
+        '''
+        Folder = os.path.join(Cache, Key)
+        if not os.path.exists(os.path.join(Folder, 'Meta.json')):
+            return False
+        with open(os.path.join(Folder, 'Meta.json')) as File:
+            Meta = json.load(File)
+        
+        for Name in self.CacheArrays:
+            setattr(self, Name, None)
+        for Name in Meta['Arrays']:
+            setattr(self, Name, np.load(os.path.join(Folder, Name + '.npy'), mmap_mode='c'))
+        for Name in self.CacheBuildParameters:
+            setattr(self, Name, Meta['Parameters'][Name])
+        self.valuecounter = Meta['valuecounter']
+        self.ShapeRememberOriginal = self.ShapeRemember
+        self.RandomMatrix = self.Matrix
+        self.RandomLabels = self.ShapeLabels
+        
+        #random streams as after the build
+        Python = (Meta['Python'][0], tuple(int(x) for x in np.load(os.path.join(Folder, 'Python.npy'))), Meta['Python'][1])
+        Numpy = None
+        if Meta['Numpy'] is not None:
+            Name, pos, has_gauss, cached_gaussian = Meta['Numpy']
+            Numpy = (str(Name), np.load(os.path.join(Folder, 'Numpy.npy')), pos, has_gauss, cached_gaussian)
+        if self.Seed is None:
+            random.setstate(Python)
+            if Numpy is not None:
+                np.random.set_state(Numpy)
+        else:
+            self.SeedStreams()
+            self.Random.setstate(Python)
+            self.Generator.set_state(Numpy)
+        return True
+    
         ########################### investigation ##################################
     
-    def InvestigateRight(self, A, i, j, Len, thick, b, c, inv = 1, Channel=None):
+    def InvestigateRight(self, A, i, j, Len, thick, b, c, inv = 1, Channel=None, Index=None):
         if Channel:
             b1 = b
             b2 = 0
@@ -458,6 +1109,10 @@ class Coefficient2d:
         NWorldFine = self.NWorldFine
         result = 1
         if j+inv*(Len) < NWorldFine[1]-b2+c and j+inv*(Len) > -1+b2 and i+inv*(thick) < NWorldFine[0]-b1 and i+inv*(thick) > -1+b1:
+            if Index is not None:
+                free = Index.IsFree(self.ShapeFootprint(1, Len, thick, inv), i, j)
+                if free is not None:
+                    return free
             for k in range(0,int(inv*(Len)),inv):
                 #rechts
                 for l in range(0,int(inv*thick),inv):
@@ -470,10 +1125,14 @@ class Coefficient2d:
             result = 0
         return result
          
-    def InvestigateDiagr1(self, A, i, j, Len, thick, b, c, inv = 1):
+    def InvestigateDiagr1(self, A, i, j, Len, thick, b, c, inv = 1, Index=None):
         NWorldFine = self.NWorldFine
         result = 1
         if j+inv*Len < NWorldFine[1]-b and j+inv*Len > -1+b and i+inv*(Len+1+thick-1) < NWorldFine[0]-b and i+inv*(Len+1+thick-1) > -1+b:
+            if Index is not None:
+                free = Index.IsFree(self.ShapeFootprint(2, Len, thick, inv), i, j)
+                if free is not None:
+                    return free
             for k in range(0,int(inv*Len),inv):
                 #rechts diag1
                 for l in range(0,int(inv*(thick+1)),inv):
@@ -484,10 +1143,14 @@ class Coefficient2d:
         return result
                 
     
-    def InvestigateDiagr2(self, A, i, j, Len, thick, b, c, inv = 1):
+    def InvestigateDiagr2(self, A, i, j, Len, thick, b, c, inv = 1, Index=None):
         NWorldFine = self.NWorldFine
         result = 1
         if j+inv*(Len+thick) < NWorldFine[1]-b and j+inv*(Len+thick) > -1+b and i+inv*(Len) < NWorldFine[0]-b and i+inv*(Len) > -1+b:
+            if Index is not None:
+                free = Index.IsFree(self.ShapeFootprint(3, Len, thick, inv), i, j)
+                if free is not None:
+                    return free
             for k in range(0,int(inv*Len),inv):
                 #rechts diag2
                 for l in range(0,int(inv*(thick+1)),inv):
@@ -497,7 +1160,7 @@ class Coefficient2d:
             result = 0
         return result 
       
-    def InvestigateDown(self, A, i, j, Len, thick, b, c, inv = 1, Channel = None):
+    def InvestigateDown(self, A, i, j, Len, thick, b, c, inv = 1, Channel = None, Index=None):
         if Channel:
             b1 = b
             b2 = 0
@@ -508,6 +1171,10 @@ class Coefficient2d:
         NWorldFine = self.NWorldFine
         result = 1
         if j+inv*(thick) < NWorldFine[1]-b1 and j+inv*(thick) > -1+b1 and i+inv*(Len)-c < NWorldFine[0]-b2 and i+inv*(Len) > -1 +b2:
+            if Index is not None:
+                free = Index.IsFree(self.ShapeFootprint(4, Len, thick, inv), i, j)
+                if free is not None:
+                    return free
             for k in range(0,int(inv*Len),inv):
                 #down
                 for l in range(0,int(inv*thick),inv):
@@ -520,10 +1187,14 @@ class Coefficient2d:
         return result
         
         
-    def InvestigateDiagl1(self, A, i, j, Len, thick, b, c, inv = 1):
+    def InvestigateDiagl1(self, A, i, j, Len, thick, b, c, inv = 1, Index=None):
         NWorldFine = self.NWorldFine
         result = 1
         if j-inv*Len > -1+b and j-inv*Len < NWorldFine[1]-b and i+inv*(Len+thick) < NWorldFine[0]-b and i+inv*(Len+thick) >-1+b:
+            if Index is not None:
+                free = Index.IsFree(self.ShapeFootprint(5, Len, thick, inv), i, j)
+                if free is not None:
+                    return free
             for k in range(0,int(inv*Len),inv):
                 #links diag1
                 for l in range(0,int(inv*(thick+1)),inv):
@@ -535,10 +1206,14 @@ class Coefficient2d:
         return result
                 
         
-    def InvestigateDiagl2(self, A, i, j, Len, thick, b, c, inv = 1):
+    def InvestigateDiagl2(self, A, i, j, Len, thick, b, c, inv = 1, Index=None):
         NWorldFine = self.NWorldFine
         result = 1
         if j-inv*(Len) > -1+b and j-inv*(Len) < NWorldFine[1] and i+inv*(Len) < NWorldFine[0]-b and i+inv*(Len) >-1+b and j+inv*(thick+1) < NWorldFine[1]-b and j+inv*(thick+1) > -1+b:
+            if Index is not None:
+                free = Index.IsFree(self.ShapeFootprint(6, Len, thick, inv), i, j)
+                if free is not None:
+                    return free
             for k in range(0,int(inv*Len),inv):
                 #links diag2
                 for l in range(0,int(inv*(thick+1)),inv):
@@ -549,40 +1224,27 @@ class Coefficient2d:
             result = 0
         return result
     
-    def InvestigateNewShapes(self, ShapeBuildMatrix, ShapeCoords, A, i, j, b, c):
-        NumberOfShapes = np.shape(ShapeBuildMatrix)[0]
-        resulttotal = 0
-        for shape in range(0,NumberOfShapes):
-            #put them together uniquely with the following properties
-            ShapeIndex = ShapeBuildMatrix[shape][0]                 #what shape
-            ShapeLength = int(ShapeBuildMatrix[shape][1])                #what length
-            ShapeThick = int(ShapeBuildMatrix[shape][2])                 #what thickness 
-            ShapeInverser = int(ShapeBuildMatrix[shape][3])              #what direction
-            px = ShapeCoords[shape*2]
-            py = ShapeCoords[shape*2+1]
-            
+    def InvestigateNewShapes(self, Parts, A, i, j, b, c, Index=None):
+        for ShapeIndex, ShapeLength, ShapeThick, ShapeInverser, px, py in Parts:
             #basic shape
             if ShapeIndex == 1:
-                result = self.InvestigateRight(A, int(i+px), int(j+py), ShapeLength, ShapeThick, b, c, ShapeInverser)
+                result = self.InvestigateRight(A, i+px, j+py, ShapeLength, ShapeThick, b, c, ShapeInverser, Index=Index)
             elif ShapeIndex == 2:
-                result = self.InvestigateDiagr1(A, int(i+px), int(j+py), ShapeLength, ShapeThick, b, c, ShapeInverser)
+                result = self.InvestigateDiagr1(A, i+px, j+py, ShapeLength, ShapeThick, b, c, ShapeInverser, Index=Index)
             elif ShapeIndex == 3:
-                result = self.InvestigateDiagr2(A,  int(i+px), int(j+py), ShapeLength, ShapeThick, b, c, ShapeInverser)
+                result = self.InvestigateDiagr2(A,  i+px, j+py, ShapeLength, ShapeThick, b, c, ShapeInverser, Index=Index)
             elif ShapeIndex == 4:
-                result = self.InvestigateDown(A, int(i+px), int(j+py), ShapeLength, ShapeThick, b, c, ShapeInverser)
+                result = self.InvestigateDown(A, i+px, j+py, ShapeLength, ShapeThick, b, c, ShapeInverser, Index=Index)
             elif ShapeIndex == 5:
-                result = self.InvestigateDiagl1(A,  int(i+px), int(j+py), ShapeLength, ShapeThick, b, c, ShapeInverser)
+                result = self.InvestigateDiagl1(A,  i+px, j+py, ShapeLength, ShapeThick, b, c, ShapeInverser, Index=Index)
             elif ShapeIndex == 6:
-                result = self.InvestigateDiagl2(A, int(i+px), int(j+py), ShapeLength, ShapeThick, b, c, ShapeInverser)
+                result = self.InvestigateDiagl2(A, i+px, j+py, ShapeLength, ShapeThick, b, c, ShapeInverser, Index=Index)
             
-            resulttotal += result
-        
-        if np.sum(resulttotal) == NumberOfShapes:
-            result = 1
-        else:
-            result = 0
+            #one part is enough
+            if result == 0:
+                return 0
             
-        return result        
+        return 1
 
          
          ################################# Build #########################################
@@ -775,31 +1437,21 @@ class Coefficient2d:
                 
         return A, B                          
 
-    def BuildNewShapes(self, ShapeBuildMatrix, ShapeCoords, A, B, i, j, val, bg, space):
-        NumberOfShapes = np.shape(ShapeBuildMatrix)[0]
-        for shape in range(0,NumberOfShapes):
-            #put them together uniquely with the following properties
-            ShapeIndex = ShapeBuildMatrix[shape][0]                 #what shape
-            ShapeLength = int(ShapeBuildMatrix[shape][1])                #what length
-            ShapeThick = int(ShapeBuildMatrix[shape][2])               #what thick
-            ShapeInverser = int(ShapeBuildMatrix[shape][3]) 
-             
-            px = ShapeCoords[shape*2]
-            py = ShapeCoords[shape*2+1]
-            
+    def BuildNewShapes(self, Parts, A, B, i, j, val, bg, space):
+        for ShapeIndex, ShapeLength, ShapeThick, ShapeInverser, px, py in Parts:
             #basic shape
             if ShapeIndex == 1:
-                A, B = self.BuildRight(A, B, int(i+px), int(j+py), val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
+                A, B = self.BuildRight(A, B, i+px, j+py, val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
             elif ShapeIndex == 2:
-                A, B = self.BuildDiagr1(A, B, int(i+px), int(j+py), val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
+                A, B = self.BuildDiagr1(A, B, i+px, j+py, val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
             elif ShapeIndex == 3:
-                A, B = self.BuildDiagr2(A, B, int(i+px), int(j+py), val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
+                A, B = self.BuildDiagr2(A, B, i+px, j+py, val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
             elif ShapeIndex == 4:
-                A, B = self.BuildDown(A, B, int(i+px), int(j+py), val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
+                A, B = self.BuildDown(A, B, i+px, j+py, val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
             elif ShapeIndex == 5:
-                A, B = self.BuildDiagl1(A, B, int(i+px), int(j+py), val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
+                A, B = self.BuildDiagl1(A, B, i+px, j+py, val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
             elif ShapeIndex == 6:
-                A, B = self.BuildDiagl2(A, B, int(i+px), int(j+py), val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
+                A, B = self.BuildDiagl2(A, B, i+px, j+py, val, bg, ShapeLength, ShapeThick, space, ShapeInverser)
                 
         return A,B        
     
@@ -824,17 +1476,29 @@ class Coefficient2d:
                     ChangeDiagl1=1, 
                     ChangeDiagl2=1,
                     Original = True,
-                    NewShapeChange=True):
+                    NewShapeChange=True,
+                    Vectorized=None,
+                    Samples=None,
+                    Delta=None):
         #Changes Value randomly or certainly
         '''
         Ratio = amount of defect :    0.1 = 10 %  of the reference value 
         probfactor = defines the percentage of the possibility of the defect.   1 = 100% , 20 = 5%     maybe change this
         randomvalue = if true then a intervall of ratios is required
         negative = if true also negative defects are allowed
+        Vectorized = if true the ValueChangeKernel is used (numpy random stream)
+        Samples = with Vectorized, number of samples returned as an (Samples, N0, N1) array
+        Delta = if true only the sparse difference [Indices, Old, New, Boxes] is returned (see DeltaOf)
         '''
         #remember stuff
         assert(self.ShapeRemember is not None)
         assert(self.RandomMatrix is not None)
+        
+        if Vectorized:
+            Change = [ChangeRight, ChangeDiagr1, ChangeDiagr2, ChangeDown, ChangeDiagl1, ChangeDiagl2]
+            C = self.ValueChangeKernel(ratio, probfactor, randomvalue, negative, ShapeRestriction, ShapeWave, Change, Original, NewShapeChange, Samples)
+            return self.Perturbed(C, Original, Delta, self.ChangedCells)
+        
         NWorldFine = self.NWorldFine
         val = self.val
         
@@ -889,8 +1553,8 @@ class Coefficient2d:
                         Len = int(S[shapecounter][1])
                         thick = int(S[shapecounter][2])
                         
-                        ratiocur = random.sample(ratioList,1)[0]
-                        decide = random.sample(decision,1)[0]
+                        ratiocur = self.Stream().sample(ratioList,1)[0]
+                        decide = self.Stream().sample(decision,1)[0]
                         
                         if zuf1 == 1:
                             A, C = self.ValueChangeRight(A, C, i, j, ChangeRight, decide, decision, ShapeWave, ratioList, ratiocur, val, Len, thick)
@@ -906,22 +1570,72 @@ class Coefficient2d:
                             A, C = self.ValueChangeDiagl2(A, C, i, j, ChangeDiagl2, decide, decision, ShapeWave, ratioList, ratiocur, val, Len, thick)
                         
                         for s in range(0,self.Shapes):
-                            #rebuildMatrix
+                            #compiled shape
                             if zuf1 == 7+s:
-                                NewShapeMatrix = self.ShapeMatrixes[self.ShapeIndex[s]:self.ShapeIndex[s+1]]
-                                NewShapeMatrix = np.reshape(NewShapeMatrix,(int(self.ShapeSizes[s][0]),int(self.ShapeSizes[s][1])))
-                                ShapeCoords = self.ShapeCoords[self.CoordsIndex[s]:self.CoordsIndex[s+1]]
-                                A, C = self.ValueChangeNewShapes(NewShapeMatrix, ShapeCoords, A, C, i, j, ShapeChange[s], decide, decision, ShapeWave, ratioList, ratiocur, val)
+                                Parts = self.CompiledShapes[s]
+                                A, C = self.ValueChangeNewShapes(Parts, A, C, i, j, ShapeChange[s], decide, decision, ShapeWave, ratioList, ratiocur, val, 
+                                                                 self.ShapeCells(s))
                         
         else:
             for i in range(0,NWorldFine[0]):
                 for j in range(0,NWorldFine[1]):
                     if A[i][j]==1:
-                        if random.sample(decision,1)[0] == 1:
-                            C[i][j] += random.sample(ratioList,1)[0] * val 
+                        if self.Stream().sample(decision,1)[0] == 1:
+                            C[i][j] += self.Stream().sample(ratioList,1)[0] * val 
+        
+        self.RandomLabels = None
+        return self.Perturbed(C, Original, Delta)
+    
+    def ValueChangeKernel(self, ratio=0.1, probfactor=1, randomvalue=None, negative=None, ShapeRestriction=True, 
+                            ShapeWave=None, Change=[1,1,1,1,1,1], Original=True, NewShapeChange=True, Samples=None, Number=None):
+        '''
+        vectorized RandomValueChange (SpecificValueChange if Number is given) on the label map of the shapes. 
+        All decisions and ratios are drawn in one call of the numpy stream and the 
+        changes are added in one scatter. 
+        Change = flags for right, diagr1, diagr2, down, diagl1, diagl2
+        Samples = if given, an (Samples, N0, N1) array of independent samples is returned
+        '''
+        val = self.val
+        C, Pixels, Ids, Active = self.LabelledShapes(Change, Original, NewShapeChange)
+        
+        ratioList = list(np.atleast_1d(ratio if randomvalue is None else randomvalue))
+        if negative:
+            ratioList.extend([-r for r in ratioList])
+        ratioList = np.array(ratioList, dtype=float)
+        p = self.DefectProbability(probfactor)
         
-        self.RandomMatrix = C                
-        return C    
+        M = 1 if Samples is None else Samples
+        n = np.shape(Active)[0]
+        m = np.size(Pixels)
+        if ShapeRestriction:
+            #decision and ratio per shape (and per pixel for the wave)
+            U = self.Uniform((M, 2*n + 2*m*bool(ShapeWave)))
+            if Number is None:
+                Decide = (Active & (U[:,0:n] < p))[:,Ids]
+            else:
+                Selected = np.zeros(n, dtype=bool)
+                Selected[np.array(Number, dtype=int)] = True
+                Decide = np.tile((Active & Selected)[Ids], (M,1))
+            Add = ratioList[(U[:,n:2*n]*np.size(ratioList)).astype(int)][:,Ids] * val
+            if ShapeWave:
+                Decide &= U[:,2*n:2*n+m] < p
+                Add = ratioList[(U[:,2*n+m:]*np.size(ratioList)).astype(int)] * val
+            Add = np.where(Decide, Add, 0.)
+        else:
+            #decision and ratio per pixel
+            U = self.Uniform((M, 2*m))
+            Add = np.where(U[:,0:m] < p, ratioList[(U[:,m:]*np.size(ratioList)).astype(int)] * val, 0.)
+        
+        if self.SparseSamples:
+            return [[Pixels[a != 0], C.flat[Pixels[a != 0]] + a[a != 0]] for a in Add]
+        C = np.repeat(C[np.newaxis], M, axis=0)
+        Flat = np.reshape(C, (M,-1))
+        Flat[:,Pixels] += Add
+        
+        if Samples is not None:
+            return C
+        self.ChangedCells = Pixels[Add[0] != 0]
+        return C[0]
     
     def ValueChangeRight(self, A, C, i, j, Change, decide, decision, ShapeWave, ratioList, ratiocur, val, Len, thick, inv = 1):
         for k in range(0,inv*Len,inv):
@@ -934,8 +1648,8 @@ class Coefficient2d:
                     for l in range(0,inv*thick,inv):
                         #change it
                         if ShapeWave: 
-                            if random.sample(decision,1)[0] == 1:
-                                C[i+l][j+k] += random.sample(ratioList,1)[0] * val
+                            if self.Stream().sample(decision,1)[0] == 1:
+                                C[i+l][j+k] += self.Stream().sample(ratioList,1)[0] * val
                         else:
                             C[i+l][j+k] += ratiocur * val
         return A, C
@@ -949,8 +1663,8 @@ class Coefficient2d:
                 if decide == 1:
                     for l in range(0,inv*(thick+1),inv):
                         if ShapeWave: 
-                            if random.sample(decision,1)[0] == 1:
-                                C[i+l+k][j+k] += random.sample(ratioList,1)[0] * val
+                            if self.Stream().sample(decision,1)[0] == 1:
+                                C[i+l+k][j+k] += self.Stream().sample(ratioList,1)[0] * val
                         else:
                             C[i+l+k][j+k] += ratiocur * val
         return A, C
@@ -964,8 +1678,8 @@ class Coefficient2d:
                 if decide == 1:
                     for l in range(0,inv*(thick+1),inv):
                         if ShapeWave: 
-                            if random.sample(decision,1)[0] == 1:
-                                C[i+k][j+k+l] += random.sample(ratioList,1)[0] * val
+                            if self.Stream().sample(decision,1)[0] == 1:
+                                C[i+k][j+k+l] += self.Stream().sample(ratioList,1)[0] * val
                         else:
                             C[i+k][j+k+l] += ratiocur * val
         return A, C
@@ -979,8 +1693,8 @@ class Coefficient2d:
                 if decide == 1:
                     for l in range(0,inv*thick,inv):
                         if ShapeWave: 
-                            if random.sample(decision,1)[0] == 1:
-                                C[i+k][j+l] += random.sample(ratioList,1)[0] * val
+                            if self.Stream().sample(decision,1)[0] == 1:
+                                C[i+k][j+l] += self.Stream().sample(ratioList,1)[0] * val
                         else:
                             C[i+k][j+l] += ratiocur * val
         
@@ -995,8 +1709,8 @@ class Coefficient2d:
                 if decide == 1:
                     for l in range(0,inv*(thick+1),inv):
                         if ShapeWave: 
-                            if random.sample(decision,1)[0] == 1:
-                                C[i+l+k][j-k] += random.sample(ratioList,1)[0] * val
+                            if self.Stream().sample(decision,1)[0] == 1:
+                                C[i+l+k][j-k] += self.Stream().sample(ratioList,1)[0] * val
                         else:
                             C[i+l+k][j-k] += ratiocur * val
         
@@ -1012,37 +1726,35 @@ class Coefficient2d:
                 if decide == 1:
                     for l in range(0,inv*(thick+1),inv):
                         if ShapeWave: 
-                            if random.sample(decision,1)[0] == 1:
-                                C[i+k][j-k+l] += random.sample(ratioList,1)[0] * val
+                            if self.Stream().sample(decision,1)[0] == 1:
+                                C[i+k][j-k+l] += self.Stream().sample(ratioList,1)[0] * val
                         else:
                             C[i+k][j-k+l] += ratiocur * val
         
         return A, C
     
-    def ValueChangeNewShapes(self, ShapeBuildMatrix, ShapeCoords, A, C, i, j, ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val):
-        NumberOfShapes = np.shape(ShapeBuildMatrix)[0]
-        for shape in range(0,NumberOfShapes):
-            #put them together uniquely with the following properties
-            ShapeIndex = ShapeBuildMatrix[shape][0]                 #what shape
-            ShapeLength = int(ShapeBuildMatrix[shape][1])                #what length
-            ShapeThick = int(ShapeBuildMatrix[shape][2])               #what thick
-            ShapeInverser = int(ShapeBuildMatrix[shape][3]) 
-             
-            px = ShapeCoords[shape*2]
-            py = ShapeCoords[shape*2+1]
-            
+    def ValueChangeNewShapes(self, Parts, A, C, i, j, ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, Cells=None):
+        if Cells is not None and not ShapeWave:
+            #the cells of ShapeCells in one scatter, the wave draws per cell and goes part by part
+            Rows, Cols, AddRows, AddCols = Cells[0:4]
+            A[i+Rows, j+Cols] = 0
+            if ShapeChange and decide == 1:
+                np.add.at(C, (i+AddRows, j+AddCols), ratiocur * val)
+            return A, C
+        
+        for ShapeIndex, ShapeLength, ShapeThick, ShapeInverser, px, py in Parts:
             if ShapeIndex == 1:
-                A, C = self.ValueChangeRight(A, C, int(i+px), int(j+py), ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
+                A, C = self.ValueChangeRight(A, C, i+px, j+py, ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
             elif ShapeIndex == 2:
-                A, C = self.ValueChangeDiagr1(A, C, int(i+px), int(j+py), ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
+                A, C = self.ValueChangeDiagr1(A, C, i+px, j+py, ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
             elif ShapeIndex == 3:
-                A, C = self.ValueChangeDiagr2(A, C, int(i+px), int(j+py), ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
+                A, C = self.ValueChangeDiagr2(A, C, i+px, j+py, ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
             elif ShapeIndex == 4:
-                A, C = self.ValueChangeDown(A, C, int(i+px), int(j+py), ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
+                A, C = self.ValueChangeDown(A, C, i+px, j+py, ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
             elif ShapeIndex == 5:
-                A, C = self.ValueChangeDiagl1(A, C, int(i+px), int(j+py), ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
+                A, C = self.ValueChangeDiagl1(A, C, i+px, j+py, ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
             elif ShapeIndex == 6:
-                A, C = self.ValueChangeDiagl2(A, C, int(i+px), int(j+py), ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
+                A, C = self.ValueChangeDiagl2(A, C, i+px, j+py, ShapeChange, decide, decision, ShapeWave, ratioList, ratiocur, val, ShapeLength, ShapeThick, ShapeInverser)
             
             
         return A,C    
@@ -1061,17 +1773,31 @@ class Coefficient2d:
                     ChangeDiagl1=1, 
                     ChangeDiagl2=1,
                     Original = True,
-                    NewShapeChange=True):
+                    NewShapeChange=True,
+                    Vectorized=None,
+                    Samples=None,
+                    Delta=None):
         #Changes Value randomly or certainly
         '''
         Ratio = amount of defect :    0.1 = 10 %  of the reference value 
         probfactor = defines the percentage of the possibility of the defect.   1 = 100% , 20 = 5%     maybe change this
         randomvalue = if true then a intervall of ratios is required
         negative = if true also negative defects are allowed
+        Vectorized = if true the ValueChangeKernel is used (numpy random stream)
+        Samples = with Vectorized, number of samples returned as an (Samples, N0, N1) array
+        Delta = if true only the sparse difference [Indices, Old, New, Boxes] is returned (see DeltaOf)
         '''
         #remember stuff
         assert(self.ShapeRemember is not None)
         assert(self.RandomMatrix is not None)
+        
+        if Vectorized:
+            if Number is None:
+                Number = [int(round(np.shape(self.ShapeTable)[0]/2.,0))]
+            Change = [ChangeRight, ChangeDiagr1, ChangeDiagr2, ChangeDown, ChangeDiagl1, ChangeDiagl2]
+            C = self.ValueChangeKernel(ratio, probfactor, randomvalue, negative, ShapeRestriction, ShapeWave, Change, Original, NewShapeChange, Samples, Number)
+            return self.Perturbed(C, Original, Delta, self.ChangedCells)
+        
         NWorldFine = self.NWorldFine
         val = self.val
         
@@ -1131,17 +1857,17 @@ class Coefficient2d:
                         Len = int(S[shapecounter][1])
                         thick = int(S[shapecounter][2])
                     
-                        ratiocur = random.sample(ratioList,1)[0]
-                        decide = random.sample(decision,1)[0]
+                        ratiocur = self.Stream().sample(ratioList,1)[0]
+                        decide = self.Stream().sample(decision,1)[0]
                         
-                        NumberList = filter(lambda x: x == shapecounter,Number)
+                        NumberList = list(filter(lambda x: x == shapecounter,Number))
                         if np.size(NumberList) == 1:
                             decide = 1
                         else:
                             decide = 0
                         
                         
-                        NumberList = filter(lambda x: x == shapecounter,Number)
+                        NumberList = list(filter(lambda x: x == shapecounter,Number))
                         if np.size(NumberList) == 1:
                             move = 1
                         else:
@@ -1162,15 +1888,14 @@ class Coefficient2d:
                             A, C = self.ValueChangeDiagl2(A, C, i, j, ChangeDiagl2, decide, decision, ShapeWave, ratioList, ratiocur, val, Len, thick)
                     
                         for s in range(0,self.Shapes):
-                            #rebuildMatrix
+                            #compiled shape
                             if zuf1 == 7+s:
-                                NewShapeMatrix = self.ShapeMatrixes[self.ShapeIndex[s]:self.ShapeIndex[s+1]]
-                                NewShapeMatrix = np.reshape(NewShapeMatrix,(int(self.ShapeSizes[s][0]),int(self.ShapeSizes[s][1])))
-                                ShapeCoords = self.ShapeCoords[self.CoordsIndex[s]:self.CoordsIndex[s+1]]
-                                A, C = self.ValueChangeNewShapes(NewShapeMatrix, ShapeCoords, A, C, i, j, ShapeChange[s], decide, decision, ShapeWave, ratioList, ratiocur, val)
+                                Parts = self.CompiledShapes[s]
+                                A, C = self.ValueChangeNewShapes(Parts, A, C, i, j, ShapeChange[s], decide, decision, ShapeWave, ratioList, ratiocur, val, 
+                                                                 self.ShapeCells(s))
                     
-        self.RandomMatrix = C                
-        return C    
+        self.RandomLabels = None
+        return self.Perturbed(C, Original, Delta)
             
     ##################################### Vanish ###################################    
                               
@@ -1184,11 +1909,24 @@ class Coefficient2d:
                     ChangeDiagl1=1, 
                     ChangeDiagl2=1,
                     Original = True,
-                    NewShapeChange=True):
-                    
+                    NewShapeChange=True,
+                    Vectorized=None,
+                    Samples=None,
+                    Delta=None):
+        '''
+        Vectorized = if true the VanishKernel is used (numpy random stream)
+        Samples = with Vectorized, number of samples returned as an (Samples, N0, N1) array
+        Delta = if true only the sparse difference [Indices, Old, New, Boxes] is returned (see DeltaOf)
+        '''
         #remember stuff
         assert(self.ShapeRememberOriginal is not None)
         assert(self.RandomMatrix is not None)
+        
+        if Vectorized:
+            Change = [ChangeRight, ChangeDiagr1, ChangeDiagr2, ChangeDown, ChangeDiagl1, ChangeDiagl2]
+            C = self.VanishKernel(probfactor, PartlyVanish, Change, Original, NewShapeChange, Samples)
+            return self.Perturbed(C, Original, Delta, self.ChangedCells)
+        
         NWorldFine = self.NWorldFine
         val = self.val
         bg = self.bg
@@ -1240,7 +1978,7 @@ class Coefficient2d:
                     Len = int(S[shapecounter][1])
                     thick = int(S[shapecounter][2])
                     
-                    vanish = random.sample(decision,1)[0]
+                    vanish = self.Stream().sample(decision,1)[0]
                     
                     #initial diecounter
                     died = 0
@@ -1259,19 +1997,86 @@ class Coefficient2d:
                         A, C, died = self.VanishDiagl2(A, C, i, j, Len, thick, ChangeDiagl2, PartlyVanish, decision, vanish)
                     
                     for s in range(0,self.Shapes):
-                        #rebuildMatrix
+                        #compiled shape
                         if zuf1 == 7+s:
-                            NewShapeMatrix = self.ShapeMatrixes[self.ShapeIndex[s]:self.ShapeIndex[s+1]]
-                            NewShapeMatrix = np.reshape(NewShapeMatrix,(int(self.ShapeSizes[s][0]),int(self.ShapeSizes[s][1])))
-                            ShapeCoords = self.ShapeCoords[self.CoordsIndex[s]:self.CoordsIndex[s+1]]
-                            A, C, died = self.VanishNewShapes(NewShapeMatrix, ShapeCoords, A, C, i, j, ShapeChange[s], PartlyVanish, decision, vanish)
+                            Parts = self.CompiledShapes[s]
+                            A, C, died = self.VanishNewShapes(Parts, A, C, i, j, ShapeChange[s], PartlyVanish, decision, vanish, self.ShapeCells(s))
                     
                     if died == bg:
                         S[shapecounter][0] = 0
                         
-        self.RandomMatrix = C           
-        return C
+        self.RandomLabels = None
+        return self.Perturbed(C, Original, Delta)
 
+    def VanishKernel(self, probfactor=1, PartlyVanish=None, Change=[1,1,1,1,1,1], Original=True, NewShapeChange=True, Samples=None):
+        '''
+        vectorized RandomVanish on the label map of the shapes. 
+        All decisions are drawn in one call of the numpy stream and the vanished 
+        pixels are set to bg in one scatter. 
+        Change = flags for right, diagr1, diagr2, down, diagl1, diagl2
+        Samples = if given, an (Samples, N0, N1) array of independent samples is returned
+        '''
+        C, Pixels, Ids, Active = self.LabelledShapes(Change, Original, NewShapeChange)
+        p = self.DefectProbability(probfactor)
+        
+        M = 1 if Samples is None else Samples
+        n = np.shape(Active)[0]
+        if PartlyVanish:
+            #every pixel of a shape decides on its own
+            Vanish = Active[Ids] & (self.Uniform((M, np.size(Pixels))) < p)
+        else:
+            Vanish = (Active & (self.Uniform((M, n)) < p))[:,Ids]
+        
+        if self.SparseSamples:
+            return [[Pixels[V], np.full(np.sum(V), float(self.bg))] for V in Vanish]
+        C = np.repeat(C[np.newaxis], M, axis=0)
+        Flat = np.reshape(C, (M,-1))
+        Flat[:,Pixels] = np.where(Vanish, self.bg, Flat[:,Pixels])
+        
+        if Samples is not None:
+            return C
+        Labels = self.RandomLabels.copy()
+        Labels.flat[Pixels[Vanish[0]]] = -1
+        self.RandomLabels = Labels
+        self.ChangedCells = Pixels[Vanish[0]]
+        return C[0]
+    
+    def LabelledShapes(self, Change, Original, NewShapeChange):
+        '''
+        input of the kernels: the matrix to change, the flat indices of the shape pixels,
+        their shape ids and which shapes may be changed
+        '''
+        assert(self.ShapeTable is not None)
+        if Original:
+            C = self.Matrix
+            self.RandomLabels = self.ShapeLabels
+        else:
+            assert(self.RandomLabels is not None)
+            C = self.RandomMatrix
+        if not self.SparseSamples:
+            C = C.copy()
+        
+        Labels = self.RandomLabels
+        Pixels = np.flatnonzero(Labels > -1)
+        Ids = Labels.flat[Pixels]
+        
+        #change flags by shape type
+        ShapeChange = np.ones(self.Shapes)
+        if NewShapeChange is not True:
+            ShapeChange = np.array(NewShapeChange, dtype=float)[0:self.Shapes]
+        Flags = np.concatenate(([0], Change, ShapeChange)) != 0
+        Active = Flags[self.ShapeTable[:,0]]
+        
+        return C, Pixels, Ids, Active
+    
+    def DefectProbability(self, probfactor):
+        '''
+        probability of a defect as in the decision lists: 1/probfactor, or 1-1/|probfactor| if negative
+        '''
+        if probfactor > 0:
+            return 1./probfactor
+        return 1. - 1./(-probfactor)
+    
     def VanishRight(self, A, C, i, j, Len, thick, Change, PartlyVanish, decision, vanish, inv = 1):
         died = 0
         for k in range(0,inv*Len,inv):
@@ -1283,7 +2088,7 @@ class Coefficient2d:
                 for l in range(0,inv*thick,inv):
                     #change it
                     if PartlyVanish:
-                        C[i+l][j+k] = random.sample(decision,1)[0]
+                        C[i+l][j+k] = self.Stream().sample(decision,1)[0]
                     else:
                         C[i+l][j+k] = vanish
                         died = vanish
@@ -1299,7 +2104,7 @@ class Coefficient2d:
             if Change:
                 for l in range(0,inv*(thick+1),inv):
                     if PartlyVanish:
-                        C[i+l+k][j+k] = random.sample(decision,1)[0]
+                        C[i+l+k][j+k] = self.Stream().sample(decision,1)[0]
                     else:
                         C[i+l+k][j+k] = vanish
                         died = vanish
@@ -1313,7 +2118,7 @@ class Coefficient2d:
             if Change:
                 for l in range(0,inv*(thick+1),inv):
                     if PartlyVanish:
-                        C[i+k][j+k+l] = random.sample(decision,1)[0]
+                        C[i+k][j+k+l] = self.Stream().sample(decision,1)[0]
                     else:
                         C[i+k][j+k+l] = vanish
                         died = vanish
@@ -1328,7 +2133,7 @@ class Coefficient2d:
             if Change:
                 for l in range(0,inv*thick,inv):
                     if PartlyVanish:
-                        C[i+k][j+l] = random.sample(decision,1)[0]
+                        C[i+k][j+l] = self.Stream().sample(decision,1)[0]
                     else:
                         C[i+k][j+l] = vanish
                         died = vanish
@@ -1344,7 +2149,7 @@ class Coefficient2d:
             if Change:
                 for l in range(0,inv*(thick+1),inv):
                     if PartlyVanish:
-                        C[i+l+k][j-k] = random.sample(decision,1)[0]
+                        C[i+l+k][j-k] = self.Stream().sample(decision,1)[0]
                     else:
                         C[i+l+k][j-k] = vanish
                         died = vanish
@@ -1360,37 +2165,37 @@ class Coefficient2d:
             if Change:
                 for l in range(0,inv*(thick+1),inv):
                     if PartlyVanish:
-                        C[i+k][j-k+l] = random.sample(decision,1)[0]
+                        C[i+k][j-k+l] = self.Stream().sample(decision,1)[0]
                     else:
                         C[i+k][j-k+l] = vanish
                         died = vanish
         return A, C, died
         
-    def VanishNewShapes(self, ShapeBuildMatrix, ShapeCoords, A, C, i, j, ShapeChange, PartlyVanish, decision, vanish):
+    def VanishNewShapes(self, Parts, A, C, i, j, ShapeChange, PartlyVanish, decision, vanish, Cells=None):
         died = 0
-        NumberOfShapes = np.shape(ShapeBuildMatrix)[0]
-        for shape in range(0,NumberOfShapes):
-            #put them together uniquely with the following properties
-            ShapeIndex = ShapeBuildMatrix[shape][0]                 #what shape
-            ShapeLength = int(ShapeBuildMatrix[shape][1])                #what length
-            ShapeThick = int(ShapeBuildMatrix[shape][2])               #what thick
-            ShapeInverser = int(ShapeBuildMatrix[shape][3]) 
-             
-            px = ShapeCoords[shape*2]
-            py = ShapeCoords[shape*2+1]
-            
+        if Cells is not None and not PartlyVanish:
+            #the cells of ShapeCells in one scatter, partly vanishing draws per cell and goes part by part
+            Rows, Cols = Cells[0:2]
+            A[i+Rows, j+Cols] = 0
+            if ShapeChange:
+                C[i+Rows, j+Cols] = vanish
+                if Cells[4]:
+                    died = vanish
+            return A, C, died
+        
+        for ShapeIndex, ShapeLength, ShapeThick, ShapeInverser, px, py in Parts:
             if ShapeIndex == 1:
-                A, C, died = self.VanishRight(A, C, int(i+px), int(j+py), ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
+                A, C, died = self.VanishRight(A, C, i+px, j+py, ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
             elif ShapeIndex == 2:
-                A, C, died = self.VanishDiagr1(A, C, int(i+px), int(j+py), ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
+                A, C, died = self.VanishDiagr1(A, C, i+px, j+py, ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
             elif ShapeIndex == 3:
-                A, C, died = self.VanishDiagr2(A, C, int(i+px), int(j+py), ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
+                A, C, died = self.VanishDiagr2(A, C, i+px, j+py, ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
             elif ShapeIndex == 4:
-                A, C, died = self.VanishDown(A, C, int(i+px), int(j+py), ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
+                A, C, died = self.VanishDown(A, C, i+px, j+py, ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
             elif ShapeIndex == 5:
-                A, C, died = self.VanishDiagl1(A, C, int(i+px), int(j+py), ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
+                A, C, died = self.VanishDiagl1(A, C, i+px, j+py, ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
             elif ShapeIndex == 6:
-                A, C, died = self.VanishDiagl2(A, C, int(i+px), int(j+py), ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
+                A, C, died = self.VanishDiagl2(A, C, i+px, j+py, ShapeLength, ShapeThick, ShapeChange, PartlyVanish, decision, vanish, ShapeInverser)
             
             
         return A,C, died
@@ -1406,7 +2211,8 @@ class Coefficient2d:
                     ChangeDiagl1=1, 
                     ChangeDiagl2=1,
                     Original = True,
-                    NewShapeChange=True):
+                    NewShapeChange=True,
+                    Delta=None):
 
         #remember stuff
         assert(self.ShapeRememberOriginal is not None)
@@ -1450,7 +2256,7 @@ class Coefficient2d:
                 if A[i][j]!=bg and A[i][j]!=0:
                     shapecounter += 1
                     
-                    NumberList = filter(lambda x: x == shapecounter,Number)
+                    NumberList = list(filter(lambda x: x == shapecounter,Number))
                     
                     if NumberList is not []:
                         #find the right shape
@@ -1465,9 +2271,9 @@ class Coefficient2d:
                         Len = int(S[shapecounter][1])
                         thick = int(S[shapecounter][2])
                     
-                        vanish = random.sample(decision,1)[0]
+                        vanish = self.Stream().sample(decision,1)[0]
                     
-                        NumberList = filter(lambda x: x == shapecounter,Number)
+                        NumberList = list(filter(lambda x: x == shapecounter,Number))
                         if np.size(NumberList) == 1:
                             vanish = bg
                         else:
@@ -1490,18 +2296,16 @@ class Coefficient2d:
                             A, C, died = self.VanishDiagl2(A, C, i, j, Len, thick, ChangeDiagl2, PartlyVanish, decision, vanish)
                     
                         for s in range(0,self.Shapes):
-                            #rebuildMatrix
+                            #compiled shape
                             if zuf1 == 7+s:
-                                NewShapeMatrix = self.ShapeMatrixes[self.ShapeIndex[s]:self.ShapeIndex[s+1]]
-                                NewShapeMatrix = np.reshape(NewShapeMatrix,(int(self.ShapeSizes[s][0]),int(self.ShapeSizes[s][1])))
-                                ShapeCoords = self.ShapeCoords[self.CoordsIndex[s]:self.CoordsIndex[s+1]]
-                                A, C, died = self.VanishNewShapes(NewShapeMatrix, ShapeCoords, A, C, i, j, ShapeChange[s], PartlyVanish, decision, vanish)
+                                Parts = self.CompiledShapes[s]
+                                A, C, died = self.VanishNewShapes(Parts, A, C, i, j, ShapeChange[s], PartlyVanish, decision, vanish, self.ShapeCells(s))
                     
                         if died == bg:
                             S[shapecounter][0] = 0
                         
-        self.RandomMatrix = C           
-        return C
+        self.RandomLabels = None
+        return self.Perturbed(C, Original, Delta)
 
     
         ###################################### MOVE #############################################  
@@ -1527,12 +2331,25 @@ class Coefficient2d:
                     Top=0,
                     TopRight=0,
                     Original = True,
-                    NewShapeChange = True):
-
+                    NewShapeChange = True,
+                    Vectorized=None,
+                    Samples=None,
+                    Delta=None):
+        '''
+        Vectorized = if true the MoveKernel is used (numpy random stream)
+        Samples = with Vectorized, number of samples returned as an (Samples, N0, N1) array
+        Delta = if true only the sparse difference [Indices, Old, New, Boxes] is returned (see DeltaOf)
+        '''
         #remember stuff
         assert(self.ShapeRememberOriginal is not None)
         assert(self.RandomMatrix is not None)
         
+        if Vectorized:
+            Change = [ChangeRight, ChangeDiagr1, ChangeDiagr2, ChangeDown, ChangeDiagl1, ChangeDiagl2]
+            Directions = [Right, BottomRight, Bottom, BottomLeft, Left, TopLeft, Top, TopRight]
+            C = self.MoveKernel(probfactor, steps, randomstep, randomDirection, Change, Directions, Original, NewShapeChange, None, Samples)
+            return self.Perturbed(C, Original, Delta, self.ChangedCells)
+        
         NWorldFine = self.NWorldFine
         val = self.val
         bg = self.bg
@@ -1596,9 +2413,9 @@ class Coefficient2d:
                     Len = int(S[shapecounter][1])
                     thick = int(S[shapecounter][2])
                     
-                    move = random.sample(decision,1)[0]
-                    step = random.sample(stepList,1)[0]
-                    direction = random.sample(MoveList,1)[0]
+                    move = self.Stream().sample(decision,1)[0]
+                    step = self.Stream().sample(stepList,1)[0]
+                    direction = self.Stream().sample(MoveList,1)[0]
                     
                     if direction == 1:
                         m1 = 0
@@ -1629,8 +2446,8 @@ class Coefficient2d:
                         for i in range(0,np.size(stepList)):
                             stepList.append(-stepList[i])
                         stepList.append(0)
-                        m1 = random.sample(stepList,1)[0]
-                        m2 = random.sample(stepList,1)[0]
+                        m1 = self.Stream().sample(stepList,1)[0]
+                        m2 = self.Stream().sample(stepList,1)[0]
                     
                     if zuf1 == 1:
                         C = self.MoveRight(A, C, i, j, m1, m2, Len, thick, ChangeRight, move)
@@ -1652,16 +2469,107 @@ class Coefficient2d:
                         A, nomore = self.KillingDiagl2(A, i, j, Len, thick)
                     
                     for s in range(0,self.Shapes):
-                        #rebuildMatrix
+                        #compiled shape
                         if zuf1 == 7+s:
-                            NewShapeMatrix = self.ShapeMatrixes[self.ShapeIndex[s]:self.ShapeIndex[s+1]]
-                            NewShapeMatrix = np.reshape(NewShapeMatrix,(int(self.ShapeSizes[s][0]),int(self.ShapeSizes[s][1])))
-                            ShapeCoords = self.ShapeCoords[self.CoordsIndex[s]:self.CoordsIndex[s+1]]
-                            A, C, died = self.MoveNewShapes(NewShapeMatrix, ShapeCoords, A, C, i, j, m1, m2, ShapeChange[s], move)
+                            Parts = self.CompiledShapes[s]
+                            A, C, died = self.MoveNewShapes(Parts, A, C, i, j, m1, m2, ShapeChange[s], move)
                                                             
         self.nomore = nomore
-        self.RandomMatrix = C           
-        return C
+        self.RandomLabels = None
+        return self.Perturbed(C, Original, Delta)
+    
+    def MoveKernel(self, probfactor=1, steps=1, randomstep=None, randomDirection=None, Change=[1,1,1,1,1,1], 
+                    Directions=[1,0,0,0,0,0,0,0], Original=True, NewShapeChange=True, Number=None, Samples=None):
+        '''
+        vectorized RandomMove (SpecificMove if Number is given) on the label map of the shapes. 
+        Whole shapes are shifted by array offsets. A move fails and the shape stays 
+        where it is if it leaves the domain or overlaps another shape, the failures are 
+        counted per shape in self.MoveFailures (summed up over Original=False calls and over the samples).
+        Change = flags for right, diagr1, diagr2, down, diagl1, diagl2
+        Directions = flags for right, bottomright, bottom, bottomleft, left, topleft, top, topright
+        Samples = if given, an (Samples, N0, N1) array of independent samples is returned
+        '''
+        if not randomDirection and (np.size(Directions) != 8 or not np.any(Directions)):
+            raise ValueError('Directions needs 8 flags (right, ..., topright) with at least one set, got %s' % (list(Directions),))
+        
+        NWorldFine = self.NWorldFine
+        Size = NWorldFine[0]*NWorldFine[1]
+        C0, Pixels, Ids, Active = self.LabelledShapes(Change, Original, NewShapeChange)
+        
+        M = 1 if Samples is None else Samples
+        n = np.shape(Active)[0]
+        m = np.size(Pixels)
+        
+        stepList = np.atleast_1d(steps if randomstep is None else randomstep)
+        MoveList = np.array([[0,1],[1,1],[1,0],[1,-1],[0,-1],[-1,-1],[-1,0],[-1,1]])[np.array(Directions) != 0]
+        
+        #decision, step and direction (or the two offsets) per shape
+        U = self.Uniform((M, 4*n))
+        if Number is None:
+            Moved = Active & (U[:,0:n] < self.DefectProbability(probfactor))
+        else:
+            Selected = np.zeros(n, dtype=bool)
+            Selected[np.array(Number, dtype=int)] = True
+            Moved = np.tile(Active & Selected, (M,1))
+        if randomDirection:
+            stepList = np.concatenate((stepList, -stepList, [0]))
+            m1 = stepList[(U[:,2*n:3*n]*np.size(stepList)).astype(int)]
+            m2 = stepList[(U[:,3*n:4*n]*np.size(stepList)).astype(int)]
+        else:
+            step = stepList[(U[:,n:2*n]*np.size(stepList)).astype(int)]
+            direction = (U[:,2*n:3*n]*np.shape(MoveList)[0]).astype(int)
+            m1 = MoveList[direction,0]*step
+            m2 = MoveList[direction,1]*step
+        
+        #the samples are handled as M*n shapes on M stacked grids
+        Moved = Moved.flatten()
+        m1 = np.where(Moved, m1.flatten(), 0).astype(int)
+        m2 = np.where(Moved, m2.flatten(), 0).astype(int)
+        Sample = np.repeat(np.arange(M), m)
+        Ids = (np.tile(Ids, M) + n*Sample)
+        rows = np.tile(Pixels // NWorldFine[1], M)
+        cols = np.tile(Pixels % NWorldFine[1], M)
+        
+        #out of the domain
+        R = rows + m1[Ids]
+        K = cols + m2[Ids]
+        outside = (R < 0) | (R > NWorldFine[0]-1) | (K < 0) | (K > NWorldFine[1]-1)
+        Failed = Moved & (np.bincount(Ids, weights=outside, minlength=M*n) > 0)
+        
+        #overlaps: put failed shapes back until nothing overlaps anymore
+        while True:
+            m1[Failed] = 0
+            m2[Failed] = 0
+            Target = (rows + m1[Ids])*NWorldFine[1] + cols + m2[Ids] + Size*Sample
+            clash = np.bincount(Target, minlength=M*Size)[Target] > 1
+            Clashed = Moved & ~Failed & (np.bincount(Ids, weights=clash, minlength=M*n) > 0)
+            if not np.any(Clashed):
+                break
+            Failed |= Clashed
+        
+        Failures = np.reshape(Failed, (M,n)).sum(axis=0)
+        if Samples is None and not Original and self.MoveFailures is not None:
+            Failures += self.MoveFailures
+        self.MoveFailures = Failures
+        self.nomore = np.sum(Failed)
+        
+        if self.SparseSamples:
+            #the shapes are removed first and written at their targets afterwards
+            Values = np.concatenate((np.full(m, float(self.bg)), C0.flat[Pixels]))
+            return [[np.concatenate((Pixels, Target[Sample == k] - Size*k)), Values] for k in range(0, M)]
+        C = np.repeat(C0[np.newaxis], M, axis=0)
+        Flat = C.reshape(-1)
+        Flat[np.tile(Pixels, M) + Size*Sample] = self.bg
+        Flat[Target] = np.tile(C0.flat[Pixels], M)
+        
+        if Samples is not None:
+            return C
+        Labels = -np.ones(NWorldFine, dtype=np.int32)
+        Labels.flat[Target] = Ids
+        self.RandomLabels = Labels
+        Shifted = Moved[Ids] & ~Failed[Ids]
+        self.ChangedCells = np.concatenate((Pixels[Shifted], Target[Shifted]))
+        return C[0]
     
         ##### MOVE ###############      
     def MoveRight(self, A, C, i, j, m1, m2, Len, thick, Change, move, inv = 1):
@@ -1826,56 +2734,37 @@ class Coefficient2d:
                     nomore = 1
         return A, nomore
      
-    def MoveNewShapes(self, ShapeBuildMatrix, ShapeCoords, A, C, i, j, m1, m2, ShapeChange, move):
+    def MoveNewShapes(self, Parts, A, C, i, j, m1, m2, ShapeChange, move):
         nomore = 0
-        NumberOfShapes = np.shape(ShapeBuildMatrix)[0]
         
-        for shape in range(0,NumberOfShapes):
-            #put them together uniquely with the following properties
-            ShapeIndex = ShapeBuildMatrix[shape][0]                 #what shape
-            ShapeLength = int(ShapeBuildMatrix[shape][1])                #what length
-            ShapeThick = int(ShapeBuildMatrix[shape][2])               #what thick
-            ShapeInverser = int(ShapeBuildMatrix[shape][3]) 
-             
-            px = ShapeCoords[shape*2]
-            py = ShapeCoords[shape*2+1]
-            
+        for ShapeIndex, ShapeLength, ShapeThick, ShapeInverser, px, py in Parts:
             if ShapeIndex == 1:
-                C = self.MoveRight(A, C, int(i+px), int(j+py), m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
+                C = self.MoveRight(A, C, i+px, j+py, m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
             elif ShapeIndex == 2:
-                C = self.MoveDiagr1(A, C, int(i+px), int(j+py), m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
+                C = self.MoveDiagr1(A, C, i+px, j+py, m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
             elif ShapeIndex == 3:
-                C = self.MoveDiagr2(A, C, int(i+px), int(j+py), m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
+                C = self.MoveDiagr2(A, C, i+px, j+py, m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
             elif ShapeIndex == 4:
-                C = self.MoveDown(A, C, int(i+px), int(j+py), m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
+                C = self.MoveDown(A, C, i+px, j+py, m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
             elif ShapeIndex == 5:
-                C = self.MoveDiagl1(A, C, int(i+px), int(j+py), m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
+                C = self.MoveDiagl1(A, C, i+px, j+py, m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
             elif ShapeIndex == 6:
-                C = self.MoveDiagl2(A, C, int(i+px), int(j+py), m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
+                C = self.MoveDiagl2(A, C, i+px, j+py, m1, m2, ShapeLength, ShapeThick, ShapeChange, move, ShapeInverser)
             
         #killing
-        for shape in range(0,NumberOfShapes):
-            #put them together uniquely with the following properties
-            ShapeIndex = ShapeBuildMatrix[shape][0]                 #what shape
-            ShapeLength = int(ShapeBuildMatrix[shape][1])                #what length
-            ShapeThick = int(ShapeBuildMatrix[shape][2])               #what thick
-            ShapeInverser = int(ShapeBuildMatrix[shape][3]) 
-         
-            px = ShapeCoords[shape*2]
-            py = ShapeCoords[shape*2+1]
-            
+        for ShapeIndex, ShapeLength, ShapeThick, ShapeInverser, px, py in Parts:
             if ShapeIndex == 1:
-                A, nomore = self.KillingRight(A, int(i+px), int(j+py), ShapeLength, ShapeThick, ShapeInverser)
+                A, nomore = self.KillingRight(A, i+px, j+py, ShapeLength, ShapeThick, ShapeInverser)
             elif ShapeIndex == 2:
-                A, nomore = self.KillingDiagr1(A, int(i+px), int(j+py), ShapeLength, ShapeThick, ShapeInverser)
+                A, nomore = self.KillingDiagr1(A, i+px, j+py, ShapeLength, ShapeThick, ShapeInverser)
             elif ShapeIndex == 3:
-                A, nomore = self.KillingDiagr2(A, int(i+px), int(j+py),  ShapeLength, ShapeThick, ShapeInverser)
+                A, nomore = self.KillingDiagr2(A, i+px, j+py,  ShapeLength, ShapeThick, ShapeInverser)
             elif ShapeIndex == 4:
-                A, nomore = self.KillingDown(A, int(i+px), int(j+py),  ShapeLength, ShapeThick, ShapeInverser)
+                A, nomore = self.KillingDown(A, i+px, j+py,  ShapeLength, ShapeThick, ShapeInverser)
             elif ShapeIndex == 5:
-                A, nomore = self.KillingDiagl1(A, int(i+px), int(j+py),  ShapeLength, ShapeThick, ShapeInverser)
+                A, nomore = self.KillingDiagl1(A, i+px, j+py,  ShapeLength, ShapeThick, ShapeInverser)
             elif ShapeIndex == 6:
-                A, nomore = self.KillingDiagl2(A, int(i+px), int(j+py),  ShapeLength, ShapeThick, ShapeInverser)
+                A, nomore = self.KillingDiagl2(A, i+px, j+py,  ShapeLength, ShapeThick, ShapeInverser)
             
         return A,C, nomore
         
@@ -1899,12 +2788,27 @@ class Coefficient2d:
                     Top=0,
                     TopRight=0,
                     Original = True,
-                    NewShapeChange = True):
-
+                    NewShapeChange = True,
+                    Vectorized=None,
+                    Samples=None,
+                    Delta=None):
+        '''
+        Vectorized = if true the MoveKernel is used (numpy random stream)
+        Samples = with Vectorized, number of samples returned as an (Samples, N0, N1) array
+        Delta = if true only the sparse difference [Indices, Old, New, Boxes] is returned (see DeltaOf)
+        '''
         #remember stuff
         assert(self.ShapeRememberOriginal is not None)
         assert(self.RandomMatrix is not None)
         
+        if Vectorized:
+            if Number is None:
+                Number = [int(round(np.shape(self.ShapeTable)[0]/2.,0))]
+            Change = [ChangeRight, ChangeDiagr1, ChangeDiagr2, ChangeDown, ChangeDiagl1, ChangeDiagl2]
+            Directions = [Right, BottomRight, Bottom, BottomLeft, Left, TopLeft, Top, TopRight]
+            C = self.MoveKernel(probfactor, steps, randomstep, randomDirection, Change, Directions, Original, NewShapeChange, Number, Samples)
+            return self.Perturbed(C, Original, Delta, self.ChangedCells)
+        
         NWorldFine = self.NWorldFine
         val = self.val
         bg = self.bg
@@ -1967,11 +2871,11 @@ class Coefficient2d:
                     Len = int(S[shapecounter][1])
                     thick = int(S[shapecounter][2])
             
-                    move = random.sample(decision,1)[0]
-                    step = random.sample(stepList,1)[0]
-                    direction = random.sample(MoveList,1)[0]
+                    move = self.Stream().sample(decision,1)[0]
+                    step = self.Stream().sample(stepList,1)[0]
+                    direction = self.Stream().sample(MoveList,1)[0]
                     
-                    NumberList = filter(lambda x: x == shapecounter,Number)
+                    NumberList = list(filter(lambda x: x == shapecounter,Number))
                     if np.size(NumberList) == 1:
                         move = 1
                     else:
@@ -2007,8 +2911,8 @@ class Coefficient2d:
                         for i in range(0,np.size(stepList)):
                             stepList.append(-stepList[i])
                         stepList.append(0)
-                        m1 = random.sample(stepList,1)[0]
-                        m2 = random.sample(stepList,1)[0]
+                        m1 = self.Stream().sample(stepList,1)[0]
+                        m2 = self.Stream().sample(stepList,1)[0]
             
                     if zuf1 == 1:
                         C = self.MoveRight(A, C, i, j, m1, m2, Len, thick, ChangeRight, move)
@@ -2030,26 +2934,24 @@ class Coefficient2d:
                         A, nomore = self.KillingDiagl2(A, i, j, Len, thick)
             
                     for s in range(0,self.Shapes):
-                        #rebuildMatrix
+                        #compiled shape
                         if zuf1 == 7+s:
-                            NewShapeMatrix = self.ShapeMatrixes[self.ShapeIndex[s]:self.ShapeIndex[s+1]]
-                            NewShapeMatrix = np.reshape(NewShapeMatrix,(int(self.ShapeSizes[s][0]),int(self.ShapeSizes[s][1])))
-                            ShapeCoords = self.ShapeCoords[self.CoordsIndex[s]:self.CoordsIndex[s+1]]
-                            A, C, died = self.MoveNewShapes(NewShapeMatrix, ShapeCoords, A, C, i, j, m1, m2, ShapeChange[s], move)
+                            Parts = self.CompiledShapes[s]
+                            A, C, died = self.MoveNewShapes(Parts, A, C, i, j, m1, m2, ShapeChange[s], move)
                            
                     
         self.nomore = nomore
-        self.RandomMatrix = C           
-        return C
+        self.RandomLabels = None
+        return self.Perturbed(C, Original, Delta)
 
     def ChannelVerticalRandomize(self, probfactor=10,
                          LU = 1,
                          RU = 1,
                          LO = 1,
                          RO = 1,
-                         Original=True):
+                         Original=True,
+                         Delta=None):
         assert(self.ChannelVertical)
-        NWorldFine = self.NWorldFine
         
         bg = self.bg
         A = self.RandomMatrix.copy()
@@ -2078,207 +2980,14 @@ class Coefficient2d:
         DirectionListori = [LU*1,RU*2,LO*3,RO*4]
         DirectionListori = list(filter(lambda x: x!=0 ,DirectionListori))
         
-        for i in range(0,NWorldFine[0]):
-            for j in range(0,NWorldFine[1]):
-                if A[i][j]!=bg and A[i][j]!=0:
-                    DirectionList = DirectionListori
-                    
-                    #get thick
-                    thick = 0
-                    for k in range(0,NWorldFine[1]):
-                        if O[i][j+k]!=bg and O[i][j+k]!=0:
-                            thick += 1
-                            A[i][j+k] = 0
-                        else:
-                            break
-                    
-                    
-                    #get length
-                    spacelu = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[1]):
-                        if stop == 1:
-                            break
-                        for l in range(0,thick):
-                            if j-k > -1 and i-l > -1:
-                                if CS[i-l][j-k] == bg or CS[i-l][j-k] == 0:
-                                    spacelu += 1
-                                else:
-                                    stop = 1
-                            else:
-                                stop = 1
-                                break
-                    spacelu /= thick
-                    
-                    spacelo = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[1]):
-                        if stop == 1:
-                            break
-                        for l in range(0,thick):
-                            if j-k > -1 and i+l < NWorldFine[0]:
-                                if CS[i+l][j-k] == bg or CS[i+l][j-k] == 0:
-                                    spacelo += 1
-                                else:
-                                    stop = 1
-                            else:
-                                stop = 1
-                                break
-                    spacelo /= thick
-                    
-                    spacelreal = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[1]):
-                        if j-k > -1:
-                            if  O[i][j-k] == bg or O[i][j-k] == 0:
-                                spacelreal += 1
-                            else:
-                                break
-                        else:
-                            break
-                    
-                    
-                    spaceru = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[1]):
-                        if stop == 1:
-                            break
-                        for l in range(0,thick):
-                            if j+k+thick-1 < NWorldFine[1] and i-l > -1:
-                                if CS[i-l][j+k+thick-1] == bg or CS[i-l][j+k+thick-1] == 0:
-                                    spaceru += 1
-                                else:
-                                    stop = 1
-                            else:
-                                stop = 1
-                                break
-                    spaceru /= thick
-                    
-                    spacero = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[1]):
-                        if stop == 1:
-                            break
-                        for l in range(0,thick):
-                            if j+k+thick-1 < NWorldFine[1] and i+l < NWorldFine[0]:
-                                if CS[i+l][j+k+thick-1] == bg or CS[i+l][j+k+thick-1] == 0:
-                                    spacero += 1
-                                else:
-                                    stop = 1
-                            else:
-                                stop = 1
-                                break
-                    
-                    spacero /= thick
-                    
-                    spacerreal = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[1]):
-                        if j+k+thick-1 < NWorldFine[1]:
-                            if O[i][j+k+thick-1] == bg or O[i][j+k+thick-1] == 0:
-                                spacerreal += 1
-                            else:
-                                break
-                        else:
-                            break                    
-                    
-                    if spacelreal != spacelo:
-                        DirectionList = list(filter(lambda x: x!=1 ,DirectionList))
-                    
-                    if spacelreal != spacelu:
-                        DirectionList = list(filter(lambda x: x!=3 ,DirectionList))
-                    
-                    if spacerreal != spacero:
-                        DirectionList = list(filter(lambda x: x!=2,DirectionList))
-                    if spacerreal != spaceru:
-                        DirectionList = list(filter(lambda x: x!=4,DirectionList))
-                    
-                    if spacelo ==0 or spacelu == 0:
-                        DirectionList = list(filter(lambda x: x!=1 and x!=3 ,DirectionList))
-                    if spacero ==0 or spaceru == 0:
-                        DirectionList = list(filter(lambda x: x!=2 and x!=4 ,DirectionList))
-                         
-                    matu = 0
-                    for k in range(1,NWorldFine[0]):
-                        if i+k < NWorldFine[0]:
-                            if CS[i+k][j]!=bg and CS[i+k][j]!=0:
-                                matu += 1
-                            else:
-                                break
-                        else:
-                            break
-                    
-                    mato = 0
-                    for k in range(1,NWorldFine[0]):
-                        if i-k > -1:
-                            if CS[i-k][j]!=bg and CS[i-k][j]!=0:
-                                mato += 1
-                            else:
-                                break
-                        else:
-                            break
-                    
-                    if mato < spacelo or matu+1 < thick:
-                        DirectionList = list(filter(lambda x: x!=3 ,DirectionList))
-                    
-                    if mato < spacero or matu+1 < thick:
-                        DirectionList = list(filter(lambda x: x!=4 ,DirectionList))
-                    
-                    if matu < spacelu or mato+1 < thick:
-                        DirectionList = list(filter(lambda x: x!=1 ,DirectionList))
-                    
-                    if matu < spaceru or mato+1 < thick:
-                        DirectionList = list(filter(lambda x: x!=2 ,DirectionList))
-                    
-                    if np.size(DirectionList) != 0:
-                        direction = random.sample(DirectionList,1)[0]
-                    else:
-                        continue
-                    
-                    if random.sample(decision,1)[0] == 0:
-                        continue
-                        
-                    if direction == 1:
-                        #LU
-                        for k in range(1,int(spacelu+1)):
-                            for l in range(0,thick):
-                                B[i-l][j-k] = B[i+k][j+l]
-                                CS[i+k][j+l] = 0
-                                B[i+k][j+l] = bg
-                                A[i+k][j+l] = 0
-                                
-                    elif direction == 2:
-                        #Ru
-                        for k in range(1,int(spaceru+1)):
-                            for l in range(0,thick):
-                                B[i-l][j+thick-1+k] = B[i+k][j+l]
-                                CS[i+k][j+l] = 0
-                                B[i+k][j+l] = bg
-                                A[i+k][j+l] = 0
-                        
-                    elif direction == 3:
-                        #LO
-                        for k in range(1,int(spacelo+1)):
-                            for l in range(0,thick):
-                                B[i+l][j-k] = B[i-k][j+l]
-                                CS[i-k][j+l] = 0
-                                A[i-k][j+l] = 0
-                                B[i-k][j+l] = bg
-                        
-                    elif direction == 4:
-                        #RO
-                        for k in range(1,int(spacero+1)):
-                            for l in range(0,thick):
-                                B[i+l][j+thick-1+k] = B[i-k][j+l]
-                                CS[i-k][j+l] = 0
-                                B[i-k][j+l] = bg
-                                A[i-k][j+l] = 0
-                    
-                    
+        #channel starts in the order of the loop over the grid
+        Starts = np.argwhere((A != bg) & (A != 0))
+        self.ChannelKernel(A, B, CS, O, bg, DirectionListori, decision, Starts, Vertical=True)
+        
         self.Channelsafe = CS
-        self.RandomMatrix = B                
+        self.RandomLabels = None
         
-        return B
+        return self.Perturbed(B, Original, Delta)
 
 
     def ChannelHorizontalRandomize(self, probfactor=10,
@@ -2286,9 +2995,9 @@ class Coefficient2d:
                          RU = 1,
                          LO = 1,
                          RO = 1,
-                         Original=True):
+                         Original=True,
+                         Delta=None):
         assert(self.ChannelHorizontal)
-        NWorldFine = self.NWorldFine
         
         bg = self.bg
         A = self.RandomMatrix.copy()
@@ -2317,214 +3026,124 @@ class Coefficient2d:
         DirectionListori = [LU*1,RU*2,LO*3,RO*4]
         DirectionListori = list(filter(lambda x: x!=0 ,DirectionListori))
         
-        for i in range(0,NWorldFine[0]):
-            for j in range(0,NWorldFine[1]):
-                if A[i][j]!=bg and A[i][j]!=0:
-                    DirectionList = DirectionListori
-                    
-                    #get thick
-                    thick = 0
-                    for k in range(0,NWorldFine[0]):
-                        if O[i+k][j]!=bg and O[i+k][j]!=0:
-                            thick += 1
-                            A[i+k][j] = 0
-                        else:
-                            break
-                    
-                    
-                    #get length
-                    spacelu = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[0]):
-                        if stop == 1:
-                            break
-                        for l in range(0,thick):
-                            if i-k > -1 and j-l > -1:
-                                if CS[i-k][j-l] == bg or CS[i-k][j-l] == 0:
-                                    spacelu += 1
-                                else:
-                                    stop = 1
-                            else:
-                                stop = 1
-                                break
-                    spacelu /= thick
-                    
-                    spacelo = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[0]):
-                        if stop == 1:
-                            break
-                        for l in range(0,thick):
-                            if i-k > -1 and j+l < NWorldFine[1]:
-                                if CS[i-k][j+l] == bg or CS[i-k][j+l] == 0:
-                                    spacelo += 1
-                                else:
-                                    stop = 1
-                            else:
-                                stop = 1
-                                break
-                    spacelo /= thick
-                    
-                    spacelreal = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[0]):
-                        if i-k > -1:
-                            if  O[i-k][j] == bg or O[i-k][j] == 0:
-                                spacelreal += 1
-                            else:
-                                break
-                        else:
-                            break
-                    
-                    
-                    spaceru = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[0]):
-                        if stop == 1:
-                            break
-                        for l in range(0,thick):
-                            if i+k+thick-1 < NWorldFine[0] and j-l > -1:
-                                if CS[i+k+thick-1][j-l] == bg or CS[i+k+thick-1][j-l] == 0:
-                                    spaceru += 1
-                                else:
-                                    stop = 1
-                            else:
-                                stop = 1
-                                break
-                    spaceru /= thick
-                    
-                    spacero = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[0]):
-                        if stop == 1:
-                            break
-                        for l in range(0,thick):
-                            if i+k+thick-1 < NWorldFine[0] and j+l < NWorldFine[1]:
-                                if CS[i+k+thick-1][j+l] == bg or CS[i+k+thick-1][j+l] == 0:
-                                    spacero += 1
-                                else:
-                                    stop = 1
-                            else:
-                                stop = 1
-                                break
-                    
-                    spacero /= thick
-                    
-                    spacerreal = 0.
-                    stop = 0
-                    for k in range(1,NWorldFine[0]):
-                        if i+k+thick-1 < NWorldFine[0]:
-                            if O[i+k+thick-1][j] == bg or O[i+k+thick-1][j] == 0:
-                                spacerreal += 1
-                            else:
-                                break
-                        else:
-                            break                    
-                    
-                    if spacelreal != spacelo:
-                        DirectionList = list(filter(lambda x: x!=1 ,DirectionList))
-                    
-                    if spacelreal != spacelu:
-                        DirectionList = list(filter(lambda x: x!=3 ,DirectionList))
-                    
-                    #print DirectionList
-                    
-                    if spacerreal != spacero:
-                        DirectionList = list(filter(lambda x: x!=2,DirectionList))
-                    if spacerreal != spaceru:
-                        DirectionList = list(filter(lambda x: x!=4,DirectionList))
-                    
-                    #print DirectionList
-                    
-                    if spacelo ==0 or spacelu == 0:
-                        DirectionList = list(filter(lambda x: x!=1 and x!=3 ,DirectionList))
-                    if spacero ==0 or spaceru == 0:
-                        DirectionList = list(filter(lambda x: x!=2 and x!=4 ,DirectionList))
-                         
-                    #print DirectionList
-                    matu = 0
-                    for k in range(1,NWorldFine[1]):
-                        if j+k < NWorldFine[1]:
-                            if CS[i][j+k]!=bg and CS[i][j+k]!=0:
-                                matu += 1
-                            else:
-                                break
-                        else:
-                            break
-                    
-                    mato = 0
-                    for k in range(1,NWorldFine[1]):
-                        if j-k > -1:
-                            if CS[i][j-k]!=bg and CS[i][j-k]!=0:
-                                mato += 1
-                            else:
-                                break
-                        else:
-                            break
-                    
-                    if mato < spacelo or matu < thick:
-                        DirectionList = list(filter(lambda x: x!=3 ,DirectionList))
-                    
-                    if mato < spacero or matu < thick:
-                        DirectionList = list(filter(lambda x: x!=4 ,DirectionList))
-                    
-                    if matu < spacelu or mato < thick:
-                        DirectionList = list(filter(lambda x: x!=1 ,DirectionList))
-                    
-                    if matu < spaceru or mato < thick:
-                        DirectionList = list(filter(lambda x: x!=2 ,DirectionList))
-                    
-                    if np.size(DirectionList) != 0:
-                        direction = random.sample(DirectionList,1)[0]
-                    else:
-                        continue
-                    
-                    if random.sample(decision,1)[0] == 0:
-                        continue
-                        
-                    if direction == 1:
-                        #LU
-                        for k in range(1,int(spacelu+1)):
-                            for l in range(0,thick):
-                                B[i-k][j-l] = B[i+l][j+k]
-                                CS[i+l][j+k] = 0
-                                B[i+l][j+k] = bg
-                                A[i+l][j+k] = 0
-                                
-                    elif direction == 2:
-                        #RU
-                        for k in range(1,int(spaceru+1)):
-                            for l in range(0,thick):
-                                B[i+thick-1+k][j-l] = B[i+l][j+k]
-                                CS[i+l][j+k] = 0
-                                B[i+l][j+k] = bg
-                                A[i+l][j+k] = 0
-                        
-                    elif direction == 3:
-                        #LO
-                        for k in range(1,int(spacelo+1)):
-                            for l in range(0,thick):
-                                B[i-k][j+l] = B[i+l][j-k]
-                                CS[i+l][j-k] = 0
-                                A[i+l][j-k] = 0
-                                B[i+l][j-k] = bg
-                        
-                    elif direction == 4:
-                        #RO
-                        for k in range(1,int(spacero+1)):
-                            for l in range(0,thick):
-                                B[i+thick-1+k][j+l] = B[i+l][j-k]
-                                CS[i+l][j-k] = 0
-                                B[i+l][j-k] = bg
-                                A[i+l][j-k] = 0
-                    
-                    
+        #the kernel works along axis 0, the order of the starts stays the one of the grid
+        Starts = np.argwhere((A != bg) & (A != 0))
+        self.ChannelKernel(A.T, B.T, CS.T, O.T, bg, DirectionListori, decision, Starts[:,::-1], Vertical=False)
+        
         self.Channelsafe = CS
-        self.RandomMatrix = B                
+        self.RandomLabels = None
         
-        return B
+        return self.Perturbed(B, Original, Delta)
+    
+    def ChannelKernel(self, A, B, CS, O, bg, DirectionListori, decision, Starts, Vertical=True):
+        '''
+        bends the channels of the channel randomizers in the frame of vertical channels 
+        (horizontal channels come transposed). Every row of a channel is a start; its thickness, 
+        the free space next to it and the channel above and below it are read from the run 
+        lengths of ChannelClearance instead of walking the grid. B and CS are changed in place.
         
-    def ExtremeRandomizer(self, Vanish=True, ValueChange=None, Move=None, Original = True, Number=None):
+        Starts = cells in the order they are visited, skipped if they are no start anymore
+        Vertical = the vertical randomizer allows the bend to reach the row itself (matu+1 < thick)
+        '''
+        Clearance = ChannelClearance(CS, O, bg)
+        N0, N1 = np.shape(A)
+        short = 1 if Vertical else 0
+        Live = (A != bg) & (A != 0)
+        
+        #thick and the free space in the original coefficient are the same for all starts
+        I, J = Starts[:,0], Starts[:,1]
+        Thick = Clearance.Thick[I,J]
+        Lreal = np.where(J > 0, Clearance.OLeft[I,J-1], 0)
+        Rreal = np.where(J+Thick < N1, Clearance.ORight[I,np.minimum(J+Thick,N1-1)], 0)
+        
+        for i, j, thick, spacelreal, spacerreal in zip(I.tolist(), J.tolist(), Thick.tolist(), Lreal.tolist(), Rreal.tolist()):
+            if not Live[i,j]:
+                continue
+            DirectionList = DirectionListori
+            
+            if thick == 0:
+                #a start off the original channels has no thickness (as in the loops)
+                raise ZeroDivisionError('channel start (%d,%d) is not part of the original channels' % (i,j))
+            Live[i,j:j+thick] = False
+            
+            #get length
+            spacelu = Clearance.Space(i, j-1, thick, True, False)
+            spacelo = Clearance.Space(i, j-1, thick, False, False)
+            spaceru = Clearance.Space(i, j+thick, thick, True, True)
+            spacero = Clearance.Space(i, j+thick, thick, False, True)
+            
+            if spacelreal != spacelo:
+                DirectionList = list(filter(lambda x: x!=1 ,DirectionList))
+            if spacelreal != spacelu:
+                DirectionList = list(filter(lambda x: x!=3 ,DirectionList))
+            if spacerreal != spacero:
+                DirectionList = list(filter(lambda x: x!=2,DirectionList))
+            if spacerreal != spaceru:
+                DirectionList = list(filter(lambda x: x!=4,DirectionList))
+            
+            if spacelo ==0 or spacelu == 0:
+                DirectionList = list(filter(lambda x: x!=1 and x!=3 ,DirectionList))
+            if spacero ==0 or spaceru == 0:
+                DirectionList = list(filter(lambda x: x!=2 and x!=4 ,DirectionList))
+            
+            #channel below and above
+            matu = Clearance.Down[i+1,j] if i+1 < N0 else 0
+            mato = Clearance.Up[i-1,j] if i > 0 else 0
+            
+            if mato < spacelo or matu+short < thick:
+                DirectionList = list(filter(lambda x: x!=3 ,DirectionList))
+            if mato < spacero or matu+short < thick:
+                DirectionList = list(filter(lambda x: x!=4 ,DirectionList))
+            if matu < spacelu or mato+short < thick:
+                DirectionList = list(filter(lambda x: x!=1 ,DirectionList))
+            if matu < spaceru or mato+short < thick:
+                DirectionList = list(filter(lambda x: x!=2 ,DirectionList))
+            
+            if np.size(DirectionList) != 0:
+                direction = self.Stream().sample(DirectionList,1)[0]
+            else:
+                continue
+            
+            if self.Stream().sample(decision,1)[0] == 0:
+                continue
+            
+            #the channel part below (LU, RU) or above (LO, RO) is turned next to the row
+            if direction == 1:
+                #LU
+                s = int(spacelu)
+                r0, r1 = i+1, i+1+s
+                if s > 0:
+                    B[i-thick+1:i+1,j-s:j] = B[r0:r1,j:j+thick].T[::-1,::-1]
+            elif direction == 2:
+                #RU
+                s = int(spaceru)
+                r0, r1 = i+1, i+1+s
+                if s > 0:
+                    B[i-thick+1:i+1,j+thick:j+thick+s] = B[r0:r1,j:j+thick].T[::-1,:]
+            elif direction == 3:
+                #LO
+                s = int(spacelo)
+                r0, r1 = i-s, i
+                if s > 0:
+                    B[i:i+thick,j-s:j] = B[r0:r1,j:j+thick].T
+            elif direction == 4:
+                #RO
+                s = int(spacero)
+                r0, r1 = i-s, i
+                if s > 0:
+                    B[i:i+thick,j+thick:j+thick+s] = B[r0:r1,j:j+thick].T[:,::-1]
+            
+            if s > 0:
+                B[r0:r1,j:j+thick] = bg
+                Live[r0:r1,j:j+thick] = False
+                Clearance.Clear(r0, r1, j, j+thick)
+        
+    def ExtremeRandomizer(self, Vanish=True, ValueChange=None, Move=None, Original = True, Number=None, Delta=None):
+        '''
+        perturbs the inclusion cells with the given numbers (counted row by row from 1, see ValueCells) 
+        all at once: Vanish sets them to bg, ValueChange to the given value and Move = [m0,m1] shifts 
+        them, cells that would leave the grid stay. Numbers that are given twice are left out.
+        '''
         NWorldFine = self.NWorldFine
     
         bg = self.bg
@@ -2534,24 +3153,976 @@ class Coefficient2d:
             A = self.Matrix.copy()
         
         if Number is None:
-            Number = self.valuecounter[int(self.valuecounter/2.)]
+            Number = [int(self.valuecounter/2.)]
+        
+        #rank index: cell numbers to flat indices
+        Number = np.asarray(Number, dtype=int).ravel()
+        Number = Number[(Number > 0) & (Number <= self.valuecounter)]
+        Counts = np.bincount(Number, minlength=self.valuecounter+1)
+        Cells = self.ValueCells[Counts[1:] == 1]
+        
+        Values = A.flat[Cells]
+        if Vanish:
+            Values[:] = bg
+        if ValueChange is not None:    
+            Values[:] = ValueChange
+        
+        if Move is None:
+            A.flat[Cells] = Values
+        else:
+            i, j = np.unravel_index(Cells, tuple(NWorldFine))
+            i = i + Move[0]
+            j = j + Move[1]
+            Inside = (i > -1) & (i < NWorldFine[0]) & (j > -1) & (j < NWorldFine[1])
+            A.flat[Cells[~Inside]] = Values[~Inside]
+            A.flat[Cells[Inside]] = bg
+            A[i[Inside],j[Inside]] = Values[Inside]
+        
+        self.RandomLabels = None
+        return self.Perturbed(A, Original, Delta)
+    
+        ###################################### COMPOSITE ###########################################
+    def Perturb(self, Operations, Original=True, Delta=None):
+        '''
+        applies an ordered list of operations on shapes (rows of ShapeTable) in one pass:
+            ['Vanish', Shapes]                  the shapes are set to bg
+            ['ValueChange', Shapes, ratio]      ratio*val is added to the shapes
+            ['Move', Shapes, [m1, m2]]          the shapes are shifted by m1 rows and m2 columns
+        Shapes = list of shape numbers, None for all shapes
+        
+        The operations only change the state of the shapes (kept, added value, offset), the pixels 
+        are written once in the end. Hence a vanished shape stays vanished and a shape whose total 
+        offset leaves the domain or overlaps another shape stays where it is (see MoveKernel).
+        Delta = if true only the combined sparse difference is returned (see DeltaOf)
+        '''
+        NWorldFine = self.NWorldFine
+        Size = NWorldFine[0]*NWorldFine[1]
+        C, Pixels, Ids, _ = self.LabelledShapes([1,1,1,1,1,1], Original, True)
+        n = np.shape(self.ShapeTable)[0]
+        
+        #state of the shapes
+        Kept = np.zeros(n, dtype=bool)
+        Kept[Ids] = True
+        Add = np.zeros(n)
+        Offset = np.zeros([n,2], dtype=int)
+        Moving = False
+        for Operation in Operations:
+            Kind = Operation[0]
+            Shapes = np.arange(n) if Operation[1] is None else np.unique(np.array(Operation[1], dtype=int))
+            if Kind == 'Vanish':
+                Kept[Shapes] = False
+            elif Kind == 'ValueChange':
+                Add[Shapes] += Operation[2] * self.val
+            elif Kind == 'Move':
+                Offset[Shapes] += np.array(Operation[2], dtype=int)
+                Moving = True
+            else:
+                raise ValueError('unknown operation ' + str(Kind))
+        
+        #moves of the kept shapes, failed ones are put back until nothing overlaps anymore
+        m1 = np.where(Kept, Offset[:,0], 0)
+        m2 = np.where(Kept, Offset[:,1], 0)
+        Moved = (m1 != 0) | (m2 != 0)
+        Left = Kept[Ids]
+        rows = Pixels // NWorldFine[1]
+        cols = Pixels % NWorldFine[1]
+        R = rows + m1[Ids]
+        K = cols + m2[Ids]
+        outside = (R < 0) | (R > NWorldFine[0]-1) | (K < 0) | (K > NWorldFine[1]-1)
+        Failed = Moved & (np.bincount(Ids, weights=outside, minlength=n) > 0)
+        while True:
+            m1[Failed] = 0
+            m2[Failed] = 0
+            Target = (rows + m1[Ids])*NWorldFine[1] + cols + m2[Ids]
+            clash = Left & (np.bincount(Target[Left], minlength=Size)[Target] > 1)
+            Clashed = Moved & ~Failed & (np.bincount(Ids, weights=clash, minlength=n) > 0)
+            if not np.any(Clashed):
+                break
+            Failed |= Clashed
+        
+        #one scatter for all operations
+        Values = C.flat[Pixels] + Add[Ids]
+        C.flat[Pixels] = self.bg
+        C.flat[Target[Left]] = Values[Left]
+        
+        if Moving:
+            Failures = Failed.astype(int)
+            if not Original and self.MoveFailures is not None:
+                Failures += self.MoveFailures
+            self.MoveFailures = Failures
+            self.nomore = np.sum(Failed)
+        
+        Labels = -np.ones(NWorldFine, dtype=np.int32)
+        Labels.flat[Target[Left]] = Ids[Left]
+        self.RandomLabels = Labels
+        
+        #the pixels of the vanished, changed and moved shapes and the targets of the moved ones
+        Changed = (~Kept | (Add != 0) | (m1 != 0) | (m2 != 0))[Ids]
+        self.ChangedCells = np.concatenate((Pixels[Changed], Target[Changed & Left]))
+        return self.Perturbed(C, Original, Delta, self.ChangedCells)
+    
+        ###################################### COMPACT #############################################
+    def Compact(self, Original=True, PerShape=True):
+        '''
+        Matrix (RandomMatrix if not Original) as a CompactCoefficient: a phase per cell and a table of values. 
+        PerShape = if true (and the label map is known) every shape gets its own phases, 
+                   such that value changes of shapes are edits of the table (see ChangeShapes)
+        '''
+        if Original:
+            C, Labels = self.Matrix, self.ShapeLabels
+        else:
+            C, Labels = self.RandomMatrix, self.RandomLabels
+        if not PerShape:
+            Labels = None
+        return CompactCoefficient.FromMatrix(C, Labels)
+    
+        ###################################### STATISTICS ##########################################
+    def CoarseStatistics(self, NCoarseElement=None):
+        '''
+        StatisticsPyramid of RandomMatrix with coarse elements of NCoarseElement fine cells (rows, columns). 
+        It is kept and updated by every perturbation, a new NCoarseElement starts a new one.
+        '''
+        if NCoarseElement is not None:
+            self.Statistics = StatisticsPyramid(self.RandomMatrix, NCoarseElement)
+        assert(self.Statistics is not None)
+        if self.Statistics.Source is not self.RandomMatrix:
+            #RandomMatrix was replaced without a perturbation (e.g. a new build)
+            self.Statistics = StatisticsPyramid(self.RandomMatrix, self.Statistics.NCoarseElement)
+        return self.Statistics
+    
+        ###################################### DELTAS ##############################################
+    def Perturbed(self, C, Original, Delta=None, Indices=None):
+        '''
+        remembers the perturbed coefficient C as RandomMatrix and returns it, or with Delta its
+        difference to the coefficient it was made from (see DeltaOf). Batches of samples are not remembered.
+        Indices = if given, the flat indices of the cells in which C may differ from the coefficient 
+                  it was made from (e.g. ChangedCells of the kernels), then nothing is compared in full
+        '''
+        if self.SparseSamples:
+            return C
+        Base = self.Matrix if Original else self.RandomMatrix
+        if np.ndim(C) == 3:
+            if Delta:
+                return [self.DeltaOf(Base, X) for X in C]
+            return C
+        if self.Statistics is not None and self.Statistics.Source is self.RandomMatrix:
+            self.Statistics.Update(C, Indices, Base)
+        self.RandomMatrix = C
+        if Delta:
+            return self.DeltaOf(Base, C, Indices)
+        return C
+
+    def DeltaOf(self, Base, New, Indices=None):
+        '''
+        sparse difference of New to Base: [Indices, Old, New, Boxes] with the changed flat indices,
+        their old and new values and one box [r0,r1,c0,c1] per connected changed region. 
+        Indices = if given, the only cells that may have changed, None: all cells are compared
+        '''
+        Base = np.asarray(Base)
+        New = np.asarray(New)
+        if Indices is None:
+            Indices = np.flatnonzero(New != Base)
+        else:
+            Indices = np.unique(Indices)
+            Indices = Indices[New.flat[Indices] != Base.flat[Indices]]
+        return [Indices, Base.flat[Indices], New.flat[Indices], self.ChangedBoxes(Indices, np.shape(Base))]
+    
+    @staticmethod
+    def ChangedBoxes(Indices, Shape):
+        '''
+        one box [r0,r1,c0,c1] per connected region (with diagonal neighbours) of the cells with the flat 
+        Indices in a grid of the given Shape, ordered like the labels of ndimage.label. The regions are 
+        found on the cells themselves, so it costs O(cells) and not O(grid).
+        '''
+        Indices = np.unique(Indices)
+        k = np.size(Indices)
+        if k == 0:
+            return np.zeros((0,4), dtype=int)
+        rows, cols = np.unravel_index(Indices, Shape)
+        
+        #edges to the changed neighbours on the right, below left, below and below right
+        From = []
+        To = []
+        for dr, dc in [(0,1), (1,-1), (1,0), (1,1)]:
+            r = rows + dr
+            c = cols + dc
+            inside = np.flatnonzero((r < Shape[0]) & (c >= 0) & (c < Shape[1]))
+            Neighbours = r[inside]*Shape[1] + c[inside]
+            Position = np.minimum(np.searchsorted(Indices, Neighbours), k-1)
+            found = Indices[Position] == Neighbours
+            From.append(inside[found])
+            To.append(Position[found])
+        From = np.concatenate(From)
+        To = np.concatenate(To)
+        Graph = sparse.coo_matrix((np.ones(np.size(From)), (From, To)), shape=(k,k))
+        n, Labels = csgraph.connected_components(Graph, directed=False)
+        
+        Boxes = np.zeros((n,4), dtype=int)
+        Boxes[:,0] = Shape[0]
+        Boxes[:,2] = Shape[1]
+        np.minimum.at(Boxes[:,0], Labels, rows)
+        np.maximum.at(Boxes[:,1], Labels, rows+1)
+        np.minimum.at(Boxes[:,2], Labels, cols)
+        np.maximum.at(Boxes[:,3], Labels, cols+1)
+        return Boxes
+
+    def ApplyDelta(self, Delta, Base=None):
+        '''
+        dense coefficient from a delta of DeltaOf, applied to Base (default: Matrix)
+        '''
+        if Base is None:
+            Base = self.Matrix
+        C = np.array(Base, copy=True)
+        C.flat[Delta[0]] = Delta[2]
+        return C
+
+        ###################################### SAMPLES #############################################
+    def SampleCoefficients(self, M, Kind='Vanish', Chunk=None, First=0, **Options):
+        '''
+        M perturbed coefficients in one vectorized pass. 
+        Kind = 'Vanish', 'ValueChange' or 'Move', the Options are the ones of 
+               RandomVanish, RandomValueChange or RandomMove
+        Chunk = if given, a generator of arrays with at most Chunk samples is returned 
+                instead of one (M, N0, N1) array
+        First = number of the first sample. With a Seed sample k is drawn from the 
+                child stream k, so it does not depend on the chunks or on the process.
+        '''
+        if Chunk is None:
+            return self.SampleChunk(Kind, First, M, Options)
+        return self.SampleChunks(Kind, M, Chunk, First, Options)
+    
+    def SampleChunks(self, Kind, M, Chunk, First, Options):
+        for start in range(0, M, Chunk):
+            yield self.SampleChunk(Kind, First+start, min(Chunk, M-start), Options)
+    
+    def SampleChunk(self, Kind, First, M, Options):
+        '''
+        the samples First, ..., First+M-1
+        '''
+        if self.Seed is not None:
+            self.SampleSeeds = range(First, First+M)
+        try:
+            return getattr(self, 'Random' + Kind)(Vectorized=True, Samples=M, **Options)
+        finally:
+            self.SampleSeeds = None
+    
+    def PerturbationStream(self, M=None, Kind='Vanish', First=0, Boxes=None, **Options):
+        '''
+        generator of perturbed coefficients with bounded memory for long Monte Carlo runs. 
+        Yields (Sample, C, Delta, Meta) for the samples First, ..., First+M-1 (endless if M is None):
+        C     = read only view of one buffer, which is valid until the next sample is drawn 
+                (copy it to keep it)
+        Delta = [Indices, Old, New, Boxes] of C to Matrix as in DeltaOf, Boxes only with Boxes=True 
+                (labelling the changes costs a pass over the grid) and None otherwise
+        Meta  = dict with Kind, the number of changed cells and for moves the failed ones
+        Kind and Options are the ones of SampleCoefficients, the samples start from Matrix. 
+        Only the changed cells are written and reset between the samples, with a Seed sample k 
+        is the one of SampleCoefficients.
+        '''
+        assert(self.RandomMatrix is not None)
+        Perturbation = getattr(self, 'Random' + Kind)
+        Base = self.Matrix
+        Buffer = Base.copy()
+        View = Buffer.view()
+        View.flags.writeable = False
+        Changed = np.zeros(0, dtype=int)
+        Sample = First
+        while M is None or Sample < First + M:
+            Buffer.flat[Changed] = Base.flat[Changed]
+            if self.Seed is not None:
+                self.SampleSeeds = [Sample]
+            self.SparseSamples = True
+            try:
+                Indices, Values = Perturbation(Vectorized=True, Samples=1, Original=True, **Options)[0]
+            finally:
+                self.SampleSeeds = None
+                self.SparseSamples = None
+            
+            #the last write of a cell counts, unchanged cells are left out
+            Changed, Last = np.unique(Indices[::-1], return_index=True)
+            Values = Values[::-1][Last]
+            Differs = Values != Base.flat[Changed]
+            Changed = Changed[Differs]
+            Buffer.flat[Changed] = Values[Differs]
+            
+            Delta = [Changed, Base.flat[Changed], Buffer.flat[Changed], None]
+            if Boxes:
+                Delta[3] = self.ChangedBoxes(Changed, np.shape(Base))
+            Meta = {'Kind': Kind, 'Cells': np.size(Changed)}
+            if Kind == 'Move':
+                Meta['Failures'] = int(self.nomore)
+            yield Sample, View, Delta, Meta
+            Sample += 1
+
+
+class GaussianCoefficient2d:
+    #how often the periodic grid of the embedding is doubled at most
+    MaxDoublings = 3
+    
+    def __init__(self, NWorldFine, 
+                    CorrelationLength=0.1, 
+                    Variance=1., 
+                    Mean=0., 
+                    Covariance='Exponential', 
+                    Threshold=None, 
+                    bg=0.01, 
+                    val=1, 
+                    Seed=None):
+        '''
+        coefficient exp(Y) for a stationary gaussian random field Y on the fine cells of [0,1]^2. 
+        The covariance is embedded in a periodic grid of at least twice the size, where the FFT 
+        diagonalizes it (circulant embedding), so one sample costs O(N log N).
+        CorrelationLength = in units of the domain
+        Covariance = 'Exponential': Variance*exp(-r/CorrelationLength) 
+                     'Gaussian':    Variance*exp(-(r/CorrelationLength)**2)
+        Threshold = if given the two phase coefficient with val where Y > Threshold and bg elsewhere
+        Seed = as for Coefficient2d. One FFT gives the samples 2p and 2p+1, which are drawn 
+               from the child stream Seed + [p]. None: the global np.random
+        '''
+        assert(Covariance in ['Exponential', 'Gaussian'])
+        self.NWorldFine = np.array(NWorldFine)
+        self.CorrelationLength = CorrelationLength
+        self.Variance = Variance
+        self.Mean = Mean
+        self.Covariance = Covariance
+        self.Threshold = Threshold
+        self.bg = bg
+        self.val = val
+        self.Seed = Seed
         
-        valuecounter = 0
-        for i in range(0,NWorldFine[0]):
-            for j in range(0,NWorldFine[1]):
-                if A[i][j] == 1:
-                    valuecounter += 1
-                    NumberList = filter(lambda x: x == valuecounter,Number)
-                    if np.size(NumberList) == 1:
-                        if Vanish:
-                            A[i][j] = bg
-                        if ValueChange is not None:    
-                            A[i][j] = ValueChange
-                        if Move is not None:    
-                            if Move[0]+i > -1 and Move[0]+i < NWorldFine[0] and Move[1]+j > -1 and Move[1]+j < NWorldFine[1]:
-                                A[i+Move[0]][j+Move[1]] = A[i][j]  
-                                A[i][j] = bg
-        
-        self.RandomMatrix = A
-        return A
-        
\ No newline at end of file
+        self.Matrix = None
+        self.RandomMatrix = None
+        self.EmbeddingSize = None
+        self.SqrtEigenvalues = None
+    
+    def CovarianceFunction(self, r):
+        if self.Covariance == 'Exponential':
+            return self.Variance*np.exp(-r/float(self.CorrelationLength))
+        return self.Variance*np.exp(-(r/float(self.CorrelationLength))**2)
+    
+    def Embedding(self):
+        '''
+        square roots of the (scaled) eigenvalues of the circulant embedding. The periodic grid is 
+        doubled (up to MaxDoublings times) until they are nonnegative. If they are not by then, the 
+        negative ones are set to zero with a warning and the samples only approximate the covariance.
+        '''
+        if self.SqrtEigenvalues is not None:
+            return self.SqrtEigenvalues
+        h = 1./self.NWorldFine
+        Size = 2*self.NWorldFine
+        for attempt in range(0, self.MaxDoublings+1):
+            if attempt > 0:
+                Size = 2*Size
+            d0 = np.minimum(np.arange(Size[0]), Size[0]-np.arange(Size[0]))*h[0]
+            d1 = np.minimum(np.arange(Size[1]), Size[1]-np.arange(Size[1]))*h[1]
+            Eigenvalues = np.fft.fft2(self.CovarianceFunction(np.hypot(d0[:,None], d1[None,:]))).real
+            if Eigenvalues.min() >= -1e-10*Eigenvalues.max():
+                break
+        else:
+            warnings.warn('circulant embedding of size %s is not nonnegative (smallest eigenvalue %g of %g), '
+                          'the negative eigenvalues are set to zero' % ([int(x) for x in Size], Eigenvalues.min(), Eigenvalues.max()))
+        self.EmbeddingSize = Size
+        self.SqrtEigenvalues = np.sqrt(np.maximum(Eigenvalues, 0)/np.prod(Size))
+        return self.SqrtEigenvalues
+    
+    def Fields(self, First, M):
+        '''
+        the gaussian fields Y of the samples First, ..., First+M-1 as (M, N0, N1) array
+        '''
+        Sqrt = self.Embedding()
+        N0, N1 = self.NWorldFine
+        Pairs = range(First//2, (First+M-1)//2+1)
+        Z = np.empty((len(Pairs),) + tuple(self.EmbeddingSize), dtype=complex)
+        for k, p in enumerate(Pairs):
+            if self.Seed is None:
+                Generator = np.random
+            else:
+                Generator = np.random.RandomState(Coefficient2d.SeedState(list(np.atleast_1d(self.Seed)) + [p]))
+            Z[k].real = Generator.standard_normal(self.EmbeddingSize)
+            Z[k].imag = Generator.standard_normal(self.EmbeddingSize)
+        X = np.fft.fft2(Sqrt*Z, axes=(-2,-1))[:,:N0,:N1]
+        Y = np.empty((2*len(Pairs), N0, N1))
+        Y[0::2] = X.real
+        Y[1::2] = X.imag
+        Offset = First - 2*Pairs[0]
+        return self.Mean + Y[Offset:Offset+M]
+    
+    def Coefficients(self, Y):
+        if self.Threshold is None:
+            return np.exp(Y)
+        return np.where(Y > self.Threshold, self.val, self.bg)
+    
+    def BuildCoefficient(self):
+        '''
+        sample 0 as Matrix and RandomMatrix, such that it replaces a Coefficient2d
+        '''
+        self.Matrix = self.SampleCoefficients(1)[0]
+        self.RandomMatrix = self.Matrix.copy()
+        return self.Matrix
+    
+    def SampleCoefficients(self, M, Chunk=None, First=0):
+        '''
+        M coefficients as (M, N0, N1) array.
+        Chunk = if given, a generator of arrays with at most Chunk samples is returned 
+        First = number of the first sample. With a Seed the samples do not depend on the chunks.
+        '''
+        if Chunk is None:
+            return self.Coefficients(self.Fields(First, M))
+        return self.SampleChunks(M, Chunk, First)
+    
+    def SampleChunks(self, M, Chunk, First):
+        for start in range(0, M, Chunk):
+            yield self.Coefficients(self.Fields(First+start, min(Chunk, M-start)))
+
+
+class OccupancyIndex:
+    #footprints with fewer cells are not indexed
+    MinArea = 20
+    
+    def __init__(self, A, TileSize=32):
+        '''
+        summed-area tables of the occupied cells (A != 0) for O(1) fit checks. 
+        
+        The tables are kept for blocks of TileSize x TileSize cells, such that stamping 
+        a shape only recomputes the few blocks it touches. Diagonal shapes are no 
+        rectangles in the grid, but they are in the sheared frames 
+            frame 0: (r, c)    frame 1: (r-c, c)    frame 2: (r-c, r)
+            frame 3: (r+c, c)  frame 4: (r+c, r)
+        which are built when they are used the first time. 
+        '''
+        self.A = A
+        self.NWorldFine = np.shape(A)
+        self.T = TileSize
+        
+        #frame: [occupancy, tables]
+        self.Frames = [None]*5
+    
+    @staticmethod
+    def Transform(frame, r, c, N1):
+        #N1 shifts r-c to nonnegative values
+        if frame == 0:
+            return r, c
+        elif frame == 1:
+            return r-c+N1-1, c
+        elif frame == 2:
+            return r-c+N1-1, r
+        elif frame == 3:
+            return r+c, c
+        elif frame == 4:
+            return r+c, r
+    
+    def Frame(self, frame):
+        if self.Frames[frame] is not None:
+            return self.Frames[frame]
+        
+        N0, N1 = self.NWorldFine
+        T = self.T
+        if frame == 0:
+            size = [N0, N1]
+        elif frame == 1 or frame == 3:
+            size = [N0+N1-1, N1]
+        else:
+            size = [N0+N1-1, N0]
+        
+        #pad up to full blocks
+        nU = -(-size[0]//T)
+        nV = -(-size[1]//T)
+        Occ = np.zeros([nU*T, nV*T], dtype=np.int16)
+        r, c = np.nonzero(self.A)
+        U, V = self.Transform(frame, r, c, N1)
+        Occ[U,V] = 1
+        
+        Tables = np.zeros([nU, nV, T+1, T+1], dtype=np.int32)
+        Blocks = Occ.reshape(nU, T, nV, T).transpose(0, 2, 1, 3)
+        Tables[:,:,1:,1:] = Blocks.cumsum(axis=2).cumsum(axis=3)
+        
+        self.Frames[frame] = [Occ, Tables]
+        return self.Frames[frame]
+        
+    def Sum(self, frame, U0, U1, V0, V1):
+        '''
+        number of occupied cells in [U0,U1) x [V0,V1) of a frame
+        '''
+        Occ, Tables = self.Frame(frame)
+        T = self.T
+        tu, tv = U0//T, V0//T
+        if (U1-1)//T == tu and (V1-1)//T == tv:
+            #inside one block
+            a0, a1, b0, b1 = U0-tu*T, U1-tu*T, V0-tv*T, V1-tv*T
+            S = Tables[tu,tv]
+            return S[a1,b1] - S[a0,b1] - S[a1,b0] + S[a0,b0]
+        
+        result = 0
+        for tu in range(U0//T, (U1-1)//T+1):
+            a0 = max(U0-tu*T, 0)
+            a1 = min(U1-tu*T, T)
+            for tv in range(V0//T, (V1-1)//T+1):
+                b0 = max(V0-tv*T, 0)
+                b1 = min(V1-tv*T, T)
+                S = Tables[tu,tv]
+                result += S[a1,b1] - S[a0,b1] - S[a1,b0] + S[a0,b0]
+        return result
+    
+    def IsFree(self, Footprint, i, j):
+        '''
+        1 if no cell of the footprint at anchor (i,j) is occupied, 0 otherwise. 
+        None if the footprint is not known or leaves the grid.
+        '''
+        if Footprint is None:
+            return None
+        frame, U0, U1, V0, V1, r0, r1, c0, c1 = Footprint
+        N0, N1 = self.NWorldFine
+        if i+r0 < 0 or i+r1 > N0 or j+c0 < 0 or j+c1 > N1:
+            return None
+        
+        U, V = self.Transform(frame, i, j, N1)
+        if self.Sum(frame, U+U0, U+U1, V+V0, V+V1) == 0:
+            return 1
+        return 0
+    
+    def Update(self, r0, r1, c0, c1):
+        '''
+        takes over the cells [r0,r1) x [c0,c1) of A after they changed
+        '''
+        N1 = self.NWorldFine[1]
+        T = self.T
+        if r1-r0 == 1 and c1-c0 == 1:
+            #one cell, shift the tables behind it
+            cell = int(self.A[r0,c0] != 0)
+            for frame in range(0,5):
+                if self.Frames[frame] is None:
+                    continue
+                Occ, Tables = self.Frames[frame]
+                U, V = self.Transform(frame, r0, c0, N1)
+                delta = cell - Occ[U,V]
+                if delta != 0:
+                    Occ[U,V] = cell
+                    Tables[U//T,V//T,U%T+1:,V%T+1:] += delta
+            return
+        
+        Cells = self.A[r0:r1,c0:c1] != 0
+        r = np.arange(r0,r1)[:,np.newaxis]
+        c = np.arange(c0,c1)[np.newaxis,:]
+        for frame in range(0,5):
+            if self.Frames[frame] is None:
+                continue
+            Occ, Tables = self.Frames[frame]
+            U, V = np.broadcast_arrays(*self.Transform(frame, r, c, N1))
+            
+            #only cells that really change
+            Changed = Occ[U,V] != Cells
+            if not Changed.any():
+                continue
+            U = U[Changed]
+            V = V[Changed]
+            Occ[U,V] = Cells[Changed]
+            
+            #recompute the touched blocks
+            for tu in range(U.min()//T, U.max()//T+1):
+                for tv in range(V.min()//T, V.max()//T+1):
+                    Block = Occ[tu*T:(tu+1)*T, tv*T:(tv+1)*T]
+                    Tables[tu,tv,1:,1:] = Block.cumsum(axis=0).cumsum(axis=1)
+
+
+class ChannelClearance:
+    def __init__(self, CS, O, bg):
+        '''
+        run lengths of the channel randomizers in the frame of vertical channels, i.e. one-sided 
+        distance transforms of the free (bg or 0) and occupied cells along the rows and columns:
+            Left/Right  free cells of CS ending/starting at (r,c) in the row
+            Up/Down     occupied cells of CS ending/starting at (r,c) in the column
+            OLeft/ORight free cells of the original O, Thick the occupied cells of O starting at (r,c)
+        Clear keeps them up to date when a channel part is removed from CS.
+        '''
+        self.CS = CS
+        self.N0, self.N1 = np.shape(CS)
+        self.Free = (CS == bg) | (CS == 0)
+        OFree = (O == bg) | (O == 0)
+        self.Left = self.Runs(self.Free, 1)
+        self.Right = self.Runs(self.Free, 1, Reverse=True)
+        self.Up = self.Runs(~self.Free, 0)
+        self.Down = self.Runs(~self.Free, 0, Reverse=True)
+        self.OLeft = self.Runs(OFree, 1)
+        self.ORight = self.Runs(OFree, 1, Reverse=True)
+        self.Thick = self.Runs(~OFree, 1, Reverse=True)
+    
+    @staticmethod
+    def Runs(M, axis, Reverse=False):
+        '''
+        number of consecutive True cells of M ending at each cell along axis (starting at it with Reverse)
+        '''
+        M = np.moveaxis(M, axis, 1)
+        if Reverse:
+            M = M[:,::-1]
+        Index = np.arange(np.shape(M)[1])
+        Last = np.maximum.accumulate(np.where(M, -1, Index), axis=1)
+        R = np.where(M, Index - Last, 0)
+        if Reverse:
+            R = R[:,::-1]
+        return np.ascontiguousarray(np.moveaxis(R, 1, axis))
+    
+    def Space(self, i, c, thick, Up, Right):
+        '''
+        free space next to the thick rows above (Up) or below row i, from column c to the left or right. 
+        As in the loops of the randomizers: full free columns count 1, the free cells of the first 
+        blocked column count 1/thick and only the first column counts if the rows leave the grid.
+        '''
+        N0, N1 = self.N0, self.N1
+        if c < 0 or c >= N1:
+            return 0.
+        if Up:
+            r0, r1 = i-thick+1, i+1
+        else:
+            r0, r1 = i, i+thick
+        if r0 < 0 or r1 > N0:
+            return float(np.count_nonzero(self.Free[max(r0,0):min(r1,N0),c]))/thick
+        
+        Runs = self.Right if Right else self.Left
+        K = int(Runs[r0:r1,c].min())
+        total = K*thick
+        c = c+K if Right else c-K
+        if c >= 0 and c < N1:
+            total += np.count_nonzero(self.Free[r0:r1,c])
+        return float(total)/thick
+    
+    def Clear(self, r0, r1, c0, c1):
+        '''
+        frees the cells [r0,r1) x [c0,c1) of CS and updates the runs through them
+        '''
+        N0, N1 = self.N0, self.N1
+        self.CS[r0:r1,c0:c1] = 0
+        self.Free[r0:r1,c0:c1] = True
+        
+        #free runs in the rows now pass through [c0,c1)
+        for r in range(r0,r1):
+            a = c0 - (self.Left[r,c0-1] if c0 > 0 else 0)
+            b = c1 + (self.Right[r,c1] if c1 < N1 else 0)
+            self.Left[r,a:b] = np.arange(1, b-a+1)
+            self.Right[r,a:b] = np.arange(b-a, 0, -1)
+        
+        #occupied runs in the columns end at the cleared rows
+        for c in range(c0,c1):
+            a = r0 - (self.Up[r0-1,c] if r0 > 0 else 0)
+            b = r1 + (self.Down[r1,c] if r1 < N0 else 0)
+            self.Up[r0:r1,c] = 0
+            self.Down[r0:r1,c] = 0
+            self.Up[r1:b,c] = np.arange(1, b-r1+1)
+            self.Down[a:r0,c] = np.arange(r0-a, 0, -1)
+
+
+class TiledCoefficient:
+    def __init__(self, Coefficient, NCoarseElement, Folder, TileCoarse=[8,8]):
+        '''
+        the coefficient of Coefficient (not built, NWorldFine may be too large for the memory) stored per 
+        coarse element in Folder/Blocks.npy, a memory mapped array [block row, block column, row, column]. 
+        
+        The fine grid is generated lazily in tiles of TileCoarse coarse elements when a patch needs them. 
+        Every tile is built on its own as a Coefficient2d with the stream Seed + [tile number] 
+        (see SeedStreams), hence the tiles do not depend on the order they are built in, but the shapes 
+        do not continue over the tile borders. Tiles that are already built are marked in Folder/Tiles.npy 
+        and reused as long as the coefficient is the same (see CacheKey).
+        NCoarseElement = fine cells per coarse element in the order of the rows and columns of Matrix
+        '''
+        assert(not Coefficient.ChannelVertical and not Coefficient.ChannelHorizontal)
+        self.Coefficient = Coefficient
+        self.NWorldFine = np.array(Coefficient.NWorldFine, dtype=int)
+        self.NCoarseElement = np.array(NCoarseElement, dtype=int)
+        self.NWorldCoarse = self.NWorldFine // self.NCoarseElement
+        assert(np.all(self.NWorldCoarse * self.NCoarseElement == self.NWorldFine))
+        self.TileCoarse = np.minimum(np.array(TileCoarse, dtype=int), self.NWorldCoarse)
+        self.NTiles = -(-self.NWorldCoarse // self.TileCoarse)
+        self.Seed = [] if Coefficient.Seed is None else [int(x) for x in np.atleast_1d(Coefficient.Seed)]
+        self.Folder = Folder
+        
+        Shape = tuple(int(x) for x in np.concatenate((self.NWorldCoarse, self.NCoarseElement)))
+        Key = Coefficient.CacheKey() + repr((Shape, self.TileCoarse.tolist()))
+        if not os.path.isdir(Folder):
+            os.makedirs(Folder)
+        Blocks = os.path.join(Folder, 'Blocks.npy')
+        Tiles = os.path.join(Folder, 'Tiles.npy')
+        KeyFile = os.path.join(Folder, 'Key.txt')
+        
+        Reuse = os.path.exists(KeyFile) and os.path.exists(Blocks) and os.path.exists(Tiles)
+        if Reuse:
+            with open(KeyFile) as File:
+                Reuse = File.read() == Key
+        if Reuse:
+            self.Blocks = np.load(Blocks, mmap_mode='r+')
+            self.Tiles = np.load(Tiles, mmap_mode='r+')
+        else:
+            self.Blocks = np.lib.format.open_memmap(Blocks, mode='w+', dtype=float, shape=Shape)
+            self.Tiles = np.lib.format.open_memmap(Tiles, mode='w+', dtype=np.uint8, shape=tuple(self.NTiles.tolist()))
+            with open(KeyFile, 'w') as File:
+                File.write(Key)
+    
+    def BuildTile(self, a, b):
+        '''
+        builds tile (a,b) and writes it to the blocks
+        '''
+        T0, T1 = self.TileCoarse
+        n0, n1 = self.NCoarseElement
+        r0, c0 = a*T0, b*T1
+        r1, c1 = min(r0+T0, self.NWorldCoarse[0]), min(c0+T1, self.NWorldCoarse[1])
+        
+        Tile = copy.copy(self.Coefficient)
+        Tile.NWorldFine = np.array([(r1-r0)*n0, (c1-c0)*n1])
+        Tile.Seed = self.Seed + [int(a*self.NTiles[1] + b)]
+        Tile.Periodic = None
+        Tile.BuildCoefficient()
+        
+        self.Blocks[r0:r1,c0:c1] = Tile.Matrix.reshape(r1-r0, n0, c1-c0, n1).transpose(0,2,1,3)
+        self.Tiles[a,b] = 1
+    
+    def Patch(self, iPatchCoarse, NPatchCoarse):
+        '''
+        dense fine coefficient of the coarse elements [i0, i0+N0) x [i1, i1+N1), 
+        only the tiles below the patch are built and read
+        '''
+        i0, i1 = [int(x) for x in iPatchCoarse]
+        N0, N1 = [int(x) for x in NPatchCoarse]
+        T0, T1 = self.TileCoarse
+        for a in range(i0//T0, (i0+N0-1)//T0+1):
+            for b in range(i1//T1, (i1+N1-1)//T1+1):
+                if not self.Tiles[a,b]:
+                    self.BuildTile(a, b)
+        
+        n0, n1 = self.NCoarseElement
+        Blocks = np.array(self.Blocks[i0:i0+N0,i1:i1+N1])
+        return Blocks.transpose(0,2,1,3).reshape(N0*n0, N1*n1)
+    
+    def localize(self, iSubWorldCoarse, NSubWorldCoarse):
+        '''
+        the patch as a coefficient like gridlod's coefficientFine.localize. 
+        gridlod counts [x, y], that is [column, row] of the Matrix.
+        '''
+        Fine = self.Patch(np.array(iSubWorldCoarse)[::-1], np.array(NSubWorldCoarse)[::-1])
+        return PatchCoefficient(np.array(NSubWorldCoarse), self.NCoarseElement[::-1], Fine.flatten())
+
+
+class PatchCoefficient:
+    def __init__(self, NWorldCoarse, NCoarseElement, aFine):
+        '''
+        a coefficient in memory in the [x, y] order of gridlod (aFine runs along x first)
+        '''
+        self.NWorldCoarse = NWorldCoarse
+        self.NCoarseElement = NCoarseElement
+        self.aFine = aFine
+    
+    def localize(self, iSubWorldCoarse, NSubWorldCoarse):
+        N = self.NWorldCoarse * self.NCoarseElement
+        i = np.array(iSubWorldCoarse) * self.NCoarseElement
+        n = np.array(NSubWorldCoarse) * self.NCoarseElement
+        Fine = self.aFine.reshape(N[1], N[0])[i[1]:i[1]+n[1],i[0]:i[0]+n[0]]
+        return PatchCoefficient(np.array(NSubWorldCoarse), self.NCoarseElement, Fine.flatten())
+
+
+class CompactCoefficient:
+    def __init__(self, Phases, Values, PhaseShapes=None):
+        '''
+        a coefficient with few values: the phase of every fine cell (uint8, uint16 or uint32, 
+        whatever suffices) and the table Values of the phases. The float64 matrix is only 
+        made by Expand. PhaseShapes gives the shape of every phase (-1: none or unknown).
+        '''
+        self.Phases = Phases
+        self.Values = np.array(Values, dtype=float)
+        if PhaseShapes is None:
+            PhaseShapes = -np.ones(np.size(self.Values), dtype=int)
+        self.PhaseShapes = np.array(PhaseShapes, dtype=int)
+        self.Expanded = None
+    
+    @staticmethod
+    def PhaseType(n):
+        '''
+        smallest unsigned integer type for n phases
+        '''
+        for Type in [np.uint8, np.uint16, np.uint32]:
+            if n <= np.iinfo(Type).max + 1:
+                return Type
+        return np.uint64
+    
+    @staticmethod
+    def FromMatrix(C, Labels=None):
+        '''
+        the phases of C are its distinct values, or the distinct pairs of shape label and value
+        '''
+        Values, Inverse = np.unique(C, return_inverse=True)
+        Inverse = Inverse.reshape(np.shape(C))
+        if Labels is None:
+            return CompactCoefficient(Inverse.astype(CompactCoefficient.PhaseType(np.size(Values))), Values)
+        
+        Pairs = (np.asarray(Labels, dtype=np.int64) + 1) * np.size(Values) + Inverse
+        Keys, Phases = np.unique(Pairs, return_inverse=True)
+        Phases = Phases.reshape(np.shape(C)).astype(CompactCoefficient.PhaseType(np.size(Keys)))
+        return CompactCoefficient(Phases, Values[Keys % np.size(Values)], Keys // np.size(Values) - 1)
+    
+    def Expand(self):
+        '''
+        the float64 matrix, made once and kept until the next change (do not write into it)
+        '''
+        if self.Expanded is None:
+            self.Expanded = self.Values[self.Phases]
+        return self.Expanded
+    
+    def Phase(self, Value, Shape=-1):
+        '''
+        number of a phase with this value and shape, a new one is added if there is none
+        '''
+        Found = np.flatnonzero((self.Values == Value) & (self.PhaseShapes == Shape))
+        if np.size(Found) > 0:
+            return Found[0]
+        self.Values = np.append(self.Values, Value)
+        self.PhaseShapes = np.append(self.PhaseShapes, Shape)
+        Type = self.PhaseType(np.size(self.Values))
+        if Type != self.Phases.dtype:
+            self.Phases = self.Phases.astype(Type)
+        return np.size(self.Values) - 1
+    
+    def SetValue(self, Phase, Value):
+        '''
+        changes the value of all cells of a phase
+        '''
+        self.Values[Phase] = Value
+        self.Expanded = None
+    
+    def ChangeShapes(self, Shapes, Add):
+        '''
+        adds Add to the values of the shapes, only the table changes
+        '''
+        Changed = np.isin(self.PhaseShapes, Shapes) & (self.PhaseShapes > -1)
+        self.Values[Changed] += Add
+        self.Expanded = None
+    
+    def Assign(self, Cells, Value):
+        '''
+        sets the cells (flat indices) to Value, in a phase that belongs to no shape
+        '''
+        Phase = self.Phase(Value)
+        self.Phases.flat[Cells] = Phase
+        self.Expanded = None
+    
+    def Canonical(self):
+        '''
+        the same coefficient with one phase per value that is used, sorted by value
+        '''
+        Used = np.flatnonzero(np.bincount(self.Phases.ravel(), minlength=np.size(self.Values)))
+        Values, Inverse = np.unique(self.Values[Used], return_inverse=True)
+        Map = np.zeros(np.size(self.Values), dtype=self.PhaseType(np.size(Values)))
+        Map[Used] = Inverse
+        return Map[self.Phases], Values
+    
+    def Hash(self):
+        '''
+        sha256 of the canonical form, equal coefficients have the same hash
+        '''
+        Phases, Values = self.Canonical()
+        Digest = hashlib.sha256(repr(np.shape(Phases)).encode('ascii'))
+        Digest.update(Values.tobytes())
+        Digest.update(np.ascontiguousarray(Phases).tobytes())
+        return Digest.hexdigest()
+    
+    def Equals(self, Other):
+        '''
+        true if both give the same matrix, compared on the phases
+        '''
+        if np.shape(self.Phases) != np.shape(Other.Phases):
+            return False
+        Phases, Values = self.Canonical()
+        OtherPhases, OtherValues = Other.Canonical()
+        return np.array_equal(Values, OtherValues) and np.array_equal(Phases, OtherPhases)
+
+
+class StatisticsPyramid:
+    def __init__(self, C, NCoarseElement):
+        '''
+        min, max, sum, sum of the inverses and number of the fine cells of C per coarse element (level 0) 
+        and per 2^l x 2^l coarse elements (level l, up to a single node). Row l of Min, Max, Sum, 
+        InvSum and Count is an array over the nodes of level l, level 0 flattened is in the order 
+        of the coarse elements of gridlod (TInd). 
+        Update takes over a changed C and only reads the coarse elements with changed cells.
+        '''
+        self.NCoarseElement = np.array(NCoarseElement, dtype=int)
+        self.NWorldCoarse = np.array(np.shape(C)) // self.NCoarseElement
+        assert(np.all(self.NWorldCoarse * self.NCoarseElement == np.shape(C)))
+        self.Source = C
+        #(Base, Indices): the source differs from Base at most in the cells Indices (see Update)
+        self.Deviation = None
+        
+        n0, n1 = self.NCoarseElement
+        M0, M1 = self.NWorldCoarse
+        Cells = np.reshape(C, (M0, n0, M1, n1))
+        self.Min = [Cells.min(axis=(1,3))]
+        self.Max = [Cells.max(axis=(1,3))]
+        self.Sum = [Cells.sum(axis=(1,3))]
+        self.InvSum = [(1./Cells).sum(axis=(1,3))]
+        self.Count = [np.full((M0, M1), n0*n1)]
+        while np.prod(np.shape(self.Min[-1])) > 1:
+            for Level, Reduce, Neutral in self.Reductions():
+                Level.append(self.Coarsen(Level[-1], Reduce, Neutral))
+    
+    def Reductions(self):
+        #the levels of every statistic, how nodes are combined and the neutral element
+        return [[self.Min, np.min, np.inf], [self.Max, np.max, -np.inf], [self.Sum, np.sum, 0], 
+                [self.InvSum, np.sum, 0], [self.Count, np.sum, 0]]
+    
+    @staticmethod
+    def Coarsen(X, Reduce, Neutral):
+        '''
+        the next level: 2 x 2 nodes to one, odd sizes padded with Neutral
+        '''
+        M0, M1 = np.shape(X)
+        P = np.full((M0 + M0 % 2, M1 + M1 % 2), Neutral, dtype=X.dtype)
+        P[0:M0,0:M1] = X
+        return Reduce(P.reshape(np.shape(P)[0]//2, 2, np.shape(P)[1]//2, 2), axis=(1,3))
+    
+    def Update(self, C, Indices=None, Base=None):
+        '''
+        takes over C: the coarse elements with cells that differ from the current source are 
+        recomputed, the upper levels are coarsened again. 
+        Indices = if given, the flat indices of the cells in which C may differ from Base, 
+                  otherwise C is compared with the source in full
+        Base = the coefficient Indices refer to (default: the current source). The pyramid remembers 
+               in which cells its source differs from Base, so repeated perturbations of the same 
+               Base (e.g. Matrix with Original=True) need no full compare either
+        '''
+        n0, n1 = self.NCoarseElement
+        M0, M1 = self.NWorldCoarse
+        if Base is None:
+            Base = self.Source
+        if Indices is None:
+            Indices = np.flatnonzero(C != self.Source)
+            self.Deviation = None
+        elif Base is self.Source:
+            if self.Deviation is not None:
+                self.Deviation = (self.Deviation[0], np.union1d(self.Deviation[1], Indices))
+        else:
+            if self.Deviation is not None and self.Deviation[0] is Base:
+                Changed = np.union1d(self.Deviation[1], Indices)
+            else:
+                Changed = np.flatnonzero(C != self.Source)
+            self.Deviation = (Base, np.asarray(Indices, dtype=int))
+            Indices = Changed
+        self.Source = C
+        if np.size(Indices) == 0:
+            return
+        
+        rows, cols = np.unravel_index(Indices, np.shape(C))
+        Touched = np.unique((rows // n0) * M1 + cols // n1)
+        b0, b1 = Touched // M1, Touched % M1
+        Cells = np.reshape(C, (M0, n0, M1, n1))[b0,:,b1,:]
+        self.Min[0][b0,b1] = Cells.min(axis=(1,2))
+        self.Max[0][b0,b1] = Cells.max(axis=(1,2))
+        self.Sum[0][b0,b1] = Cells.sum(axis=(1,2))
+        self.InvSum[0][b0,b1] = (1./Cells).sum(axis=(1,2))
+        
+        for l in range(1, len(self.Min)):
+            for Level, Reduce, Neutral in self.Reductions():
+                Level[l] = self.Coarsen(Level[l-1], Reduce, Neutral)
+    
+    def ArithmeticMean(self, l=0):
+        return self.Sum[l] / self.Count[l]
+    
+    def HarmonicMean(self, l=0):
+        return self.Count[l] / self.InvSum[l]
+    
+    def Contrast(self, l=0):
+        return self.Max[l] / self.Min[l]
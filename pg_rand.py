@@ -4,13 +4,25 @@
 # License: BSD 2-Clause License (http://opensource.org/licenses/BSD-2-Clause)
 # This file is motivated by gridlod: https://github.com/TiKeil/gridlod.git
 
+from __future__ import print_function
+
 import numpy as np
 from copy import deepcopy
 import scipy.sparse as sparse
+import os
+import json
+import pickle
+import hashlib
+import shutil
+import tempfile
+import itertools
 
 from gridlod import lod, util, fem, ecworker, eccontroller
 
 class VcPetrovGalerkinLOD:
+    #version of the layout of the stored origin correctors (see saveOriginCorrectors)
+    storeVersion = 1
+    
     def __init__(self, origincoef, world, k, IPatchGenerator, printLevel=0):
         self.world = world
         NtCoarse = np.prod(world.NWorldCoarse)
@@ -32,6 +44,12 @@ class VcPetrovGalerkinLOD:
         self.K = None
         self.basisCorrectors = None
         
+        #origin correctors grouped by patch geometry (see indicatorGroups), the view they were sent to 
+        #and the prefix of their names on the engines
+        self.indicatorGroupList = None
+        self.indicatorView = None
+        self.indicatorName = None
+        
         #for testing
         self.currentTestingCorrector = None
         #coefficient without defects
@@ -39,7 +57,16 @@ class VcPetrovGalerkinLOD:
         
         eccontroller.clearWorkers()
         
-    def originCorrectors(self, clearFineQuantities=True):
+    def originCorrectors(self, clearFineQuantities=True, Cache=None):
+        '''
+        Cache = folder of stored origin correctors. They are loaded if they were stored for the same 
+                world, k, interpolation and coefficient (see originKey), otherwise they are computed and stored.
+        '''
+        if Cache is not None:
+            key = self.originKey(clearFineQuantities)
+            if self.loadOriginCorrectors(Cache, key):
+                return
+        
         world = self.world
         k = self.k
         IPatchGenerator = self.IPatchGenerator
@@ -55,12 +82,14 @@ class VcPetrovGalerkinLOD:
         self.basisCorrectors = None
         
         self.ecListOrigin = [None]*NtCoarse
+        self.indicatorGroupList = None
+        self.releaseIndicatorView()
         
         if self.printLevel >= 2:
-            print 'Setting up workers for origin Correctors'
+            print('Setting up workers for origin Correctors')
         eccontroller.setupWorker(world, coefficient, IPatchGenerator, k, clearFineQuantities, self.printLevel)
         if self.printLevel >= 2:
-            print 'Done'
+            print('Done')
         
         #element corrector list has coarse element size 
         ecListOrigin = self.ecListOrigin     
@@ -75,17 +104,100 @@ class VcPetrovGalerkinLOD:
             ecComputeList.append((TInd, iElement))    
         
         if self.printLevel >= 2:
-            print 'Waiting for results', len(ecComputeList)
+            print('Waiting for results', len(ecComputeList))
                     
         ecResultList = eccontroller.mapComputations(ecComputeList, self.printLevel)
         for ecResult, ecCompute in zip(ecResultList, ecComputeList):
             ecListOrigin[ecCompute[0]] = ecResult
             
-        self.ecList = deepcopy(ecListOrigin)
-        self.ecListtesting = deepcopy(ecListOrigin)
+        #the origin correctors are shared, not copied (see CorrectorStore)
+        self.ecList = CorrectorStore(ecListOrigin)
+        self.ecListtesting = CorrectorStore(ecListOrigin)
+        
+        if Cache is not None:
+            self.saveOriginCorrectors(Cache, key)
+    
+    def originKey(self, clearFineQuantities=True):
+        '''
+        sha256 of what the origin correctors depend on: the world with its boundary conditions, k, 
+        the interpolation (IPatchGenerator on the patch in the lower left corner, which sees the 
+        boundary), aFine of origincoef and whether the fine quantities are cleared
+        '''
+        world = self.world
+        NPatchCoarse = np.minimum(2*self.k+1, world.NWorldCoarse)
+        IPatch = sparse.coo_matrix(self.IPatchGenerator(np.zeros_like(world.NWorldCoarse), NPatchCoarse))
+        
+        parts = [world.NWorldCoarse, world.NCoarseElement, world.boundaryConditions, 
+                 [self.k, int(bool(clearFineQuantities)), self.storeVersion], 
+                 IPatch.shape, IPatch.row, IPatch.col, IPatch.data, self.origincoef.aFine]
+        key = hashlib.sha256()
+        for part in parts:
+            part = np.asarray(part)
+            part = part.astype(np.float64 if part.dtype.kind in 'fc' else np.int64)
+            key.update(str(part.shape).encode('ascii'))
+            key.update(part.tobytes())
+        return key.hexdigest()
+    
+    def saveOriginCorrectors(self, Cache, key):
+        '''
+        writes the origin correctors to the folder Cache/key: the pickled correctors in Correctors.pkl 
+        with their large arrays in the binary file Arrays.bin, aligned such that they can be memory mapped
+        '''
+        folder = os.path.join(Cache, key)
+        if os.path.exists(folder):
+            return folder
+        if not os.path.isdir(Cache):
+            try:
+                os.makedirs(Cache)
+            except OSError:
+                pass
+        
+        #written to a new folder that is renamed in the end, other processes see all or nothing
+        temporary = tempfile.mkdtemp(dir=Cache)
+        with open(os.path.join(temporary, 'Correctors.pkl'), 'wb') as pickleFile:
+            with open(os.path.join(temporary, 'Arrays.bin'), 'wb') as arrayFile:
+                pickler = CorrectorPickler(pickleFile, arrayFile)
+                pickler.dump(self.ecListOrigin)
+        with open(os.path.join(temporary, 'Meta.json'), 'w') as metaFile:
+            json.dump({'NtCoarse': len(self.ecListOrigin), 'Bytes': pickler.offset, 'Version': self.storeVersion}, metaFile)
+        try:
+            os.rename(temporary, folder)
+        except OSError:
+            #stored by someone else in the meantime
+            shutil.rmtree(temporary, ignore_errors=True)
+        return folder
+    
+    def loadOriginCorrectors(self, Cache, key):
+        '''
+        takes over the origin correctors stored in Cache/key, returns False if there are none. 
+        Their arrays are memory mapped read only, so several processes share one copy.
+        '''
+        folder = os.path.join(Cache, key)
+        if not os.path.exists(os.path.join(folder, 'Meta.json')):
+            return False
+        with open(os.path.join(folder, 'Meta.json')) as metaFile:
+            meta = json.load(metaFile)
+        
+        arrays = None
+        if meta['Bytes'] > 0:
+            arrays = np.memmap(os.path.join(folder, 'Arrays.bin'), dtype=np.uint8, mode='r')
+        with open(os.path.join(folder, 'Correctors.pkl'), 'rb') as pickleFile:
+            ecListOrigin = CorrectorUnpickler(pickleFile, arrays).load()
+        
+        # Reset all caches
+        self.Kms = None
+        self.K = None
+        self.basisCorrectors = None
+        self.indicatorGroupList = None
+        self.releaseIndicatorView()
+        
+        self.ecListOrigin = ecListOrigin
+        self.ecList = CorrectorStore(ecListOrigin)
+        self.ecListtesting = CorrectorStore(ecListOrigin)
+        return True
 
     def CorrectorsToOrigin(self):
-        self.ecListtesting = self.ecListOrigin
+        self.ecListtesting = CorrectorStore(self.ecListOrigin)
     
     def originRhsCorrectors(self, clearFineQuantities=True):
         '''
@@ -138,10 +250,18 @@ class VcPetrovGalerkinLOD:
                 rhsCT.clearFineQuantities()
             rhsCListOrigin[TInd] = rhsCT
             
-        self.rhsCList = deepcopy(rhsCListOrigin)
+        self.rhsCList = CorrectorStore(rhsCListOrigin)
 
             
-    def updateCorrectors(self, coefficient, epsilonTol, f, epsilonQuestion =0, clearFineQuantities=True, Testing = None, Computing= True,mc=0):
+    def updateCorrectors(self, coefficient, epsilonTol, f, epsilonQuestion =0, clearFineQuantities=True, Testing = None, Computing= True,mc=0, Changed=None, Batched=None, View=None):
+        '''
+        Changed = flat indices of the fine cells in which coefficient differs from origincoef 
+                  (e.g. the Delta of buildcoef2d), None: found by comparing aFine. 
+                  Elements whose patch contains none of them get epsilonT = 0 without localizing.
+        Batched = if true the fine error indicators of the touched elements are computed together 
+                  by errorIndicatorBatch
+        View = ipyparallel view for errorIndicatorBatch on the engines (implies Batched)
+        '''
         assert(self.ecListOrigin is not None)
         
         if epsilonTol == 0 and Computing == True and mc==0:
@@ -163,22 +283,22 @@ class VcPetrovGalerkinLOD:
         
         self.ageList = [0]*NtCoarse
         
-        if self.epsilonList == None:
+        if self.epsilonList is None:
             self.epsilonList = [np.nan]*NtCoarse
         
         #element corrector list has coarse element size 
         if Testing:
             ecListOrigin = self.ecListtesting
+            ecList = self.ecListtesting.snapshot()
         else:
             ecListOrigin = self.ecListOrigin
-        
-        ecList = deepcopy(ecListOrigin)
+            ecList = CorrectorStore(self.ecListOrigin)
         
         if self.printLevel >= 2:
-            print 'Setting up workers'
+            print('Setting up workers')
         eccontroller.setupWorker(world, coefficient, IPatchGenerator, k, clearFineQuantities, self.printLevel)
         if self.printLevel >= 2:
-            print 'Done'
+            print('Done')
         
         #only for coarse coefficient
         if self.ecList is not None and hasattr(coefficient, 'rCoarse'):
@@ -187,6 +307,13 @@ class VcPetrovGalerkinLOD:
             delta = np.abs((AOld-ANew)/np.sqrt(AOld*ANew))
             ceta = np.abs(AOld/ANew)
         
+        #only for the fine error indicator of the origin correctors
+        touched = None
+        if not Testing and hasattr(coefficient, 'aFine') and not hasattr(coefficient, 'aLagging') and not hasattr(coefficient, 'rCoarse'):
+            touched = self.touchedElements(coefficient, Changed)
+            if Batched or View is not None:
+                epsilonBatch = self.errorIndicatorBatch(coefficient, touched, View)
+        
         # saves the age of the corrector and error indicator for element
         ageList = self.ageList
         
@@ -199,7 +326,7 @@ class VcPetrovGalerkinLOD:
         ecComputeList = []
         for TInd in range(NtCoarse):
             if self.printLevel >= 3:
-                print str(TInd) + ' / ' + str(NtCoarse),
+                print(str(TInd) + ' / ' + str(NtCoarse), end=' ')
             
             ageList[TInd] += 1
             
@@ -216,16 +343,21 @@ class VcPetrovGalerkinLOD:
                     coefficientPatch = coefficient.localize(ecT.iPatchWorldCoarse, ecT.NPatchCoarse)
                     epsilonT = ecListOrigin[TInd].computeTimsCoarseErrorIndicator(delta,ceta)
                 elif hasattr(ecT, 'fsi'):
-                    coefficientPatch = coefficient.localize(ecT.iPatchWorldCoarse, ecT.NPatchCoarse)
-                    epsilonT = ecListOrigin[TInd].computeErrorIndicatorFine(coefficientPatch)
+                    if touched is not None and not touched[TInd]:
+                        epsilonT = 0
+                    elif touched is not None and (Batched or View is not None):
+                        epsilonT = epsilonBatch[TInd]
+                    else:
+                        coefficientPatch = coefficient.localize(ecT.iPatchWorldCoarse, ecT.NPatchCoarse)
+                        epsilonT = ecListOrigin[TInd].computeErrorIndicatorFine(coefficientPatch)
                 epsilonList[TInd] = epsilonT
             
             if self.printLevel >= 2:
-                print 'epsilonT = ' + str(epsilonT), 
+                print('epsilonT = ' + str(epsilonT), end=' ')
                 
             if epsilonT > epsilonTol:
                 if self.printLevel >= 2:
-                    print 'C'
+                    print('C')
                 if Testing:
                     epsilonList[TInd] = 0
                     self.currentTestingCorrector = TInd
@@ -235,14 +367,14 @@ class VcPetrovGalerkinLOD:
                 recomputeCount += 1
             else:
                 if self.printLevel > 1:
-                    print 'N'    
+                    print('N')
         
         if self.printLevel >= 2:
-            print 'Waiting for results', len(ecComputeList)
+            print('Waiting for results', len(ecComputeList))
         
         if self.printLevel > 0 or Testing:
             if mc == 0:
-                print "To be recomputed: ", float(recomputeCount)/NtCoarse*100, '%'
+                print("To be recomputed: ", float(recomputeCount)/NtCoarse*100, '%')
         
         self.printLevel = 0
 
@@ -251,7 +383,7 @@ class VcPetrovGalerkinLOD:
             for ecResult, ecCompute in zip(ecResultList, ecComputeList):
                 ecList[ecCompute[0]] = ecResult
         else:
-            print "Not Recomputed!"
+            print("Not Recomputed!")
                 
         self.ecList = ecList
         
@@ -270,9 +402,144 @@ class VcPetrovGalerkinLOD:
         if epsilonQuestion == 1:
             return ageListinv, epsilonList
 
-    def ErrorIndicator(self, coefficient):
+    def touchedElements(self, coefficient, Changed=None):
+        '''
+        for every coarse element whether its patch contains a fine cell in which 
+        coefficient differs from origincoef. 
+        Changed = flat indices of the changed fine cells, None: found by comparing aFine
+        '''
+        world = self.world
+        NWorldFine = world.NWorldCoarse*world.NCoarseElement
+        
+        if Changed is None:
+            Changed = np.flatnonzero(coefficient.aFine != self.origincoef.aFine)
+        
+        #coarse elements with changed cells, the arrays are indexed [..., x1, x0]
+        fineCoordinates = np.unravel_index(np.asarray(Changed, dtype=int), NWorldFine[::-1])
+        coarseChanged = np.zeros(world.NWorldCoarse[::-1], dtype=bool)
+        coarseChanged[tuple(c // n for c, n in zip(fineCoordinates, world.NCoarseElement[::-1]))] = True
+        
+        touched = []
+        for ecT in self.ecListOrigin:
+            patch = tuple(slice(i, i+n) for i, n in zip(ecT.iPatchWorldCoarse[::-1], ecT.NPatchCoarse[::-1]))
+            touched.append(bool(np.any(coarseChanged[patch])))
+        return touched
+    
+    def indicatorGroups(self):
+        '''
+        the origin correctors grouped by the geometry of their patch (size and position of the element). 
+        Per group: the elements, the first fine cells of their patches in the world and the map to 
+        the other ones, the nodes of the patch cells, which patch cells belong to the element, the 
+        coarse basis functions of the element on the patch nodes and the correctorsList of the elements. 
+        The correctors are only referenced, not copied.
+        '''
+        if self.indicatorGroupList is not None:
+            return self.indicatorGroupList
         assert(self.ecListOrigin is not None)
         
+        world = self.world
+        NWorldCoarse = world.NWorldCoarse
+        NCoarseElement = world.NCoarseElement
+        NWorldFine = NWorldCoarse*NCoarseElement
+        d = np.size(NWorldCoarse)
+        
+        geometries = {}
+        for TInd, ecT in enumerate(self.ecListOrigin):
+            assert(hasattr(ecT, 'fsi'))
+            iElement = util.convertpIndexToCoordinate(NWorldCoarse-1, TInd)
+            key = tuple(ecT.NPatchCoarse) + tuple(iElement - ecT.iPatchWorldCoarse)
+            geometries.setdefault(key, []).append(TInd)
+        
+        groups = []
+        for key in sorted(geometries):
+            elements = geometries[key]
+            NPatchFine = np.array(key[:d])*NCoarseElement
+            iElementPatchFine = np.array(key[d:])*NCoarseElement
+            
+            patchtIndexMap = util.lowerLeftpIndexMap(NPatchFine-1, NWorldFine-1)
+            patchtStartIndices = np.array([util.convertpCoordinateToIndex(NWorldFine-1, self.ecListOrigin[TInd].iPatchWorldCoarse*NCoarseElement)
+                                           for TInd in elements])
+            
+            cellNodes = np.add.outer(util.lowerLeftpIndexMap(NPatchFine-1, NPatchFine), 
+                                     util.lowerLeftpIndexMap(np.ones_like(NPatchFine), NPatchFine))
+            
+            inElement = np.zeros(np.prod(NPatchFine), dtype=bool)
+            inElement[util.convertpCoordinateToIndex(NPatchFine-1, iElementPatchFine) + 
+                      util.lowerLeftpIndexMap(NCoarseElement-1, NPatchFine-1)] = True
+            
+            basis = np.zeros((np.prod(NPatchFine+1), 2**d))
+            basis[util.convertpCoordinateToIndex(NPatchFine, iElementPatchFine) + 
+                  util.lowerLeftpIndexMap(NCoarseElement, NPatchFine)] = world.localBasis
+            
+            correctors = [self.ecListOrigin[TInd].fsi.correctorsList for TInd in elements]
+            groups.append((np.array(elements), patchtStartIndices, patchtIndexMap, cellNodes, inElement, basis, correctors))
+        
+        self.indicatorGroupList = groups
+        return groups
+    
+    def errorIndicatorBatch(self, coefficient, touched=None, View=None):
+        '''
+        fine error indicators of all elements in vectorized form (see groupErrorIndicators). 
+        The elements of one patch geometry are evaluated together (see indicatorGroups).
+        touched = if given, only the elements with a true entry are computed, the others get 0 (see touchedElements)
+        View = if given, an ipyparallel view on the engines (e.g. the ones of eccontroller). The groups 
+               are scattered to the engines once per origin, then every call only sends aFine and 
+               gathers the indicators in one round trip.
+        returns epsilonList as ndarray
+        '''
+        world = self.world
+        aNew = coefficient.aFine
+        
+        if View is None:
+            results = [groupErrorIndicators(self.indicatorGroups(), world.ALocFine, self.origincoef.aFine, aNew, touched)]
+        else:
+            from ipyparallel import Reference
+            if self.indicatorView is not View:
+                self.releaseIndicatorView()
+                #the names are unique per instance and origin, such that instances share a view safely
+                name = 'pgIndicator%x_%d' % (id(self), next(indicatorCount))
+                #every group is split over the engines, the parts are rotated such that small groups spread too
+                n = len(View)
+                parts = []
+                for p in range(n):
+                    for g, (elements, starts, patchtIndexMap, cellNodes, inElement, basis, correctors) in enumerate(self.indicatorGroups()):
+                        chunk = np.array_split(np.arange(np.size(elements)), n)[(p+g) % n]
+                        parts.append((elements[chunk], starts[chunk], patchtIndexMap, cellNodes, inElement, basis, 
+                                      [correctors[i] for i in chunk]))
+                View.scatter(name + 'Groups', parts, block=True)
+                View.push({name + 'ALocFine': world.ALocFine, name + 'Old': self.origincoef.aFine}, block=True)
+                self.indicatorView = View
+                self.indicatorName = name
+            name = self.indicatorName
+            results = View.apply_sync(groupErrorIndicators, Reference(name + 'Groups'), Reference(name + 'ALocFine'), 
+                                      Reference(name + 'Old'), aNew, touched)
+        
+        epsilonList = np.zeros(np.prod(world.NWorldCoarse))
+        for elements, epsilon in results:
+            epsilonList[elements] = epsilon
+        return epsilonList
+    
+    def releaseIndicatorView(self):
+        '''
+        deletes the groups of errorIndicatorBatch on the engines of the view they were sent to
+        '''
+        if self.indicatorView is not None:
+            name = self.indicatorName
+            self.indicatorView.execute('del %sGroups, %sALocFine, %sOld' % (name, name, name), block=True)
+        self.indicatorView = None
+        self.indicatorName = None
+    
+    def ErrorIndicator(self, coefficient, Batched=None, View=None):
+        '''
+        Batched = if true errorIndicatorBatch is used and the epsilonList is an ndarray
+        View = ipyparallel view for errorIndicatorBatch on the engines (implies Batched)
+        '''
+        assert(self.ecListOrigin is not None)
+        
+        if Batched or View is not None:
+            self.epsilonList = self.errorIndicatorBatch(coefficient, View=View)
+            return self.epsilonList
+        
         world = self.world
         k = self.k
         IPatchGenerator = self.IPatchGenerator
@@ -285,7 +552,6 @@ class VcPetrovGalerkinLOD:
         
         #element corrector list has coarse element size 
         ecListOrigin = self.ecListOrigin
-        ecList = deepcopy(ecListOrigin)     
                 
         epsilonList = self.epsilonList
         
@@ -334,7 +600,7 @@ class VcPetrovGalerkinLOD:
         NtCoarse = np.prod(world.NWorldCoarse)
         for TInd in range(NtCoarse):
             if self.printLevel > 0:
-                print str(TInd) + ' / ' + str(NtCoarse)
+                print(str(TInd) + ' / ' + str(NtCoarse))
                 
             ecT = self.ecList[TInd]
             
@@ -577,4 +843,136 @@ class VcPetrovGalerkinLOD:
 
         self.K = K
         return K
-    
\ No newline at end of file
+
+
+#numbers the groups sent to the engines by errorIndicatorBatch
+indicatorCount = itertools.count()
+
+def groupErrorIndicators(groups, ALocFine, aOld, aNew, touched=None, chunkBytes=2**25):
+    '''
+    fine error indicators of the elements in the groups of VcPetrovGalerkinLOD.indicatorGroups, 
+        epsilonT^2 = max_w  ||(aOld-aNew)/sqrt(aNew) (chi_T grad w - grad Q_T w)||^2_U(T) / ||sqrt(aOld) grad w||^2_T 
+    over the coarse functions w on T with the origin correctors Q_T. 
+    It is a module function such that the engines of ipyparallel can run it. 
+    touched = if given, only the elements with a true entry are computed
+    chunkBytes = bound of the temporary arrays, the elements of a group are evaluated in chunks
+    returns the computed elements and their indicators
+    '''
+    elementList = [np.zeros(0, dtype=int)]
+    epsilonList = [np.zeros(0)]
+    for elements, starts, patchtIndexMap, cellNodes, inElement, basis, correctors in groups:
+        compute = np.arange(np.size(elements))
+        if touched is not None:
+            compute = compute[np.asarray(touched, dtype=bool)[elements]]
+        if np.size(compute) == 0:
+            continue
+        
+        #the element part of the denominator is the same for the whole group
+        basisCells = basis[cellNodes]
+        basisT = basisCells[inElement]
+        ABasisT = np.einsum('ij,tjn->tin', ALocFine, basisT)
+        
+        chunkSize = max(1, int(chunkBytes // (8*np.prod(np.shape(basisCells)))))
+        for first in range(0, np.size(compute), chunkSize):
+            chunk = compute[first:first+chunkSize]
+            cells = np.add.outer(starts[chunk], patchtIndexMap)
+            aOldPatch = aOld[cells]
+            aNewPatch = aNew[cells]
+            deltaSquare = (aOldPatch-aNewPatch)**2/aNewPatch
+            
+            #nodal values of chi_T w - Q_T w on every patch cell: (elements, cells, cell nodes, functions)
+            Q = np.array([np.column_stack(correctors[i]) for i in chunk])
+            W = np.where(inElement[np.newaxis,:,np.newaxis,np.newaxis], basisCells, 0.) - Q[:,cellNodes]
+            AW = np.einsum('ij,gtjn->gtin', ALocFine, W)
+            numerator = np.einsum('gt,gtim,gtin->gmn', deltaSquare, W, AW)
+            denominator = np.einsum('gt,tim,tin->gmn', aOldPatch[:,inElement], basisT, ABasisT)
+            
+            #the constant function is in the kernel of both, the largest generalized eigenvalue 
+            #of the rest by the cholesky factor of the denominator
+            L = np.linalg.cholesky(denominator[:,:-1,:-1])
+            X = np.linalg.solve(L, numerator[:,:-1,:-1])
+            X = np.linalg.solve(L, np.swapaxes(X, 1, 2))
+            elementList.append(elements[chunk])
+            epsilonList.append(np.sqrt(np.maximum(np.linalg.eigvalsh(X)[:,-1], 0)))
+    
+    return np.concatenate(elementList), np.concatenate(epsilonList)
+
+
+class CorrectorStore:
+    '''
+    element correctors as a version of a list of origin correctors: unchanged elements share 
+    the origin corrector objects and only the entries set since then are kept in changes. 
+    A snapshot or a new store on the origin is O(1), the changes are copied on the first write after a snapshot. 
+    The corrector objects are never copied, so they must not be changed in place.
+    '''
+    def __init__(self, origin, changes=None):
+        self.origin = origin
+        self.changes = {} if changes is None else changes
+        self.shared = changes is not None
+    
+    def __len__(self):
+        return len(self.origin)
+    
+    def __getitem__(self, TInd):
+        if TInd in self.changes:
+            return self.changes[TInd]
+        return self.origin[TInd]
+    
+    def __setitem__(self, TInd, ecT):
+        if self.shared:
+            self.changes = dict(self.changes)
+            self.shared = False
+        self.changes[TInd] = ecT
+    
+    def __iter__(self):
+        for TInd in range(len(self.origin)):
+            yield self[TInd]
+    
+    def snapshot(self):
+        '''
+        a store with the current correctors, later changes of either store do not affect the other
+        '''
+        self.shared = True
+        return CorrectorStore(self.origin, self.changes)
+
+
+class CorrectorPickler(pickle.Pickler):
+    '''
+    pickles the correctors, but writes the arrays with at least minBytes to arrayFile 
+    (aligned to 64 bytes) and only keeps a reference (offset, dtype, shape) in the pickle
+    '''
+    minBytes = 1024
+    
+    def __init__(self, pickleFile, arrayFile):
+        pickle.Pickler.__init__(self, pickleFile, 2)
+        self.arrayFile = arrayFile
+        self.offset = 0
+        self.written = {}
+    
+    def persistent_id(self, obj):
+        if type(obj) is not np.ndarray or obj.dtype.hasobject or obj.nbytes < self.minBytes:
+            return None
+        if id(obj) in self.written:
+            return self.written[id(obj)][1]
+        
+        padding = -self.offset % 64
+        self.arrayFile.write(b'\0'*padding)
+        self.offset += padding
+        reference = ('array', self.offset, obj.dtype.str, obj.shape)
+        self.arrayFile.write(np.ascontiguousarray(obj).tobytes())
+        self.offset += obj.nbytes
+        #the array is kept such that its id is not reused
+        self.written[id(obj)] = (obj, reference)
+        return reference
+
+class CorrectorUnpickler(pickle.Unpickler):
+    '''
+    loads what CorrectorPickler wrote, the arrays are views of the memory mapped arrayFile
+    '''
+    def __init__(self, pickleFile, arrays):
+        pickle.Unpickler.__init__(self, pickleFile)
+        self.arrays = arrays
+    
+    def persistent_load(self, reference):
+        kind, offset, dtype, shape = reference
+        return np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=self.arrays, offset=offset)
@@ -0,0 +1,196 @@
+# This file is part of the master thesis "Variational crimes in the Localized orthogonal decomposition method":
+#   https://github.com/TiKeil/Masterthesis-LOD.git
+# Copyright holder: Tim Keil 
+# License: BSD 2-Clause License (http://opensource.org/licenses/BSD-2-Clause)
+
+'''
+timings and peak memory of BuildCoefficient and the perturbations of buildcoef2d.Coefficient2d 
+for several grid sizes and shape configurations: the loops, their vectorized forms, the batches 
+of SampleCoefficients, Perturb and PerturbationStream.
+
+    python Benchmark_buildcoef2d.py --save baseline.json
+    python Benchmark_buildcoef2d.py --sizes 128 256 --compare baseline.json
+
+The results are written as json (one entry per configuration, size and operation). With --compare 
+the times are compared to a saved baseline and the exit code is 1 if one of them got slower 
+than the tolerance allows.
+'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+import buildcoef2d
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+bg = 0.05   #background
+val = 1     #values
+
+Configurations = {
+    'EquidistantBoxes': dict(length=2, thick=2, space=2, probfactor=1, right=1, 
+                            equidistant=True, BoundarySpace=True),
+    'RandomDiagonals':  dict(thick=1, space=0, probfactor=1, diagr1=1, diagl1=1, 
+                            LenSwitch=[4,5,6,7,8]),
+    'Channels':         dict(length=1, thick=1, space=2, probfactor=1, equidistant=True, 
+                            ChannelVertical=True, BoundarySpace=True),
+    'ChannelsHorizontal': dict(length=1, thick=1, space=2, probfactor=1, equidistant=True, 
+                            ChannelHorizontal=True, BoundarySpace=True),
+    'NewShapes':        dict(space=2, probfactor=1, BoundarySpace=True),
+}
+
+newshape = np.array([[1,6,1,1,1,6,0], 
+                     [4,6,1, 1,1,6,0], 
+                     [1,6,1,-1,1,6,0],
+                     [4,6,1,-1,0,0,0]])
+
+Sizes = [128, 256, 512, 1024, 2048]
+
+# number of samples of the batched operations
+Samples = 16
+
+def Numbers(CoefClass):
+    # every 50th shape for the specific perturbations
+    return list(range(1, len(CoefClass.ShapeRemember)+1, 50))
+
+def Cells(CoefClass):
+    # every 100th inclusion cell for the ExtremeRandomizer
+    return list(range(1, CoefClass.valuecounter+1, 100))
+
+def Consume(Generator):
+    # the samples of a stream are only drawn when they are taken
+    for Item in Generator:
+        pass
+
+Operations = {
+    'RandomValueChange':           lambda C: C.RandomValueChange(ratio=-0.4, probfactor=10),
+    'RandomVanish':                lambda C: C.RandomVanish(probfactor=10),
+    'RandomMove':                  lambda C: C.RandomMove(probfactor=10),
+    'SpecificValueChange':         lambda C: C.SpecificValueChange(Number=Numbers(C), ratio=-0.4),
+    'SpecificVanish':              lambda C: C.SpecificVanish(Number=Numbers(C)),
+    'SpecificMove':                lambda C: C.SpecificMove(Number=Numbers(C)),
+    'ChannelVerticalRandomize':    lambda C: C.ChannelVerticalRandomize(),
+    'ChannelHorizontalRandomize':  lambda C: C.ChannelHorizontalRandomize(),
+    'ExtremeRandomizer':           lambda C: C.ExtremeRandomizer(Number=Cells(C)),
+    'RandomValueChangeVectorized': lambda C: C.RandomValueChange(ratio=-0.4, probfactor=10, Vectorized=True),
+    'RandomVanishVectorized':      lambda C: C.RandomVanish(probfactor=10, Vectorized=True),
+    'RandomMoveVectorized':        lambda C: C.RandomMove(probfactor=10, Vectorized=True),
+    'SampleCoefficients':          lambda C: C.SampleCoefficients(Samples, Kind='Vanish', probfactor=10),
+    'Perturb':                     lambda C: C.Perturb([['Vanish', Numbers(C)], ['ValueChange', None, -0.4], 
+                                                        ['Move', None, [1,0]]]),
+    'PerturbationStream':          lambda C: Consume(C.PerturbationStream(Samples, Kind='Vanish', probfactor=10)),
+}
+
+def NewCoefficient(Configuration, N):
+    CoefClass = buildcoef2d.Coefficient2d(np.array([N, N]), bg=bg, val=val, Seed=0, 
+                                          **Configurations[Configuration])
+    if Configuration == 'NewShapes':
+        CoefClass.NewShape(newshape)
+    return CoefClass
+
+def Measure(Function, Repeat):
+    '''
+    the best time of Repeat calls and the peak of the memory allocated during one call 
+    (None without tracemalloc)
+    '''
+    Times = []
+    for r in range(0, Repeat):
+        start = timer()
+        Function()
+        Times.append(timer() - start)
+    Peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        Function()
+        Peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(Times), Peak
+
+def Applicable(CoefClass, Operation):
+    if Operation == 'ChannelVerticalRandomize':
+        return bool(CoefClass.ChannelVertical)
+    if Operation == 'ChannelHorizontalRandomize':
+        return bool(CoefClass.ChannelHorizontal)
+    return True
+
+def Run(Sizes, ConfigurationNames, OperationNames, Repeat):
+    Results = []
+    for Configuration in ConfigurationNames:
+        for N in Sizes:
+            Built = []
+            def Build():
+                CoefClass = NewCoefficient(Configuration, N)
+                CoefClass.BuildCoefficient()
+                Built[:] = [CoefClass]
+            Cases = [('BuildCoefficient', Build)]
+            for Operation in OperationNames:
+                Cases.append((Operation, lambda Operation=Operation: Operations[Operation](Built[0])))
+            for Operation, Function in Cases:
+                if Operation != 'BuildCoefficient' and not Applicable(Built[0], Operation):
+                    continue
+                Seconds, Peak = Measure(Function, Repeat)
+                Results.append({'Configuration': Configuration, 'Size': N, 'Operation': Operation, 
+                                'Seconds': Seconds, 'PeakBytes': Peak})
+                print('%-18s %5d %-28s %10.4f s %10s MB' % (Configuration, N, Operation, Seconds, 
+                      '-' if Peak is None else '%.1f' % (Peak/2.**20)))
+                sys.stdout.flush()
+    return Results
+
+def Key(Result):
+    return (Result['Configuration'], Result['Size'], Result['Operation'])
+
+def Compare(Results, Baseline, Tolerance):
+    '''
+    prints the ratios to the baseline and returns the results that got slower than Tolerance
+    '''
+    Old = dict((Key(Result), Result) for Result in Baseline['Results'])
+    Slower = []
+    print('\n%-18s %5s %-28s %10s %10s %7s' % ('Configuration', 'Size', 'Operation', 'Baseline', 'Now', 'Ratio'))
+    for Result in Results:
+        if Key(Result) not in Old:
+            continue
+        Reference = Old[Key(Result)]['Seconds']
+        Ratio = Result['Seconds'] / max(Reference, 1e-9)
+        Flag = ''
+        if Ratio > Tolerance:
+            Slower.append(Result)
+            Flag = '  SLOWER'
+        print('%-18s %5d %-28s %10.4f %10.4f %7.2f%s' % (Key(Result) + (Reference, Result['Seconds'], Ratio, Flag)))
+    return Slower
+
+def main():
+    Parser = argparse.ArgumentParser(description='benchmark of buildcoef2d')
+    Parser.add_argument('--sizes', type=int, nargs='+', default=Sizes)
+    Parser.add_argument('--configurations', nargs='+', default=sorted(Configurations), 
+                        choices=sorted(Configurations))
+    Parser.add_argument('--operations', nargs='+', default=sorted(Operations), choices=sorted(Operations))
+    Parser.add_argument('--repeat', type=int, default=3, help='the best of repeat calls is taken')
+    Parser.add_argument('--save', help='json file for the results')
+    Parser.add_argument('--compare', help='json file of a saved baseline')
+    Parser.add_argument('--tolerance', type=float, default=1.25, 
+                        help='allowed ratio of the time to the baseline')
+    Arguments = Parser.parse_args()
+
+    Results = Run(Arguments.sizes, Arguments.configurations, Arguments.operations, Arguments.repeat)
+    Output = {'Python': platform.python_version(), 'Numpy': np.__version__, 
+              'Machine': platform.platform(), 'Repeat': Arguments.repeat, 'Results': Results}
+    if Arguments.save:
+        with open(Arguments.save, 'w') as File:
+            json.dump(Output, File, indent=1, sort_keys=True)
+    if Arguments.compare:
+        with open(Arguments.compare) as File:
+            Slower = Compare(Results, json.load(File), Arguments.tolerance)
+        if Slower:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# This file is part of the master thesis "Variational crimes in the Localized orthogonal decomposition method":
+#   https://github.com/TiKeil/Masterthesis-LOD.git
+# Copyright holder: Tim Keil 
+# License: BSD 2-Clause License (http://opensource.org/licenses/BSD-2-Clause)
+
+'''
+makes the modules of the repository importable. If gridlod is not installed, a stub with the 
+index maps of gridlod.util is used, the tests that need the real gridlod are skipped then. 
+The modules are python 2 code, under python 3 random.sample takes any population as there.
+'''
+
+import os
+import random
+import sys
+import types
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.version_info[0] >= 3:
+    pySample = random.Random.sample
+    random.Random.sample = lambda self, population, k: pySample(self, list(population), k)
+    random.sample = random._inst.sample
+
+try:
+    import gridlod
+    STUB_GRIDLOD = False
+except ImportError:
+    STUB_GRIDLOD = True
+
+def convertpCoordinateToIndex(N, iCoord):
+    N = np.asarray(N)
+    return int(np.dot(iCoord, np.concatenate(([1], np.cumprod(N[:-1]+1)))))
+
+def convertpIndexToCoordinate(N, ind):
+    coordinate = []
+    for n in np.asarray(N):
+        coordinate.append(ind % (n+1))
+        ind //= (n+1)
+    return np.array(coordinate)
+
+def lowerLeftpIndexMap(NUpper, N):
+    N = np.asarray(N)
+    strides = np.concatenate(([1], np.cumprod(N[:-1]+1)))
+    indices = np.zeros(1, dtype=int)
+    for d in range(np.size(N)):
+        indices = np.add.outer(strides[d]*np.arange(NUpper[d]+1), indices).ravel()
+    return indices
+
+if STUB_GRIDLOD:
+    gridlod = types.ModuleType('gridlod')
+    util = types.ModuleType('gridlod.util')
+    util.convertpCoordinateToIndex = convertpCoordinateToIndex
+    util.convertpIndexToCoordinate = convertpIndexToCoordinate
+    util.lowerLeftpIndexMap = lowerLeftpIndexMap
+    lod = types.ModuleType('gridlod.lod')
+    lod.schurComplementSolver = lambda NWorldFine: None
+    eccontroller = types.ModuleType('gridlod.eccontroller')
+    eccontroller.clearWorkers = lambda: None
+    eccontroller.setupWorker = lambda *args: None
+    #the recomputed correctors are new objects that remember their task
+    eccontroller.mapComputations = lambda ecComputeList, printLevel=0: [('recomputed', TInd) for TInd, iElement in ecComputeList]
+    gridlod.util = util
+    gridlod.lod = lod
+    gridlod.eccontroller = eccontroller
+    gridlod.fem = types.ModuleType('gridlod.fem')
+    gridlod.ecworker = types.ModuleType('gridlod.ecworker')
+    for module in [gridlod, util, lod, eccontroller, gridlod.fem, gridlod.ecworker]:
+        sys.modules[module.__name__] = module
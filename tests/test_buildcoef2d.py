@@ -0,0 +1,613 @@
+# This file is part of the master thesis "Variational crimes in the Localized orthogonal decomposition method":
+#   https://github.com/TiKeil/Masterthesis-LOD.git
+# Copyright holder: Tim Keil
+# License: BSD 2-Clause License (http://opensource.org/licenses/BSD-2-Clause)
+
+import os
+import random
+import numpy as np
+import pytest
+from scipy import ndimage
+
+import buildcoef2d
+
+Kinds = ['right', 'down', 'diagr1', 'diagr2', 'diagl1', 'diagl2']
+
+#new shapes: a cross of four parts, one with overlapping parts and a staircase
+Cross = np.array([[1,6,1,1,1,6,0],[4,6,1,1,1,6,0],[1,6,1,-1,1,6,0],[4,6,1,-1,0,0,0]])
+Overlap = np.array([[1,4,1,1,1,0,0],[4,4,1,1,1,2,0],[1,3,1,1,0,0,0]])
+Stairs = np.array([[1,2,1,1,1,0,1],[1,2,1,-1,1,1,-1],[1,2,1,-1,1,1,-1],[1,2,1,-1,1,1,-1],[1,2,1,-1,1,1,-1],[1,2,1,-1,0,0,0]])
+
+#coefficients of every kind: (NWorldFine, options, new shapes)
+Configurations = [((64,64), dict(length=2, thick=2, space=2, right=1, equidistant=True, BoundarySpace=True), []),
+                  ((64,64), dict(length=8, thick=2, space=4, diagl2=1, BoundarySpace=True), []),
+                  ((64,64), dict(thick=1, space=0, diagr1=1, diagl1=1, LenSwitch=[4,5,6,7,8]), []),
+                  ((64,64), dict(length=3, thick=1, space=1, probfactor=3, right=1, down=1, diagr1=1, diagr2=1, 
+                                 diagl1=1, diagl2=1, BoundarySpace=True), []),
+                  ((64,64), dict(length=4, thick=2, space=1, probfactor=2, right=1, down=1, diagr1=1, diagr2=1, 
+                                 diagl1=1, diagl2=1, LenSwitch=[2,3,5], thickSwitch=[1,2]), []),
+                  ((64,64), dict(length=5, thick=1, space=2, probfactor=-3, right=1, down=1), []),
+                  ((40,40), dict(space=2, BoundarySpace=True), [Cross]),
+                  ((64,64), dict(length=3, space=1, probfactor=2, right=1, diagl1=1, BoundarySpace=True), [Stairs])]
+
+def built(NWorldFine, BuildOptions={}, NewShapes=[], **Options):
+    Coefficient = dict(bg=0.05, val=1, probfactor=1, Seed=1)
+    Coefficient.update(Options)
+    CoefClass = buildcoef2d.Coefficient2d(np.array(NWorldFine), **Coefficient)
+    for Shape in NewShapes:
+        CoefClass.NewShape(Shape)
+    CoefClass.BuildCoefficient(**BuildOptions)
+    return CoefClass
+
+def assertSameBuild(CoefClass, Reference):
+    assert np.array_equal(CoefClass.Matrix, Reference.Matrix)
+    assert np.array_equal(CoefClass.ShapeRemember, Reference.ShapeRemember)
+    assert CoefClass.valuecounter == Reference.valuecounter
+
+@pytest.mark.parametrize('NWorldFine, Options',
+    [((64,64), dict({Kind: 1}, length=3, thick=1, space=2, BoundarySpace=True)) for Kind in Kinds] +
+    [((97,131), dict({Kind: 1}, length=5, thick=2, space=3)) for Kind in Kinds] +
+    [((128,128), dict(diagl2=1, length=5, thick=1, space=3, BoundarySpace=True)),
+     ((200,64), dict(diagl2=1, length=4, thick=2, space=1, BoundarySpace=True)),
+     ((131,97), dict(diagl2=1, length=3, thick=1, space=2, BoundarySpace=True)),
+     ((96,80), dict(length=1, thick=1, space=2, ChannelVertical=True, BoundarySpace=True)),
+     ((96,80), dict(length=1, thick=1, space=2, ChannelHorizontal=True, BoundarySpace=True))])
+def test_periodic_build_equals_loop(NWorldFine, Options):
+    Periodic = built(NWorldFine, equidistant=True, Periodic=True, **Options)
+    Loop = built(NWorldFine, equidistant=True, **Options)
+    assertSameBuild(Periodic, Loop)
+
+def test_periodic_build_tiles():
+    for Kind in ['right', 'down', 'diagr1']:
+        Periodic = built((128,128), equidistant=True, Periodic=True, length=3, thick=1, space=2, **{Kind: 1})
+        assert Periodic.Period is not None
+    #shapes that reach left of their anchor use the loop
+    Periodic = built((128,128), equidistant=True, Periodic=True, length=3, thick=1, space=2, diagl2=1)
+    assert Periodic.Period is None
+
+@pytest.mark.parametrize('NWorldFine, Options, NewShapes', Configurations)
+def test_stamped_build_equals_loop(NWorldFine, Options, NewShapes):
+    Stamped = built(NWorldFine, dict(Indexing=False), NewShapes, **Options)
+    Loop = built(NWorldFine, dict(Stamping=False), NewShapes, **Options)
+    assertSameBuild(Stamped, Loop)
+    assert np.array_equal(Stamped.ShapeAnchors, Loop.ShapeAnchors)
+
+def test_stamped_build_equals_loop_without_seed():
+    #the global streams are seeded by the build
+    Stamped = buildcoef2d.Coefficient2d(np.array([48,48]), bg=0.05, val=1, length=3, thick=1, space=1, probfactor=2, right=1, diagr2=1)
+    Stamped.BuildCoefficient()
+    Loop = buildcoef2d.Coefficient2d(np.array([48,48]), bg=0.05, val=1, length=3, thick=1, space=1, probfactor=2, right=1, diagr2=1)
+    Loop.BuildCoefficient(Stamping=False)
+    assertSameBuild(Stamped, Loop)
+
+@pytest.mark.parametrize('NWorldFine, Options, NewShapes', Configurations)
+def test_indexed_build_equals_loop(NWorldFine, Options, NewShapes):
+    Indexed = built(NWorldFine, dict(Indexing=True), NewShapes, **Options)
+    Loop = built(NWorldFine, dict(Stamping=False), NewShapes, **Options)
+    assertSameBuild(Indexed, Loop)
+
+def test_occupancy_index_fit_checks_equal_scans():
+    rng = np.random.RandomState(2)
+    A = (rng.random_sample([40,48]) < 0.02).astype(float)
+    Index = buildcoef2d.OccupancyIndex(A, TileSize=8)
+    CoefClass = buildcoef2d.Coefficient2d(np.array([40,48]))
+    Investigate = [CoefClass.InvestigateRight, CoefClass.InvestigateDiagr1, CoefClass.InvestigateDiagr2, 
+                   CoefClass.InvestigateDown, CoefClass.InvestigateDiagl1, CoefClass.InvestigateDiagl2]
+    
+    def assertSameChecks():
+        for Shape, Check in enumerate(Investigate):
+            assert CoefClass.ShapeFootprint(Shape+1, 8, 3) is not None
+            for i in range(0,40):
+                for j in range(0,48):
+                    assert Check(A, i, j, 8, 3, 0, 0, Index=Index) == Check(A, i, j, 8, 3, 0, 0)
+    
+    assertSameChecks()
+    #a block and a single cell change, the tables are updated
+    A[10:17,20:31] = 1
+    Index.Update(10, 17, 20, 31)
+    A[3,5] = 1
+    Index.Update(3, 4, 5, 6)
+    A[12,22] = 0
+    Index.Update(12, 13, 22, 23)
+    assertSameChecks()
+
+def test_compiled_new_shapes_equal_registry():
+    CoefClass = buildcoef2d.Coefficient2d(np.array([40,40]))
+    for Shape in [Cross, Overlap, Stairs]:
+        CoefClass.NewShape(Shape)
+    
+    #the parts as the loops sliced them out of the flat registry
+    for s in range(0,CoefClass.Shapes):
+        Matrix = np.reshape(CoefClass.ShapeMatrixes[CoefClass.ShapeIndex[s]:CoefClass.ShapeIndex[s+1]], 
+                            CoefClass.ShapeSizes[s].astype(int))
+        Coords = CoefClass.ShapeCoords[CoefClass.CoordsIndex[s]:CoefClass.CoordsIndex[s+1]]
+        Parts = [[int(Matrix[k][0]), int(Matrix[k][1]), int(Matrix[k][2]), int(Matrix[k][3]), 
+                  int(Coords[2*k]), int(Coords[2*k+1])] for k in range(0,np.shape(Matrix)[0])]
+        assert CoefClass.CompiledShapes[s] == Parts
+
+@pytest.mark.parametrize('NWorldFine, Options, NewShapes', 
+    [((40,40), dict(space=2, BoundarySpace=True), [Cross]),
+     ((64,64), dict(space=2, BoundarySpace=True), [Overlap]),
+     ((64,64), dict(length=3, space=1, probfactor=2, right=1, diagl1=1, BoundarySpace=True), [Stairs])])
+def test_compiled_new_shape_changes_equal_parts(NWorldFine, Options, NewShapes):
+    Compiled = built(NWorldFine, {}, NewShapes, **Options)
+    Parts = built(NWorldFine, {}, NewShapes, **Options)
+    #without the cells of ShapeCells the randomizers go part by part
+    Parts.ShapeCells = lambda s: None
+    
+    Calls = [('RandomValueChange', dict(randomvalue=[-0.4,0.3], probfactor=2)),
+             ('RandomValueChange', dict(ratio=0.2, negative=True)),
+             ('SpecificValueChange', dict(Number=[1,3], ratio=0.3)),
+             ('RandomVanish', dict(probfactor=2)),
+             ('RandomVanish', dict(probfactor=3, PartlyVanish=True)),
+             ('SpecificVanish', dict(Number=[0,2]))]
+    for Name, Options in Calls:
+        assert np.array_equal(getattr(Compiled, Name)(**Options), getattr(Parts, Name)(**Options))
+
+@pytest.mark.parametrize('NWorldFine, Options, NewShapes', Configurations)
+def test_shape_labels_equal_vanished_shapes(NWorldFine, Options, NewShapes):
+    CoefClass = built(NWorldFine, {}, NewShapes, **Options)
+    Table = CoefClass.ShapeTable
+    n = np.shape(CoefClass.ShapeRemember)[0]
+    assert np.shape(Table)[0] == n
+    assert np.array_equal(Table[:,0], CoefClass.ShapeRemember[:,0])
+    assert np.array_equal(CoefClass.ShapeLabels > -1, CoefClass.Matrix != CoefClass.bg)
+    
+    #the loop of SpecificVanish finds shape k by counting the shapes in the grid
+    for k in range(0,n,max(1,n//12)):
+        Vanished = CoefClass.SpecificVanish(Number=[k]) != CoefClass.Matrix
+        assert np.array_equal(Vanished, CoefClass.ShapeLabels == k)
+        rows, cols = np.nonzero(Vanished)
+        assert list(Table[k,5:9]) == [rows.min(), rows.max()+1, cols.min(), cols.max()+1]
+        assert np.array_equal(CoefClass.ShapePixels(k), (rows, cols))
+
+@pytest.mark.parametrize('NWorldFine, Options, NewShapes', Configurations)
+def test_vectorized_kernels_equal_loops(NWorldFine, Options, NewShapes):
+    #certain defects (probfactor 1, one ratio, given numbers) do not depend on the random streams
+    CoefClass = built(NWorldFine, {}, NewShapes, **Options)
+    n = np.shape(CoefClass.ShapeRemember)[0]
+    Number = list(range(1,n,3))
+    Calls = [('RandomVanish', dict(probfactor=1)),
+             ('RandomVanish', dict(probfactor=1, PartlyVanish=True)),
+             ('RandomVanish', dict(probfactor=1, ChangeRight=0, ChangeDiagl1=0, NewShapeChange=[0])),
+             ('RandomValueChange', dict(probfactor=1, ratio=0.3)),
+             ('RandomValueChange', dict(probfactor=1, ratio=-0.2, ChangeDown=0, ChangeDiagr1=0)),
+             ('RandomValueChange', dict(probfactor=1, ratio=0.4, ShapeRestriction=False)),
+             ('SpecificValueChange', dict(Number=Number, ratio=0.25))]
+    for Name, Options in Calls:
+        Loop = getattr(CoefClass, Name)(**Options)
+        Vectorized = getattr(CoefClass, Name)(Vectorized=True, **Options)
+        assert np.array_equal(Vectorized, Loop)
+
+def test_vectorized_kernels_chain():
+    CoefClass = built((64,64), {}, **Configurations[3][1])
+    Changed = CoefClass.SpecificValueChange(Number=[3,7,11], ratio=0.5, Vectorized=True)
+    Vanished = CoefClass.RandomVanish(probfactor=1, ChangeDown=0, Original=False, Vectorized=True)
+    
+    Expected = np.where((CoefClass.ShapeLabels > -1) & (CoefClass.ShapeTable[CoefClass.ShapeLabels,0] != 4), CoefClass.bg, Changed)
+    assert np.array_equal(Vanished, Expected)
+    assert np.array_equal(CoefClass.RandomLabels > -1, Vanished != CoefClass.bg)
+
+Directions = ['Right', 'BottomRight', 'Bottom', 'BottomLeft', 'Left', 'TopLeft', 'Top', 'TopRight']
+
+@pytest.mark.parametrize('NWorldFine, Options, NewShapes', [Configurations[k] for k in [0,1,6]])
+def test_move_kernel_equals_loops(NWorldFine, Options, NewShapes):
+    #all shapes keep a space to each other and to the boundary, so no move fails and the loops 
+    #(which drop shapes near the boundary) give the same
+    CoefClass = built(NWorldFine, {}, NewShapes, **Options)
+    for Direction in Directions:
+        Flags = dict((Name, int(Name == Direction)) for Name in Directions)
+        Loop = CoefClass.RandomMove(probfactor=1, **Flags)
+        Vectorized = CoefClass.RandomMove(probfactor=1, Vectorized=True, **Flags)
+        assert CoefClass.nomore == 0
+        assert np.array_equal(Vectorized, Loop)
+        
+        Loop = CoefClass.SpecificMove(Number=[1,4], **Flags)
+        Vectorized = CoefClass.SpecificMove(Number=[1,4], Vectorized=True, **Flags)
+        assert np.array_equal(Vectorized, Loop)
+
+def test_move_kernel_keeps_failed_shapes():
+    CoefClass = built((64,64), {}, **Configurations[5][1])
+    Moved = CoefClass.RandomMove(probfactor=1, steps=3, Vectorized=True)
+    Table = CoefClass.ShapeTable
+    
+    #shapes that would leave the grid or hit another shape stay where they are
+    Leaving = Table[:,8] + 3 > 64
+    assert np.all(CoefClass.MoveFailures[Leaving] == 1)
+    assert CoefClass.nomore == np.sum(CoefClass.MoveFailures) > np.sum(Leaving)
+    for k in range(0,np.shape(Table)[0]):
+        rows, cols = CoefClass.ShapePixels(k)
+        if CoefClass.MoveFailures[k]:
+            assert np.all(Moved[rows, cols] == CoefClass.Matrix[rows, cols])
+        else:
+            assert np.all(Moved[rows, cols+3] == CoefClass.Matrix[rows, cols])
+    assert np.sum(Moved != CoefClass.bg) == np.sum(CoefClass.Matrix != CoefClass.bg)
+
+Samplings = [('Vanish', dict(probfactor=2)), 
+             ('Vanish', dict(probfactor=3, PartlyVanish=True)),
+             ('ValueChange', dict(probfactor=2, randomvalue=[0.2,-0.3,0.5])),
+             ('ValueChange', dict(probfactor=2, ratio=0.3, ShapeWave=True)),
+             ('Move', dict(probfactor=2, randomstep=[1,2], Right=1, Bottom=1, TopLeft=1)),
+             ('Move', dict(probfactor=1, randomstep=[1,3], randomDirection=True))]
+
+@pytest.mark.parametrize('Kind, Options', Samplings)
+def test_batched_samples_equal_single_calls(Kind, Options):
+    CoefClass = built((64,64), {}, **Configurations[3][1])
+    Samples = CoefClass.SampleCoefficients(6, Kind, **Options)
+    assert np.shape(Samples) == (6,64,64)
+    for k in range(0,6):
+        Single = getattr(CoefClass.Spawn(k), 'Random' + Kind)(Vectorized=True, **Options)
+        assert np.array_equal(Samples[k], Single)
+    assert np.array_equal(np.concatenate(list(CoefClass.SampleCoefficients(6, Kind, Chunk=4, **Options))), Samples)
+    assert np.array_equal(CoefClass.SampleCoefficients(3, Kind, First=2, **Options), Samples[2:5])
+    
+    #without a seed the first sample is the single call from the same state of np.random
+    CoefClass = built((64,64), {}, **dict(Configurations[3][1], Seed=None))
+    np.random.seed(3)
+    Samples = CoefClass.SampleCoefficients(4, Kind, **Options)
+    np.random.seed(3)
+    assert np.array_equal(Samples[0], getattr(CoefClass, 'Random' + Kind)(Vectorized=True, **Options))
+
+def test_seeded_streams_are_reproducible_and_private():
+    Options = Configurations[4][1]
+    PythonState = random.getstate()
+    NumpyState = np.random.get_state()[1].copy()
+    First = built((64,64), {}, Seed=7, **Options)
+    Second = built((64,64), {}, Seed=7, **Options)
+    assertSameBuild(First, Second)
+    Results = [[CoefClass.RandomVanish(probfactor=2), 
+                CoefClass.RandomValueChange(probfactor=2, Vectorized=True), 
+                CoefClass.RandomMove(probfactor=2, Vectorized=True, Original=False)] for CoefClass in [First, Second]]
+    for a, b in zip(*Results):
+        assert np.array_equal(a, b)
+    #the global streams are not touched
+    assert random.getstate() == PythonState
+    assert np.array_equal(np.random.get_state()[1], NumpyState)
+    
+    assert not np.array_equal(built((64,64), {}, Seed=8, **Options).Matrix, First.Matrix)
+
+def test_spawned_streams_do_not_depend_on_the_order():
+    CoefClass = built((64,64), {}, Seed=[7,1], **Configurations[4][1])
+    Forward = [CoefClass.Spawn(k).RandomVanish(probfactor=2, Vectorized=True) for k in range(0,4)]
+    Backward = [CoefClass.Spawn(k).RandomVanish(probfactor=2, Vectorized=True) for k in range(3,-1,-1)][::-1]
+    for a, b in zip(Forward, Backward):
+        assert np.array_equal(a, b)
+    assert not np.array_equal(Forward[0], Forward[1])
+    
+    Child = CoefClass.Spawn(2).Spawn(5)
+    assert Child.Seed == [7,1,2,5]
+    assert Child.Matrix is CoefClass.Matrix
+    assert np.array_equal(Child.Generator.get_state()[1], 
+                          np.random.RandomState(np.random.SeedSequence(7, spawn_key=(1,2,5)).generate_state(4)).get_state()[1])
+
+def labelledBoxes(Changed):
+    #boxes of the connected regions as ndimage finds them on the dense grid
+    Labels = ndimage.label(Changed, structure=np.ones((3,3)))[0]
+    return np.array([[s[0].start, s[0].stop, s[1].start, s[1].stop] for s in ndimage.find_objects(Labels)], dtype=int).reshape(-1,4)
+
+def test_changed_boxes_equal_labelling():
+    rng = np.random.RandomState(4)
+    for Shape, density in [((30,40), 0.05), ((30,40), 0.3), ((1,50), 0.5), ((50,1), 0.5), ((17,23), 0.)]:
+        Changed = rng.random_sample(Shape) < density
+        Boxes = buildcoef2d.Coefficient2d.ChangedBoxes(np.flatnonzero(Changed), Shape)
+        assert np.array_equal(Boxes, labelledBoxes(Changed))
+
+#the loops do not chain (Original=False) on their own results
+@pytest.mark.parametrize('Name, Options, Chained', [('RandomVanish', dict(probfactor=3), False),
+                                                    ('RandomMove', dict(probfactor=2), False),
+                                                    ('RandomVanish', dict(probfactor=3, Vectorized=True), True),
+                                                    ('RandomValueChange', dict(probfactor=2, ratio=0.3, Vectorized=True), True),
+                                                    ('RandomMove', dict(probfactor=2, Vectorized=True), True),
+                                                    ('ExtremeRandomizer', dict(Number=list(range(1,600,7)), Move=[1,1]), True),
+                                                    ('Perturb', dict(Operations=[['Vanish', [1,2,3]], ['Move', None, [0,-1]]]), True)])
+def test_deltas_equal_dense_results(Name, Options, Chained):
+    Dense = built((64,64), {}, Seed=3, **Configurations[3][1])
+    Sparse = built((64,64), {}, Seed=3, **Configurations[3][1])
+    for Original in [True, False][0:1+Chained]:
+        Before = Sparse.RandomMatrix
+        C = getattr(Dense, Name)(Original=Original, **Options)
+        Delta = getattr(Sparse, Name)(Original=Original, Delta=True, **Options)
+        
+        Base = Sparse.Matrix if Original else Before
+        Changed = C != Base
+        assert np.array_equal(Delta[0], np.flatnonzero(Changed))
+        assert np.array_equal(Delta[1], Base[Changed])
+        assert np.array_equal(Delta[2], C[Changed])
+        assert np.array_equal(Delta[3], labelledBoxes(Changed))
+        assert np.array_equal(Sparse.ApplyDelta(Delta, Base), C)
+        assert np.array_equal(Sparse.RandomMatrix, C)
+
+def test_batched_deltas_equal_samples():
+    CoefClass = built((64,64), {}, **Configurations[3][1])
+    Samples = CoefClass.SampleCoefficients(4, 'Move', probfactor=2)
+    Deltas = CoefClass.SampleCoefficients(4, 'Move', probfactor=2, Delta=True)
+    for C, Delta in zip(Samples, Deltas):
+        assert np.array_equal(CoefClass.ApplyDelta(Delta), C)
+        assert np.array_equal(Delta[3], labelledBoxes(C != CoefClass.Matrix))
+
+def walkedRuns(M, axis, Reverse=False):
+    #the runs of ChannelClearance as the loops walked them, cell by cell
+    M = np.moveaxis(M, axis, 1)
+    R = np.zeros(np.shape(M), dtype=int)
+    step = 1 if Reverse else -1
+    for r in range(0,np.shape(M)[0]):
+        for c in range(0,np.shape(M)[1]):
+            k = c
+            while k > -1 and k < np.shape(M)[1] and M[r,k]:
+                R[r,c] += 1
+                k += step
+    return np.moveaxis(R, 1, axis)
+
+def walkedSpace(Free, i, c, thick, Up, Right):
+    #free cells next to the rows column by column, until the first column with a blocked cell
+    N0, N1 = np.shape(Free)
+    rows = range(i, i-thick, -1) if Up else range(i, i+thick)
+    space = 0.
+    while c > -1 and c < N1:
+        stop = False
+        for r in rows:
+            if r < 0 or r > N0-1:
+                stop = True
+                break
+            if Free[r,c]:
+                space += 1
+            else:
+                stop = True
+        if stop:
+            break
+        c = c+1 if Right else c-1
+    return space/thick
+
+def assertSameClearance(Clearance, CS, O, bg):
+    Free = (CS == bg) | (CS == 0)
+    OFree = (O == bg) | (O == 0)
+    assert np.array_equal(Clearance.Left, walkedRuns(Free, 1))
+    assert np.array_equal(Clearance.Right, walkedRuns(Free, 1, Reverse=True))
+    assert np.array_equal(Clearance.Up, walkedRuns(~Free, 0))
+    assert np.array_equal(Clearance.Down, walkedRuns(~Free, 0, Reverse=True))
+    assert np.array_equal(Clearance.OLeft, walkedRuns(OFree, 1))
+    assert np.array_equal(Clearance.ORight, walkedRuns(OFree, 1, Reverse=True))
+    assert np.array_equal(Clearance.Thick, walkedRuns(~OFree, 1, Reverse=True))
+    for i in range(0,np.shape(CS)[0],3):
+        for c in range(-1,np.shape(CS)[1]+1,2):
+            for thick in [1,2,3]:
+                for Up in [True, False]:
+                    for Right in [True, False]:
+                        assert Clearance.Space(i, c, thick, Up, Right) == walkedSpace(Free, i, c, thick, Up, Right)
+
+def test_channel_clearance_equals_walks():
+    CoefClass = built((48,40), equidistant=True, length=1, thick=2, space=2, ChannelVertical=True, BoundarySpace=True)
+    O = CoefClass.Matrix
+    bg = CoefClass.bg
+    CS = O.copy()
+    Clearance = buildcoef2d.ChannelClearance(CS, O, bg)
+    assertSameClearance(Clearance, CS, O, bg)
+    
+    #channel parts are removed as the kernel bends them
+    rng = np.random.RandomState(5)
+    for _ in range(0,6):
+        r0 = rng.randint(0,44)
+        c0 = rng.randint(0,36)
+        Clearance.Clear(r0, r0+rng.randint(1,5), c0, c0+rng.randint(1,5))
+    assertSameClearance(Clearance, CS, O, bg)
+
+def loopExtreme(CoefClass, Vanish, ValueChange, Move, Number):
+    #the loop of ExtremeRandomizer: the cells equal to 1 are counted row by row
+    A = CoefClass.Matrix.copy()
+    N0, N1 = np.shape(A)
+    counter = 0
+    for i in range(0,N0):
+        for j in range(0,N1):
+            if A[i][j] == 1:
+                counter += 1
+                if Number.count(counter) == 1:
+                    if Vanish:
+                        A[i][j] = CoefClass.bg
+                    if ValueChange is not None:
+                        A[i][j] = ValueChange
+                    if Move is not None and Move[0]+i > -1 and Move[0]+i < N0 and Move[1]+j > -1 and Move[1]+j < N1:
+                        A[i+Move[0]][j+Move[1]] = A[i][j]
+                        A[i][j] = CoefClass.bg
+    return A
+
+@pytest.mark.parametrize('NWorldFine, Options, NewShapes', Configurations[0:4])
+def test_value_cells_and_extreme_randomizer_equal_loops(NWorldFine, Options, NewShapes):
+    CoefClass = built(NWorldFine, {}, NewShapes, **Options)
+    assert np.array_equal(CoefClass.ValueCells, [i*NWorldFine[1]+j for i in range(0,NWorldFine[0]) 
+                                                 for j in range(0,NWorldFine[1]) if CoefClass.Matrix[i][j] == 1])
+    assert CoefClass.valuecounter == np.size(CoefClass.ValueCells)
+    
+    #every third cell, cells given twice are left out, moves go back to cells counted before
+    Number = list(range(1,CoefClass.valuecounter+1,3)) + [4, 4, 10]
+    for Vanish, ValueChange, Move in [(True, None, None), (False, 0.5, None), (False, None, [-1,0]), 
+                                      (False, None, [0,-1]), (False, 2., [-1,-1]), (True, None, [-2,1])]:
+        Expected = loopExtreme(CoefClass, Vanish, ValueChange, Move, Number)
+        assert np.array_equal(CoefClass.ExtremeRandomizer(Vanish, ValueChange, Move, Number=Number), Expected)
+
+@pytest.mark.parametrize('NWorldFine, Options, NewShapes', [Configurations[k] for k in [0,1,6]])
+def test_composite_perturbation_equals_single_operations(NWorldFine, Options, NewShapes):
+    CoefClass = built(NWorldFine, {}, NewShapes, **Options)
+    n = np.shape(CoefClass.ShapeTable)[0]
+    A = list(range(0,n,3))
+    B = list(range(1,n,4))
+    
+    #single operations against the loops
+    assert np.array_equal(CoefClass.Perturb([['Vanish', A]]), CoefClass.SpecificVanish(Number=A))
+    assert np.array_equal(CoefClass.Perturb([['ValueChange', A, 0.4]]), CoefClass.SpecificValueChange(Number=A, ratio=0.4))
+    assert np.array_equal(CoefClass.Perturb([['Move', B, [1,-1]]]), CoefClass.SpecificMove(Number=B, Right=0, BottomLeft=1))
+    
+    #a sequence against the kernels one after another
+    C = CoefClass.Perturb([['ValueChange', A, 0.4], ['Move', B, [-1,0]], ['ValueChange', B, -0.2]])
+    Changed = CoefClass.ChangedCells
+    CoefClass.SpecificValueChange(Number=A, ratio=0.4, Vectorized=True)
+    CoefClass.SpecificMove(Number=B, Right=0, Top=1, Original=False, Vectorized=True)
+    Expected = CoefClass.SpecificValueChange(Number=B, ratio=-0.2, Original=False, Vectorized=True)
+    assert np.array_equal(C, Expected)
+    assert np.all(np.isin(np.flatnonzero(C != CoefClass.Matrix), Changed))
+
+@pytest.mark.parametrize('Seed', [None, 4])
+def test_cached_coefficient_equals_build(tmp_path, Seed):
+    Cache = str(tmp_path)
+    Options = dict(Configurations[4][1], Seed=Seed)
+    Fresh = built((64,64), {}, **Options)
+    Draws = []
+    for k in range(0,2):
+        #the build leaves np.random alone, python's random continues after the build
+        np.random.seed(1)
+        CoefClass = built((64,64), dict(Cache=Cache), **Options)
+        Draws.append([CoefClass.RandomVanish(probfactor=2), CoefClass.RandomMove(probfactor=2, Vectorized=True), 
+                      CoefClass.Stream().random()])
+        #the first build stores it, the second loads it
+        assert isinstance(CoefClass.Matrix, np.memmap) == (k == 1)
+        assertSameBuild(CoefClass, Fresh)
+        for Name in ['ShapeAnchors', 'ValueCells', 'ShapeTable', 'ShapeLabels']:
+            assert np.array_equal(getattr(CoefClass, Name), getattr(Fresh, Name))
+    for a, b in zip(*Draws):
+        assert np.array_equal(a, b)
+    
+    #the loaded arrays are copy-on-write
+    CoefClass.Matrix[0,0] = 7.
+    assert not np.any(built((64,64), dict(Cache=Cache), **Options).Matrix == 7.)
+    assert len(os.listdir(Cache)) == 1
+    assert CoefClass.CacheKey() != built((64,64), {}, **dict(Options, space=2)).CacheKey()
+
+def test_tiled_coefficient_equals_tile_builds(tmp_path):
+    Options = dict(bg=0.05, val=1, length=3, thick=1, space=1, probfactor=2, right=1, diagl1=1, Seed=[6])
+    Coefficient = buildcoef2d.Coefficient2d(np.array([40,60]), **Options)
+    Tiled = buildcoef2d.TiledCoefficient(Coefficient, [4,5], str(tmp_path.joinpath('a')), TileCoarse=[4,5])
+    
+    #every tile built on its own with its child stream, tiles at the right and bottom are smaller
+    Expected = np.zeros([40,60])
+    for a, (r0, r1) in enumerate([(0,16), (16,32), (32,40)]):
+        for b, (c0, c1) in enumerate([(0,25), (25,50), (50,60)]):
+            Tile = buildcoef2d.Coefficient2d(np.array([r1-r0, c1-c0]), **dict(Options, Seed=[6, 3*a+b]))
+            Expected[r0:r1,c0:c1] = Tile.BuildCoefficient()
+    
+    assert np.array_equal(Tiled.Patch([3,4], [2,3]), Expected[12:20,20:35])
+    assert np.sum(Tiled.Tiles) == 4
+    #gridlod counts [x, y] = [column, row]
+    Local = Tiled.localize([1,2], [6,5])
+    assert np.array_equal(Local.aFine, Expected[8:28,5:35].flatten())
+    assert np.array_equal(Local.localize([2,1], [3,2]).aFine, Expected[12:20,15:30].flatten())
+    assert np.array_equal(Tiled.Patch([0,0], [10,12]), Expected)
+    
+    #the order of the patches does not matter and built tiles are reused
+    Other = buildcoef2d.TiledCoefficient(Coefficient, [4,5], str(tmp_path.joinpath('b')), TileCoarse=[4,5])
+    assert np.array_equal(Other.Patch([9,11], [1,1]), Expected[36:40,55:60])
+    assert np.array_equal(Other.Patch([0,0], [10,12]), Expected)
+    Reused = buildcoef2d.TiledCoefficient(Coefficient, [4,5], str(tmp_path.joinpath('a')), TileCoarse=[4,5])
+    assert np.all(Reused.Tiles == 1)
+    assert np.array_equal(Reused.Patch([0,0], [10,12]), Expected)
+
+@pytest.mark.parametrize('NWorldFine, Options, NewShapes', Configurations[0:4] + Configurations[6:8])
+def test_compact_coefficient_equals_loops(NWorldFine, Options, NewShapes):
+    CoefClass = built(NWorldFine, {}, NewShapes, **Options)
+    n = np.shape(CoefClass.ShapeTable)[0]
+    Plain = CoefClass.Compact(PerShape=False)
+    Compact = CoefClass.Compact()
+    assert Plain.Phases.dtype == np.uint8
+    assert Compact.Phases.dtype == (np.uint8 if n+1 <= 256 else np.uint16)
+    assert np.array_equal(Plain.Expand(), CoefClass.Matrix)
+    assert np.array_equal(Compact.Expand(), CoefClass.Matrix)
+    assert Plain.Equals(Compact) and Plain.Hash() == Compact.Hash()
+    
+    #value changes of shapes are edits of the table, vanished shapes are cells assigned to bg
+    Shapes = list(range(0,n,4))
+    Compact.ChangeShapes(Shapes, 0.3*CoefClass.val)
+    assert np.array_equal(Compact.Expand(), CoefClass.SpecificValueChange(Number=Shapes, ratio=0.3))
+    Compact = CoefClass.Compact()
+    Compact.Assign(np.flatnonzero(np.isin(CoefClass.ShapeLabels, Shapes)), CoefClass.bg)
+    assert np.array_equal(Compact.Expand(), CoefClass.SpecificVanish(Number=Shapes))
+    assert Compact.Equals(CoefClass.Compact(Original=False, PerShape=False))
+    assert not Compact.Equals(Plain) and Compact.Hash() != Plain.Hash()
+
+def assertSamePyramid(Pyramid, C, NCoarseElement):
+    #every node of level l holds the cells of its 2^l x 2^l coarse elements
+    for l in range(0,len(Pyramid.Min)):
+        n0, n1 = NCoarseElement[0]*2**l, NCoarseElement[1]*2**l
+        for a in range(0,np.shape(Pyramid.Min[l])[0]):
+            for b in range(0,np.shape(Pyramid.Min[l])[1]):
+                Cells = C[a*n0:(a+1)*n0,b*n1:(b+1)*n1]
+                assert Pyramid.Min[l][a,b] == Cells.min()
+                assert Pyramid.Max[l][a,b] == Cells.max()
+                assert np.isclose(Pyramid.Sum[l][a,b], Cells.sum(), rtol=1e-13)
+                assert np.isclose(Pyramid.InvSum[l][a,b], (1./Cells).sum(), rtol=1e-13)
+                assert Pyramid.Count[l][a,b] == np.size(Cells)
+    assert np.shape(Pyramid.Min[-1]) == (1,1)
+
+def test_statistics_pyramid_follows_perturbations():
+    CoefClass = built((60,64), {}, **Configurations[3][1])
+    Pyramid = CoefClass.CoarseStatistics([4,8])
+    assertSamePyramid(Pyramid, CoefClass.Matrix, [4,8])
+    n = np.shape(CoefClass.ShapeTable)[0]
+    Perturbations = [lambda: CoefClass.RandomVanish(probfactor=3, Vectorized=True),
+                     lambda: CoefClass.RandomValueChange(probfactor=2, ratio=0.5, Original=False, Vectorized=True),
+                     lambda: CoefClass.RandomMove(probfactor=2, Original=False, Vectorized=True),
+                     lambda: CoefClass.RandomVanish(probfactor=3),
+                     lambda: CoefClass.Perturb([['Move', range(0,n,2), [1,0]], ['ValueChange', None, 0.2]]),
+                     lambda: CoefClass.SpecificMove(Number=[3,8], Original=False, Vectorized=True),
+                     lambda: CoefClass.ExtremeRandomizer(Number=list(range(1,300,5)), Original=False)]
+    for Perturbation in Perturbations:
+        Perturbation()
+        Pyramid = CoefClass.CoarseStatistics()
+        Fresh = buildcoef2d.StatisticsPyramid(CoefClass.RandomMatrix, [4,8])
+        for Level, FreshLevel in zip([Pyramid.Min, Pyramid.Max, Pyramid.Sum, Pyramid.InvSum, Pyramid.Count], 
+                                     [Fresh.Min, Fresh.Max, Fresh.Sum, Fresh.InvSum, Fresh.Count]):
+            for X, Y in zip(Level, FreshLevel):
+                assert np.allclose(X, Y, rtol=1e-13, atol=0)
+        assertSamePyramid(Pyramid, CoefClass.RandomMatrix, [4,8])
+
+@pytest.mark.parametrize('Covariance, CorrelationLength', [('Exponential', 0.3), ('Gaussian', 0.15)])
+def test_gaussian_field_has_the_covariance(Covariance, CorrelationLength):
+    Field = buildcoef2d.GaussianCoefficient2d([6,5], CorrelationLength=CorrelationLength, Variance=2., 
+                                             Covariance=Covariance, Seed=1)
+    Sqrt = Field.Embedding()
+    n = np.size(Sqrt)
+    #the field is Y = Re(F S Z) for the 2d DFT F, S = diag(Sqrt) and complex normal Z, so its covariance is Re(F S S F^H)
+    F = np.fft.fft2(np.eye(n).reshape((n,) + tuple(Field.EmbeddingSize)), axes=(-2,-1)).reshape(n,n).T
+    Inside = np.ravel_multi_index(np.nonzero(np.ones((6,5))), tuple(Field.EmbeddingSize))
+    FS = F[Inside] * Sqrt.ravel()
+    rows, cols = np.nonzero(np.ones((6,5)))
+    Distance = np.hypot((rows[:,None]-rows[None,:])/6., (cols[:,None]-cols[None,:])/5.)
+    assert np.allclose(np.dot(FS, FS.conj().T).real, Field.CovarianceFunction(Distance), rtol=1e-10, atol=1e-12)
+
+def test_gaussian_samples_do_not_depend_on_chunks():
+    Field = buildcoef2d.GaussianCoefficient2d([20,24], CorrelationLength=0.2, Seed=[3,1])
+    Samples = Field.SampleCoefficients(7)
+    assert np.shape(Samples) == (7,20,24)
+    assert np.array_equal(np.concatenate(list(Field.SampleCoefficients(7, Chunk=3))), Samples)
+    assert np.array_equal(Field.SampleCoefficients(3, First=3), Samples[3:6])
+    assert np.array_equal(Field.BuildCoefficient(), Samples[0])
+    
+    Phases = buildcoef2d.GaussianCoefficient2d([20,24], CorrelationLength=0.2, Threshold=0.5, bg=0.1, val=2., Seed=[3,1])
+    assert np.array_equal(Phases.SampleCoefficients(7), np.where(np.log(Samples) > 0.5, 2., 0.1))
+
+@pytest.mark.parametrize('Kind, Options', Samplings)
+def test_perturbation_stream_equals_samples(Kind, Options):
+    CoefClass = built((64,64), {}, **Configurations[3][1])
+    Samples = CoefClass.SampleCoefficients(5, Kind, First=2, **Options)
+    Views = []
+    for k, (Sample, C, Delta, Meta) in enumerate(CoefClass.PerturbationStream(5, Kind, First=2, Boxes=True, **Options)):
+        assert Sample == k+2
+        assert not C.flags.writeable
+        assert np.array_equal(C, Samples[k])
+        Expected = CoefClass.DeltaOf(CoefClass.Matrix, Samples[k])
+        for a, b in zip(Delta, Expected):
+            assert np.array_equal(a, b)
+        assert Meta['Cells'] == np.size(Expected[0])
+        if Kind == 'Move':
+            Child = CoefClass.Spawn(Sample)
+            Child.RandomMove(Vectorized=True, **Options)
+            assert Meta['Failures'] == Child.nomore
+        Views.append(C)
+    #one buffer for all samples
+    assert all(np.shares_memory(View, Views[0]) for View in Views)
+    
+    #without a seed the samples are the single calls one after another
+    CoefClass = built((64,64), {}, **dict(Configurations[3][1], Seed=None))
+    np.random.seed(2)
+    Stream = CoefClass.PerturbationStream(None, Kind, **Options)
+    Streamed = [next(Stream)[1].copy() for k in range(0,4)]
+    np.random.seed(2)
+    for C in Streamed:
+        assert np.array_equal(C, getattr(CoefClass, 'Random' + Kind)(Vectorized=True, **Options))
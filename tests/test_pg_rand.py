@@ -0,0 +1,269 @@
+# This file is part of the master thesis "Variational crimes in the Localized orthogonal decomposition method":
+#   https://github.com/TiKeil/Masterthesis-LOD.git
+# Copyright holder: Tim Keil 
+# License: BSD 2-Clause License (http://opensource.org/licenses/BSD-2-Clause)
+
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import conftest
+import pg_rand
+
+needsStub = pytest.mark.skipif(not conftest.STUB_GRIDLOD, reason='uses the gridlod stub')
+
+class StubCorrector:
+    '''
+    element corrector with the patch of an element for k layers
+    '''
+    def __init__(self, world, TInd, k=1, rng=None):
+        iElement = conftest.convertpIndexToCoordinate(world.NWorldCoarse-1, TInd)
+        self.iPatchWorldCoarse = np.maximum(iElement-k, 0)
+        self.NPatchCoarse = np.minimum(iElement+k+1, world.NWorldCoarse) - self.iPatchWorldCoarse
+        self.fsi = types.SimpleNamespace()
+        if rng is not None:
+            NpPatchFine = np.prod(self.NPatchCoarse*world.NCoarseElement+1)
+            self.fsi.correctorsList = [0.1*rng.standard_normal(NpPatchFine) for _ in range(4)]
+
+def stubLOD(NWorldCoarse=[4,3], NCoarseElement=[2,2], rng=None):
+    world = types.SimpleNamespace(NWorldCoarse=np.array(NWorldCoarse), NCoarseElement=np.array(NCoarseElement))
+    pglod = pg_rand.VcPetrovGalerkinLOD(None, world, 1, None)
+    pglod.ecListOrigin = [StubCorrector(world, TInd, rng=rng) for TInd in range(np.prod(world.NWorldCoarse))]
+    pglod.ecList = pg_rand.CorrectorStore(pglod.ecListOrigin)
+    pglod.ecListtesting = pg_rand.CorrectorStore(pglod.ecListOrigin)
+    return pglod
+
+
+def test_corrector_store_snapshot_is_copy_on_write():
+    origin = ['a', 'b', 'c', 'd']
+    store = pg_rand.CorrectorStore(origin)
+    snapshot = store.snapshot()
+    snapshot[1] = 'X'
+    later = snapshot.snapshot()
+    later[2] = None
+    snapshot[3] = 'Y'
+    
+    assert list(store) == ['a', 'b', 'c', 'd']
+    assert list(snapshot) == ['a', 'X', 'c', 'Y']
+    assert list(later) == ['a', 'X', None, 'd']
+    assert origin == ['a', 'b', 'c', 'd']
+    assert len(later) == 4
+
+def test_corrector_store_shares_unchanged_correctors():
+    origin = [object() for _ in range(3)]
+    store = pg_rand.CorrectorStore(origin).snapshot()
+    store[0] = object()
+    assert store[0] is not origin[0]
+    assert all(store[i] is origin[i] for i in [1, 2])
+
+@needsStub
+def test_testing_flow_recomputes_and_rolls_back():
+    pglod = stubLOD()
+    origin = list(pglod.ecListOrigin)
+    pglod.epsilonList = [0.5, 2., 0.1, 3.] + [0.]*8
+    
+    pglod.updateCorrectors(None, 1., None, Testing=True)
+    
+    recomputed = [TInd for TInd, ecT in enumerate(pglod.ecListtesting) if ecT is not origin[TInd]]
+    assert recomputed == [1, 3]
+    assert pglod.ecListtesting[3] == ('recomputed', 3)
+    assert pglod.ecListOrigin == origin
+    assert pglod.epsilonList[1] == 0 and pglod.epsilonList[3] == 0
+    
+    #the next test starts from the updated correctors without changing them
+    pglod.epsilonList[5] = 4.
+    first = pglod.ecListtesting
+    pglod.updateCorrectors(None, 1., None, Testing=True)
+    assert [ecT is origin[TInd] for TInd, ecT in enumerate(first)] == [TInd not in [1, 3] for TInd in range(12)]
+    assert pglod.ecListtesting[5] == ('recomputed', 5) and pglod.ecListtesting[1] == ('recomputed', 1)
+    
+    pglod.CorrectorsToOrigin()
+    assert all(ecT is origin[TInd] for TInd, ecT in enumerate(pglod.ecListtesting))
+
+def Q1World(NWorldCoarse, NCoarseElement):
+    '''
+    stub world with the Q1 element matrix of the fine elements and the coarse basis on an element
+    '''
+    world = types.SimpleNamespace(NWorldCoarse=np.array(NWorldCoarse), NCoarseElement=np.array(NCoarseElement))
+    hx, hy = 1./(world.NWorldCoarse*world.NCoarseElement)
+    signs = [(-1,-1), (1,-1), (-1,1), (1,1)]
+    world.ALocFine = np.array([[a*c*hy/hx*(1/3. if b == d else 1/6.) + b*d*hx/hy*(1/3. if a == c else 1/6.) 
+                                for (c, d) in signs] for (a, b) in signs])
+    x, y = np.meshgrid(np.linspace(0, 1, NCoarseElement[0]+1), np.linspace(0, 1, NCoarseElement[1]+1))
+    x = x.ravel()
+    y = y.ravel()
+    world.localBasis = np.column_stack([(1-x)*(1-y), x*(1-y), (1-x)*y, x*y])
+    return world
+
+def stubIndicatorLOD(rng):
+    world = Q1World([5,4], [3,3])
+    pglod = pg_rand.VcPetrovGalerkinLOD(None, world, 1, None)
+    pglod.ecListOrigin = [StubCorrector(world, TInd, rng=rng) for TInd in range(20)]
+    NtFine = np.prod(world.NWorldCoarse*world.NCoarseElement)
+    pglod.origincoef = types.SimpleNamespace(aFine=np.exp(rng.standard_normal(NtFine)))
+    aNew = pglod.origincoef.aFine.copy()
+    aNew[rng.choice(NtFine, 12)] *= 3
+    return pglod, types.SimpleNamespace(aFine=aNew)
+
+@needsStub
+def test_batch_indicator_has_the_closed_form_of_scaled_correctors():
+    #aOld = a0, aNew = c on the cells of T only and the correctors s times the coarse basis on T: 
+    #only T counts, there chi_T w - Q_T w = (1-s) w and epsilon_T = |1-s| |a0-c| / sqrt(a0 c) for all w
+    world = Q1World([5,4], [3,3])
+    NWorldFine = world.NWorldCoarse*world.NCoarseElement
+    pglod = pg_rand.VcPetrovGalerkinLOD(None, world, 1, None)
+    pglod.ecListOrigin = [StubCorrector(world, TInd) for TInd in range(20)]
+    scale = np.linspace(-0.5, 0.9, 20)
+    for TInd, ecT in enumerate(pglod.ecListOrigin):
+        NPatchFine = ecT.NPatchCoarse*world.NCoarseElement
+        iElementPatchFine = (conftest.convertpIndexToCoordinate(world.NWorldCoarse-1, TInd) - ecT.iPatchWorldCoarse)*world.NCoarseElement
+        nodes = [conftest.convertpCoordinateToIndex(NPatchFine, iElementPatchFine + [x, y]) 
+                 for y in range(world.NCoarseElement[1]+1) for x in range(world.NCoarseElement[0]+1)]
+        ecT.fsi.correctorsList = [np.zeros(np.prod(NPatchFine+1)) for _ in range(4)]
+        for i in range(4):
+            ecT.fsi.correctorsList[i][nodes] = scale[TInd]*world.localBasis[:,i]
+    a0 = 2.
+    pglod.origincoef = types.SimpleNamespace(aFine=np.full(np.prod(NWorldFine), a0))
+    
+    for TInd, c in [(0, 0.5), (7, 3.), (13, 0.1), (19, 1.5)]:
+        iElement = conftest.convertpIndexToCoordinate(world.NWorldCoarse-1, TInd)
+        cells = [conftest.convertpCoordinateToIndex(NWorldFine-1, iElement*world.NCoarseElement + [x, y]) 
+                 for y in range(world.NCoarseElement[1]) for x in range(world.NCoarseElement[0])]
+        aNew = np.full(np.prod(NWorldFine), a0)
+        aNew[cells] = c
+        epsilon = pglod.errorIndicatorBatch(types.SimpleNamespace(aFine=aNew))
+        assert np.isclose(epsilon[TInd], abs(1-scale[TInd])*abs(a0-c)/np.sqrt(a0*c), rtol=1e-12)
+
+@needsStub
+def test_batch_indicator_chunks_and_shares_the_correctors():
+    pglod, coefficient = stubIndicatorLOD(np.random.RandomState(1))
+    epsilon = pglod.errorIndicatorBatch(coefficient)
+    
+    #chunks of single elements give the same
+    single = pg_rand.groupErrorIndicators(pglod.indicatorGroups(), pglod.world.ALocFine, 
+                                          pglod.origincoef.aFine, coefficient.aFine, chunkBytes=1)
+    assert np.allclose(epsilon[single[0]], single[1], rtol=1e-12, atol=0)
+    
+    #the groups reference the correctors instead of copying them
+    for group in pglod.indicatorGroups():
+        for TInd, correctors in zip(group[0], group[6]):
+            assert correctors is pglod.ecListOrigin[TInd].fsi.correctorsList
+
+@pytest.mark.skipif(conftest.STUB_GRIDLOD, reason='needs gridlod')
+def test_batch_indicator_matches_computeErrorIndicatorFine():
+    from gridlod import interp, coef
+    from gridlod.world import World
+    NWorldCoarse = np.array([4,4])
+    NCoarseElement = np.array([4,4])
+    NWorldFine = NWorldCoarse*NCoarseElement
+    boundaryConditions = np.array([[0, 0], [0, 0]])
+    world = World(NWorldCoarse, NCoarseElement, boundaryConditions)
+    IPatchGenerator = lambda i, N: interp.L2ProjectionPatchMatrix(i, N, NWorldCoarse, NCoarseElement, boundaryConditions)
+    
+    rng = np.random.RandomState(0)
+    aBase = np.exp(rng.standard_normal(np.prod(NWorldFine)))
+    aNew = aBase.copy()
+    aNew[rng.choice(np.size(aNew), 10)] *= 5
+    pglod = pg_rand.VcPetrovGalerkinLOD(coef.coefficientFine(NWorldCoarse, NCoarseElement, aBase), world, 1, IPatchGenerator, 0)
+    pglod.originCorrectors(clearFineQuantities=False)
+    
+    coefficient = coef.coefficientFine(NWorldCoarse, NCoarseElement, aNew)
+    reference = np.array(pglod.ErrorIndicator(coefficient))
+    assert np.allclose(pglod.ErrorIndicator(coefficient, Batched=True), reference)
+
+class FakeView:
+    '''
+    direct view on engines that are namespaces in this process
+    '''
+    def __init__(self, n):
+        self.engines = [{} for _ in range(n)]
+    
+    def __len__(self):
+        return len(self.engines)
+    
+    def scatter(self, name, sequence, block=False):
+        bounds = np.linspace(0, len(sequence), len(self)+1).astype(int)
+        for engine, first, last in zip(self.engines, bounds[:-1], bounds[1:]):
+            engine[name] = sequence[first:last]
+    
+    def push(self, variables, block=False):
+        for engine in self.engines:
+            engine.update(variables)
+    
+    def execute(self, code, block=False):
+        for engine in self.engines:
+            exec(code, {}, engine)
+    
+    def apply_sync(self, f, *args):
+        resolve = lambda engine, arg: engine[arg.name] if isinstance(arg, Reference) else arg
+        return [f(*[resolve(engine, arg) for arg in args]) for engine in self.engines]
+
+class Reference:
+    def __init__(self, name):
+        self.name = name
+
+@needsStub
+def test_batch_indicator_instances_share_a_view(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'ipyparallel', types.SimpleNamespace(Reference=Reference))
+    view = FakeView(3)
+    pglodA, coefficientA = stubIndicatorLOD(np.random.RandomState(2))
+    pglodB, coefficientB = stubIndicatorLOD(np.random.RandomState(3))
+    
+    epsilonA = pglodA.errorIndicatorBatch(coefficientA, View=view)
+    epsilonB = pglodB.errorIndicatorBatch(coefficientB, View=view)
+    assert np.allclose(epsilonA, pglodA.errorIndicatorBatch(coefficientA))
+    assert np.allclose(epsilonB, pglodB.errorIndicatorBatch(coefficientB))
+    assert np.array_equal(pglodA.errorIndicatorBatch(coefficientA, View=view), epsilonA)
+    assert pglodA.indicatorName != pglodB.indicatorName
+    
+    #a new origin deletes the old groups on the engines
+    pglodA.originCorrectors()
+    assert pglodA.indicatorView is None
+    assert all(sorted(engine) == sorted(name for name in engine if name.startswith(pglodB.indicatorName)) 
+               for engine in view.engines)
+
+def test_touched_elements_are_the_patches_around_the_changes():
+    pglod = stubLOD([6,4], [4,4])
+    pglod.origincoef = types.SimpleNamespace(aFine=np.ones(24*16))
+    aNew = np.ones(24*16)
+    #fine cell x=13, y=2 lies in the coarse element (3,0)
+    aNew[2*24+13] = 2
+    
+    touched = pglod.touchedElements(types.SimpleNamespace(aFine=aNew))
+    assert list(np.flatnonzero(touched)) == [2, 3, 4, 8, 9, 10]
+    assert pglod.touchedElements(None, Changed=[2*24+13]) == touched
+    assert not any(pglod.touchedElements(None, Changed=[]))
+
+def test_stored_origin_correctors_round_trip(tmp_path):
+    rng = np.random.RandomState(4)
+    #patches large enough that all correctors go to the array file
+    pglod = stubLOD(NCoarseElement=[6,6], rng=rng)
+    pglod.world.boundaryConditions = np.zeros((2,2), dtype=int)
+    pglod.IPatchGenerator = lambda i, N: np.eye(np.prod(N+1))
+    pglod.origincoef = types.SimpleNamespace(aFine=rng.standard_normal(432))
+    #an array shared by two correctors is written once
+    shared = pglod.ecListOrigin[0].fsi.correctorsList[0]
+    pglod.ecListOrigin[1].fsi.correctorsList[0] = shared
+    
+    key = pglod.originKey()
+    assert key != pglod.originKey(clearFineQuantities=False)
+    assert not pglod.loadOriginCorrectors(str(tmp_path), key)
+    folder = pglod.saveOriginCorrectors(str(tmp_path), key)
+    
+    loaded = stubLOD(NCoarseElement=[6,6])
+    assert loaded.loadOriginCorrectors(str(tmp_path), key)
+    distinct = dict((id(a), a) for ecT in pglod.ecListOrigin for a in ecT.fsi.correctorsList).values()
+    size = os.path.getsize(os.path.join(folder, 'Arrays.bin'))
+    assert sum(a.nbytes for a in distinct) <= size < sum(a.nbytes + 64 for a in distinct)
+    
+    for ecT, ecLoaded in zip(pglod.ecListOrigin, loaded.ecListOrigin):
+        assert np.array_equal(ecT.iPatchWorldCoarse, ecLoaded.iPatchWorldCoarse)
+        for a, b in zip(ecT.fsi.correctorsList, ecLoaded.fsi.correctorsList):
+            assert np.array_equal(a, b)
+            assert isinstance(b.base, np.memmap) and not b.flags.writeable
+    first, second = loaded.ecListOrigin[0].fsi.correctorsList[0], loaded.ecListOrigin[1].fsi.correctorsList[0]
+    assert np.shares_memory(first, second)
+    assert loaded.ecList[0] is loaded.ecListOrigin[0]